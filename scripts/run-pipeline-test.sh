@@ -77,7 +77,20 @@ echo "============== PIPELINE TEST =============="
 echo "Starting evanescent server..."
 ${EVANESCENT_PATH}/lldash-relay.exe --port 9000 > $EVANESCENT_OUTPUT 2>&1 &
 SERVER_PID=$!
-sleep 2
+
+# Wait for the server to accept connections (any HTTP response will do)
+SERVER_READY=false
+for i in $(seq 1 100); do
+    if curl -s -o /dev/null http://127.0.0.1:9000/; then
+        SERVER_READY=true
+        break
+    fi
+    sleep 0.1
+done
+if [ "$SERVER_READY" = false ]; then
+    echo "Timed out waiting for evanescent server"
+    exit 1
+fi
 
 # Start cwipc_forward with verbose mode
 echo "Starting cwipc_forward..."
@@ -91,13 +104,13 @@ TIMEOUT=60
 MPD_START_TIME=$(date +%s.%N)
 
 while [ $(echo "$(date +%s.%N) - $MPD_START_TIME < $TIMEOUT" | bc) -eq 1 ]; do
-    if grep -q "Added.*cwpic_lldpkg.mpd" $EVANESCENT_OUTPUT 2>/dev/null; then
+    if curl -sf -o /dev/null http://127.0.0.1:9000/bin2dashSink.mpd; then
         MPD_READY=true
         ELAPSED=$(echo "$(date +%s.%N) - $MPD_START_TIME" | bc)
         echo "MPD file is ready after ${ELAPSED} seconds"
         break
     fi
-    sleep 1
+    sleep 0.1
     echo -n "."
 done
 echo ""
@@ -107,9 +120,6 @@ if [ "$MPD_READY" = false ]; then
     exit 1
 fi
 
-# Wait for MPD to be fully processed
-sleep 3
-
 # Start cwipc_view client
 echo "Starting cwipc_view client..."
 ( cwipc_view --verbose --nodisplay --sub "http://127.0.0.1:9000/bin2dashSink.mpd" > $CLIENT_OUTPUT 2>&1 ) &
@@ -1,3 +1,4 @@
+import sys
 import matplotlib.pyplot as plt
 
 # Your list of numbers
@@ -377,6 +378,12 @@ all_receiver_latencies = [
         0.128,
 ]
 
+if len(sys.argv) > 1:
+    # Plot the latencies from a receiver statistics log (testlatency_receiver.stats in --logdir) in stead
+    from testlatency_statlog import StatisticsLogReader
+    from testlatency_receiver import ReceiverStatistics
+    all_receiver_latencies = [rs.receiver_wallclock - rs.timestamp / 1000.0 for rs in StatisticsLogReader(sys.argv[1], ReceiverStatistics)]
+
 # Create the plot
 plt.plot(all_receiver_latencies)
 plt.xlabel('Index')
@@ -1,19 +1,36 @@
 import sys
 import argparse
+import asyncio
+import copy
 import time
 import os
-from testlatency_server import ServerThread
-from testlatency_sender import SenderThread
-from testlatency_receiver import ReceiverThread
-from testlatency_analyse import Analyser
+from testlatency_server import ServerThread, free_port
+from testlatency_sender import SenderThread, SenderStatistics
+from testlatency_receiver import ReceiverThread, ReceiverStatistics
+from testlatency_analyse import analyse
+from testlatency_sessions import Session, analyse_sessions, write_results
+from testlatency_probes import StageStatistics
+from testlatency_statlog import StatisticsLogReader, statistics_log_path
+from testlatency_publisher import SegmentPublisher, saturation_point
+from testlatency_httpbench import HttpBenchThread, print_httpbench
+from testlatency_metrics import MetricsServer, enable_live_metrics
+from testlatency_clocksync import ClockSyncServer, estimate_offset, combine_offsets, save_clock_offset, load_clock_offset, print_clock_offset, CLOCKSYNC_FILENAME
+from testlatency_collector import StatisticsCollector, parse_address, send_document
+from testlatency_fanout import analyse_fanout
+from testlatency_bandwidth import analyse_bandwidth, print_bandwidth, load_stream_variants
+from testlatency_switches import SwitchStatistics, analyse_switches, print_switches
+from testlatency_shaper import start_shaper, print_shaper
+from testlatency_viewport import analyse_viewport, print_viewport
+from testlatency_tiles import analyse_tiles, print_tiles
+from testlatency_resources import ResourceSampler, have_proc, warn_no_proc, capacity, print_resources
 
 def main():
     parser = argparse.ArgumentParser(description="Test latency of CWIPC.")
     parser.add_argument(
         "--mode",
-        choices=["server", "sender", "receiver", "all"],
+        choices=["server", "sender", "receiver", "all", "analyse", "publish", "collect"],
         default="all",
-        help="Mode to run the script in: server, sender, or receiver. Default: all",
+        help="Mode to run the script in: server, sender, or receiver, or analyse the statistics logs in --logdir of an earlier run, or publish synthetic segments straight to the relay, or collect statistics from --collector senders and receivers into --logdir. Default: all",
     )
     parser.add_argument(
         "--fps",
@@ -35,6 +52,39 @@ def main():
         action="store_true", 
         help="Use tiled streams"
     )
+    parser.add_argument(
+        "--tiles",
+        type=int,
+        default=0,
+        metavar="N",
+        help="With --tiled, publish only the first N tiles of the synthetic source (default: all)",
+    )
+    parser.add_argument(
+        "--decode-pool",
+        action="store_true",
+        help="Decode the tiles of a tiled stream on one shared pool of --decode-workers threads, in stead of one decoder thread per tile",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Number of decode threads for --decode-pool (default: number of available cores)",
+    )
+    parser.add_argument(
+        "--decode-queue",
+        type=int,
+        default=2,
+        metavar="N",
+        help="With --decode-pool, per tile at most N buffers in decoding or waiting for the synchronizer before fetching stops (default: 2)",
+    )
+    parser.add_argument(
+        "--ready-poll",
+        type=float,
+        default=0,
+        metavar="MS",
+        help="For tiled streams without --decode-pool, poll the tile decoders every MS milliseconds for when each tile was ready, in stead of taking the time the synchronizer first saw it available. Adds a polling thread to the receiver (default: off)",
+    )
     parser.add_argument(
         "--octree_bits", 
         action="append", 
@@ -60,6 +110,164 @@ def main():
         metavar="S",
         help="Switch receiver quality every S seconds"
     )
+    parser.add_argument(
+        "--abr",
+        choices=["off", "roundrobin", "throughput", "viewport"],
+        default="off",
+        help="Receiver quality selection for tiled streams: fixed, the next quality every --switch-interval seconds, adapted to measured throughput, decoder queue depth and latency drift, or highest for the tiles facing the viewer and lowest for the others (default: off, roundrobin with --switch-interval)"
+    )
+    parser.add_argument(
+        "--viewport-trajectory",
+        type=str,
+        default="",
+        metavar="FILE",
+        help="With --abr viewport, CSV file of time,x,y,z viewer positions relative to the point cloud (default: orbit)"
+    )
+    parser.add_argument(
+        "--viewport-orbit",
+        type=float,
+        default=10,
+        metavar="S",
+        help="With --abr viewport and no trajectory, the viewer circles the point cloud once every S seconds (default: 10)"
+    )
+    parser.add_argument(
+        "--viewport-angle",
+        type=float,
+        default=90,
+        metavar="DEG",
+        help="With --abr viewport, a tile faces the viewer when its normal is less than DEG degrees from the direction to the viewer (default: 90)"
+    )
+    parser.add_argument(
+        "--shape-rate",
+        type=float,
+        default=0,
+        metavar="MBPS",
+        help="Receivers reach the relay through a local proxy that limits the relay to receiver traffic to MBPS megabits per second, shared by all receivers, to simulate a constrained link (default: off)"
+    )
+    parser.add_argument(
+        "--shape-burst",
+        type=int,
+        default=65536,
+        metavar="BYTES",
+        help="With --shape-rate, token bucket size, at least 1 (default: 65536)"
+    )
+    parser.add_argument(
+        "--senders",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of concurrent publishing sessions, each with its own MPD and its own --receivers (default: 1)",
+    )
+    parser.add_argument(
+        "--hot-session-npoints",
+        type=int,
+        default=0,
+        metavar="N",
+        help="With --senders, let session 0 send N points per frame, to see if one heavy session starves the others",
+    )
+    parser.add_argument(
+        "--receivers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of concurrent receivers pulling the same stream (default: 1). More than one runs them in a process pool.",
+    )
+    parser.add_argument(
+        "--receiver-processes",
+        type=int,
+        default=0,
+        metavar="P",
+        help="Number of worker processes for --receivers (default: number of cores)",
+    )
+    parser.add_argument(
+        "--receiver-ramp",
+        type=float,
+        default=0,
+        metavar="S",
+        help="Start the --receivers one by one, S seconds apart, to see latency scale with viewer count (default: all at once)",
+    )
+    parser.add_argument(
+        "--isolation",
+        choices=["thread", "process"],
+        default="thread",
+        help="In --mode all, run sender and receiver as threads in this process, or each in its own process so they do not contend for the GIL. Statistics come back through the statistics logs. Live --metrics-port metrics are not available with process. (default: thread)",
+    )
+    parser.add_argument(
+        "--joins",
+        type=int,
+        default=0,
+        metavar="N",
+        help="In stead of one receiver for the whole run, let N receivers join the stream one after the other and report tune-in, first frame and convergence times. Make --duration long enough.",
+    )
+    parser.add_argument(
+        "--join-duration",
+        type=float,
+        default=5,
+        metavar="S",
+        help="With --joins, every receiver stays S seconds (default: 5)",
+    )
+    parser.add_argument(
+        "--join-interval",
+        type=float,
+        default=1,
+        metavar="S",
+        help="With --joins, wait S seconds between leaving and the next join (default: 1)",
+    )
+    parser.add_argument(
+        "--http-clients",
+        type=int,
+        default=0,
+        metavar="N",
+        help="In stead of cwipc receivers, run N lightweight asyncio HTTP clients that only pull segments from the relay (relay-only benchmark)",
+    )
+    parser.add_argument(
+        "--http-poll-interval",
+        type=float,
+        default=0.05,
+        metavar="S",
+        help="With --http-clients, retry not yet published MPDs and segments after S seconds (default: 0.05, not used for segments with --long-poll)",
+    )
+    parser.add_argument(
+        "--publish-rates",
+        type=lambda s: [float(r) for r in s.split(",")],
+        default=[10.0],
+        metavar="R,R,...",
+        help="With --mode publish, upload R segments per second, one step of --publish-step-duration per rate (default: 10)",
+    )
+    parser.add_argument(
+        "--publish-step-duration",
+        type=float,
+        default=10,
+        metavar="S",
+        help="With --mode publish, duration of every rate step in seconds (default: 10)",
+    )
+    parser.add_argument(
+        "--publish-size",
+        type=int,
+        default=100000,
+        metavar="BYTES",
+        help="With --mode publish, size of synthetic segments (default: 100000)",
+    )
+    parser.add_argument(
+        "--publish-dir",
+        type=str,
+        default="",
+        metavar="DIR",
+        help="With --mode publish, upload the prerecorded segment files in DIR (cycled) in stead of synthetic segments",
+    )
+    parser.add_argument(
+        "--publish-connections",
+        type=int,
+        default=4,
+        metavar="N",
+        help="With --mode publish, number of persistent upload connections (default: 4)",
+    )
+    parser.add_argument(
+        "--publish-method",
+        choices=["PUT", "POST"],
+        default="PUT",
+        help="With --mode publish, HTTP method for uploads (default: PUT)",
+    )
     parser.add_argument(
         "--synchronizer", 
         action="store_true", 
@@ -74,13 +282,19 @@ def main():
     parser.add_argument(
         "--all_latencies",
         action="store_true",
-        help="Don't ignore initial and final latencies in the analysis.",
+        help="Don't ignore the warm-up latencies in the analysis.",
     )
     parser.add_argument(
         "--print-latencies",
         action="store_true",
         help="Print all receiver latencies"
     )
+    parser.add_argument(
+        "--analyser",
+        choices=["dict", "numpy"],
+        default="dict",
+        help="Analysis engine: per-frame dictionaries or vectorized NumPy (faster for long runs). Default: dict",
+    )
     parser.add_argument(
         "--seg_dur",
         type=int,
@@ -93,6 +307,33 @@ def main():
         default="localhost",
         help="Host address for the server.",
     )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=9000,
+        help="Port for the relay server, 0 to pick a free port so several tests can run concurrently. Default is 9000.",
+    )
+    parser.add_argument(
+        "--clock-sync-port",
+        type=int,
+        default=0,
+        metavar="PORT",
+        help="For sender and receiver on different hosts: the sender answers clock sync requests on UDP port PORT, the receiver uses them to estimate the clock offset (default: off)",
+    )
+    parser.add_argument(
+        "--clock-sync-host",
+        type=str,
+        default="127.0.0.1",
+        metavar="HOST",
+        help="With --clock-sync-port, the host the sender runs on (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--clock-sync-linger",
+        type=float,
+        default=30,
+        metavar="S",
+        help="With --clock-sync-port, the sender keeps answering for at most S seconds after the stream has ended, for the end estimate of the receiver (default: 30)",
+    )
     parser.add_argument(
         "--long-poll",
         type=int,
@@ -102,16 +343,65 @@ def main():
     parser.add_argument(
         "--sender-delay",
         type=float,
-        default=1,
+        default=0,
         metavar="S",
-        help="Wait S seconds after starting the server before starting the sender (default: 1)"
+        help="Wait S extra seconds after the server listens before starting the sender (default: 0)"
     )
     parser.add_argument(
         "--receiver-delay",
         type=float,
+        default=0,
+        metavar="S",
+        help="Wait S extra seconds after the sender has published the MPD before starting the receiver (default: 0)"
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=30,
+        metavar="S",
+        help="Give up when the server does not listen, or the sender does not publish the MPD, within S seconds (default: 30)"
+    )
+    parser.add_argument(
+        "--resource-interval",
+        type=float,
         default=1,
         metavar="S",
-        help="Wait S seconds after starting the sender before starting the receiver (default: 1)"
+        help="In --mode all, sample CPU, memory and I/O of the relay, sender and receivers from /proc every S seconds and report them per stream and per viewer, 0 to disable (default: 1)"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        metavar="PORT",
+        help="Serve live rolling-window metrics in Prometheus text format on http://HOST:PORT/metrics during the run (default: off)"
+    )
+    parser.add_argument(
+        "--metrics-host",
+        type=str,
+        default="127.0.0.1",
+        metavar="HOST",
+        help="Address to serve --metrics-port on, 0.0.0.0 for all interfaces: anyone who can reach it can read the metrics, which are read-only (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--metrics-window",
+        type=float,
+        default=10,
+        metavar="S",
+        help="Window for the live metrics in seconds (default: 10)"
+    )
+    parser.add_argument(
+        "--abort-latency",
+        type=float,
+        default=0,
+        metavar="S",
+        help="Abort the run early when the live p99 latency exceeds S seconds (default: never)"
+    )
+    parser.add_argument(
+        "--abort-loss",
+        type=float,
+        default=0,
+        metavar="F",
+        help="Abort the run early when the live fraction of lost frames exceeds F (default: never)"
     )
     parser.add_argument(
         "--verbose",
@@ -127,7 +417,42 @@ def main():
         "--logdir",
         type=str,
         default="",
-        help="Directory to store log files. Default: on stdout and stderr",
+        help="Directory to store log files and binary statistics logs. Default: on stdout and stderr, statistics in memory",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        default="",
+        metavar="FILE",
+        help="Also write the analysis results and throughput as JSON to FILE (used by testlatency_sweep.py)",
+    )
+    parser.add_argument(
+        "--collector",
+        type=str,
+        default="",
+        metavar="HOST:PORT",
+        help="Stream statistics to a --mode collect process at HOST:PORT, for sender and receiver processes or hosts without a shared --logdir. With --mode collect: listen on PORT.",
+    )
+    parser.add_argument(
+        "--collector-host",
+        type=str,
+        default="127.0.0.1",
+        metavar="HOST",
+        help="With --mode collect, address to listen on, 0.0.0.0 for senders and receivers on other hosts: anyone who can reach it can write into --logdir (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--sender-logdir",
+        type=str,
+        default="",
+        metavar="DIR",
+        help="With --mode analyse, read the sender statistics from DIR (default: --logdir)",
+    )
+    parser.add_argument(
+        "--receiver-logdir",
+        type=str,
+        default="",
+        metavar="DIR",
+        help="With --mode analyse, read the receiver statistics and clock offset from DIR (default: --logdir)",
     )
     parser.add_argument(
         "--debugpy",
@@ -152,35 +477,107 @@ def main():
     if args.logdir:
         if not os.path.exists(args.logdir):
             os.makedirs(args.logdir)
+    if args.shape_burst < 1:
+        print("testlatency: --shape-burst must be at least 1 byte", file=sys.stderr)
+        return 2
+    if args.port == 0:
+        if args.mode != "all" and args.mode != "publish":
+            print("testlatency: --port 0 only works with --mode all or publish, other modes must agree on a port", file=sys.stderr)
+            return 2
+        args.port = free_port()
+        if args.verbose:
+            print(f"testlatency: using port {args.port}", file=sys.stderr)
     if args.mode == "server":
         ServerThread(args).run()
     elif args.mode == "sender":
+        clock_sync_server = None
+        if args.clock_sync_port:
+            clock_sync_server = ClockSyncServer(args.clock_sync_port)
+            clock_sync_server.start()
         SenderThread(args).run()
+        if clock_sync_server:
+            # For the end estimate of the receiver, which only starts once it has seen the end of the stream
+            clock_sync_server.linger(args.clock_sync_linger)
     elif args.mode == "receiver":
-        ReceiverThread(args).run()
+        clock_offset_before = None
+        if args.clock_sync_port:
+            clock_offset_before = estimate_offset(args.clock_sync_host, args.clock_sync_port)
+            print_clock_offset("start", clock_offset_before)
+        receiver_args = args
+        shaper = start_shaper(args)
+        if shaper:
+            receiver_args = copy.copy(args)
+            receiver_args.port = shaper.listen_port
+        receiver_start = time.time()
+        ReceiverThread(receiver_args).run()
+        if shaper:
+            shaper.stop()
+            print_shaper(shaper, time.time() - receiver_start)
+        if args.clock_sync_port:
+            clock_offset_after = estimate_offset(args.clock_sync_host, args.clock_sync_port, done=True)
+            print_clock_offset("end", clock_offset_after)
+            clock_offset = combine_offsets(clock_offset_before, clock_offset_after)
+            # For --mode analyse
+            if clock_offset and args.collector:
+                send_document(args.collector, CLOCKSYNC_FILENAME, clock_offset._asdict())
+            elif clock_offset and args.logdir:
+                save_clock_offset(args.logdir, clock_offset)
     elif args.mode == "all":
         server_thread = ServerThread(args)
-        sender_thread = SenderThread(args)
-        receiver_thread = ReceiverThread(args)
+        metrics_server = None
+        if args.metrics_port or args.abort_latency or args.abort_loss:
+            # Before creating the sessions, so their threads report to the live metrics
+            metrics = enable_live_metrics(args.metrics_window)
+            def abort(reason : str) -> None:
+                for session in sessions:
+                    session.sender_thread.stop()
+                    session.receiver_thread.stop()
+            metrics_server = MetricsServer(metrics, args.metrics_port, abort, args.abort_latency, args.abort_loss, args.metrics_host)
+        shaper = start_shaper(args)
+        sessions = [Session(args, session, shaper.listen_port if shaper else None) for session in range(args.senders)]
+        run_start = time.time()
+        if metrics_server:
+            metrics_server.start()
+        sampler = None
+        if args.resource_interval > 0:
+            if have_proc():
+                sampler = ResourceSampler(args.resource_interval)
+                sampler.add_side("relay", lambda: [(server_thread.process.pid, None)] if server_thread.process else [])
+                sampler.add_side("sender", lambda: [target for session in sessions for target in session.sender_targets()])
+                sampler.add_side("receiver", lambda: [target for session in sessions for target in session.receiver_targets()])
+                # All of this process, including the native encoder and decoder threads
+                sampler.add_side("testlatency", lambda: [(os.getpid(), None)])
+            elif args.verbose:
+                warn_no_proc()
         if args.debug:
             print("testlatency: Starting server and sender threads...", file=sys.stderr)
         server_thread.start()
+        if sampler:
+            sampler.start()
         #
-        # Wait for a short while, so the server has had a chancce to start.
+        # Start every stage as soon as the previous one is ready: the relay listens, then
+        # the sender has published its MPD. The delays are optional extra waits.
         #
+        ok = True
+        if not server_thread.wait_listening(args.startup_timeout):
+            print(f"testlatency: Server is not listening on port {args.port}", file=sys.stderr)
+            ok = False
         time.sleep(args.sender_delay)
-        sender_thread.start()
-        #
-        # Wait another short while, so we know we can start the receiver.
-        #
+        if ok:
+            for session in sessions:
+                session.start_sender()
+            for session in sessions:
+                if not session.wait_mpd(args.startup_timeout):
+                    print(f"testlatency: Sender {session.session} did not publish {session.url}", file=sys.stderr)
+                    ok = False
         time.sleep(args.receiver_delay)
         #
         # Check that the sender and server thread are still alive
         #
-        ok = True
-        if not sender_thread.is_alive():
-            print("testlatency: Sender thread appears to have stopped", file=sys.stderr)
-            ok = False
+        for session in sessions:
+            if session.sender_start_time is not None and not session.sender_thread.is_alive():
+                print(f"testlatency: Sender thread {session.session} appears to have stopped", file=sys.stderr)
+                ok = False
         if not server_thread.is_alive():
             print("testlatency: Server thread appears to have stopped", file=sys.stderr)
             ok = False
@@ -190,21 +587,30 @@ def main():
         if ok:
             if args.debug:
                 print("testlatency: Starting receiver thread...", file=sys.stderr)
-            receiver_thread.start()
+            for session in sessions:
+                session.start_receiver()
         else:
             print("testlatency: Skip receiver thread start, stop sender and server threads", file=sys.stderr)
-            sender_thread.stop()
-            receiver_thread.stop()
+            for session in sessions:
+                session.sender_thread.stop()
+                session.receiver_thread.stop()
         if args.debug:
             print("testlatency: Waiting for threads to finish...", file=sys.stderr)
-        if sender_thread.is_alive():
-            sender_thread.join()
+        # Only threads that were started: SenderThread.is_alive() is true until it has run
+        for session in sessions:
+            if session.sender_start_time is not None and session.sender_thread.is_alive():
+                session.sender_thread.join()
         if args.debug:
             print("testlatency: sender thread finished", file=sys.stderr)
-        if receiver_thread.is_alive():
-            receiver_thread.join()
+        for session in sessions:
+            if session.receiver_start_time is not None and session.receiver_thread.is_alive():
+                session.receiver_thread.join()
         if args.debug:
             print("testlatency: receiver thread finished", file=sys.stderr)
+        if sampler:
+            # While the relay is still running, for its final counters
+            sampler.stop()
+            sampler.join()
         if server_thread.is_alive():
             if args.debug:
                 print("testlatency: Stopping server thread...", file=sys.stderr)
@@ -212,34 +618,160 @@ def main():
             server_thread.join()
         if args.debug:
             print("testlatency: server thread finished", file=sys.stderr)
+        if shaper:
+            shaper.stop()
+            print_shaper(shaper, time.time() - run_start)
         ok = True
+        if metrics_server:
+            metrics_server.stop()
+            if metrics_server.aborted:
+                print(f"testlatency: Run aborted early: {metrics_server.aborted}", file=sys.stderr)
+                ok = False
         if server_thread.exit_status != 0:
             print(f"testlatency: Server thread exited with exit status code {server_thread.exit_status}", file=sys.stderr)
             ok = False
-        if sender_thread.exit_status != 0:
-            print(f"testlatency: Sender thread exited with exit status code {sender_thread.exit_status}", file=sys.stderr)
-            ok = False
-        if receiver_thread.exit_status != 0:
-            print(f"testlatency: Receiver thread exited with exit status code {receiver_thread.exit_status}", file=sys.stderr)
-            ok = False
+        for session in sessions:
+            if session.sender_thread.exit_status != 0:
+                print(f"testlatency: Sender thread exited with exit status code {session.sender_thread.exit_status}", file=sys.stderr)
+                ok = False
+            if session.receiver_thread.exit_status != 0:
+                print(f"testlatency: Receiver thread exited with exit status code {session.receiver_thread.exit_status}", file=sys.stderr)
+                ok = False
         if not ok:
             print(f"testlatency: One or more threads exited with an error.")
             print(f"testlatency: results are probably bogus.")
-        analyser = Analyser(receiver_thread.statistics, sender_thread.statistics)
-        results = analyser.analyse(not args.all_latencies)
-        analyser.print(results)
-        if args.print_latencies:
-            print(f"testlatency: all_receiver_latencies = [")
-            for rs in receiver_thread.statistics:
-                latency = rs.receiver_wallclock - (rs.timestamp / 1000.0)
-                print(f"\t{latency:.3f},")
-            print(f"]")
-        if ok and analyser.judge(results):
+        if len(sessions) == 1:
+            analysis_ok = sessions[0].analyse(args)[0]
+        else:
+            analysis_ok = analyse_sessions(args, sessions)
+        capacity_results = None
+        if sampler:
+            usage = sampler.usage()
+            capacity_results = capacity(usage, len(sessions), sum(session.viewers() for session in sessions))
+            print_resources(usage, capacity_results)
+        if args.results:
+            write_results(args.results, sessions, server_thread.time_to_listen, capacity_results)
+        for session in sessions:
+            session.close()
+        if ok and analysis_ok:
+            print("testlatency: Latency test passed.")
+            return 0
+        else:
+            print("testlatency: Latency test failed.")
+            return 1
+    elif args.mode == "analyse":
+        #
+        # Analyse the statistics logs of an earlier run. Sender and receivers may have run as
+        # separate processes or on separate hosts, with their logs in different directories.
+        #
+        sender_logdir = args.sender_logdir or args.logdir
+        receiver_logdir = args.receiver_logdir or args.logdir
+        if not sender_logdir or not receiver_logdir:
+            print("testlatency: --mode analyse needs --logdir, or --sender-logdir and --receiver-logdir", file=sys.stderr)
+            return 2
+        sender_statistics = StatisticsLogReader(statistics_log_path(sender_logdir, "sender"), SenderStatistics)
+        receiver_names = sorted(
+            filename[len("testlatency_"):-len(".stats")]
+            for filename in os.listdir(receiver_logdir)
+            if filename.startswith("testlatency_receiver") and filename.endswith(".stats") and not filename.endswith(("_stages.stats", "_switches.stats"))
+        )
+        if not receiver_names:
+            print(f"testlatency: no receiver statistics in {receiver_logdir}", file=sys.stderr)
+            return 1
+        receiver_statistics = [StatisticsLogReader(statistics_log_path(receiver_logdir, name), ReceiverStatistics) for name in receiver_names]
+        clock_offset = load_clock_offset(receiver_logdir)
+        sender_stages_path = statistics_log_path(sender_logdir, "sender_stages")
+        sender_stages = StatisticsLogReader(sender_stages_path, StageStatistics) if os.path.exists(sender_stages_path) else []
+        variants = load_stream_variants(sender_logdir, "sender")
+        if sender_stages:
+            print_bandwidth(analyse_bandwidth(sender_stages, sender_statistics, variants))
+        switches_path = statistics_log_path(receiver_logdir, "receiver_switches")
+        receiver_stages_path = statistics_log_path(receiver_logdir, "receiver_stages")
+        if args.abr == "viewport" and os.path.exists(receiver_stages_path):
+            print_viewport(analyse_viewport(sender_stages, StatisticsLogReader(receiver_stages_path, StageStatistics), variants))
+        if len(receiver_statistics) == 1 and os.path.exists(switches_path) and os.path.exists(receiver_stages_path):
+            print_switches(analyse_switches(
+                StatisticsLogReader(switches_path, SwitchStatistics),
+                receiver_statistics[0],
+                sender_statistics,
+                StatisticsLogReader(receiver_stages_path, StageStatistics),
+                sender_stages,
+                variants,
+                clock_offset.offset if clock_offset else 0
+            ))
+        if len(receiver_statistics) == 1 and os.path.exists(receiver_stages_path):
+            print_tiles(*analyse_tiles(
+                receiver_statistics[0],
+                sender_statistics,
+                StatisticsLogReader(receiver_stages_path, StageStatistics),
+                sender_stages,
+                variants,
+                clock_offset.offset if clock_offset else 0
+            ))
+        if len(receiver_statistics) > 1:
+            aggregated = analyse_fanout(args, receiver_statistics, sender_statistics, clock_offset=clock_offset)
+            analysis_ok = aggregated.count_receivers > 0 and aggregated.count_failed == 0
+        else:
+            stage_statistics : list[StageStatistics] = []
+            for logdir, name in [(sender_logdir, "sender_stages"), (receiver_logdir, "receiver_stages")]:
+                path = statistics_log_path(logdir, name)
+                if os.path.exists(path):
+                    stage_statistics += list(StatisticsLogReader(path, StageStatistics))
+            analysis_ok, _ = analyse(args, receiver_statistics[0], sender_statistics, stage_statistics, clock_offset=clock_offset)
+        if analysis_ok:
             print("testlatency: Latency test passed.")
             return 0
         else:
             print("testlatency: Latency test failed.")
             return 1
+    elif args.mode == "collect":
+        #
+        # Receive the statistics of --collector senders and receivers, until they are all done
+        #
+        if not args.logdir or not args.collector:
+            print("testlatency: --mode collect needs --logdir and --collector", file=sys.stderr)
+            return 2
+        collector = StatisticsCollector(parse_address(args.collector)[1], args.logdir, host=args.collector_host)
+        collector.start()
+        try:
+            collector.join()
+        except KeyboardInterrupt:
+            collector.stop()
+            collector.join()
+        print(f"testlatency: collected {', '.join(collector.streams)} into {args.logdir}")
+        return 0 if collector.streams else 1
+    elif args.mode == "publish":
+        #
+        # Relay ingest benchmark: no packager or encoder, synthetic segments are uploaded at
+        # increasing rates. With --http-clients the segments are pulled concurrently.
+        #
+        server_thread = ServerThread(args)
+        server_thread.start()
+        if not server_thread.wait_listening(args.startup_timeout):
+            print(f"testlatency: Server is not listening on port {args.port}", file=sys.stderr)
+            server_thread.stop()
+            return 1
+        publisher = SegmentPublisher(args)
+        bench_thread = None
+        if args.http_clients:
+            args.duration = len(args.publish_rates) * args.publish_step_duration
+            bench_thread = HttpBenchThread(args)
+            bench_thread.start()
+        results = asyncio.run(publisher.run_async())
+        if bench_thread:
+            bench_thread.stop()
+            bench_thread.join()
+            if bench_thread.results:
+                print_httpbench(bench_thread.results)
+        server_thread.stop()
+        server_thread.join()
+        print(f"testlatency: publisher: saturation_rate={saturation_point(results):.1f}")
+        if all(step.segments > 0 for step in results):
+            print("testlatency: Publish test passed.")
+            return 0
+        else:
+            print("testlatency: Publish test failed.")
+            return 1
     else:
         print("testlatency: Invalid mode selected. Use --help for more information.", file=sys.stderr)
         return 2
@@ -0,0 +1,206 @@
+import argparse
+import collections
+import statistics
+import threading
+from typing import Any, Deque, Dict, List, Optional
+
+#
+# Adaptive quality selection for tiled streams. The receive loop feeds a controller with what
+# it can measure: the bytes and arrival time of every fetched tile buffer (throughput per tile),
+# the number of fetched but not yet decoded buffers per tile (buffer depth), and the latency of
+# every delivered frame (latency drift, the current latency over the lowest seen). The controller
+# answers which tiles should switch to which quality, applied with select_tile_quality().
+#
+# Controllers work on levels, 0 is the lowest bitrate: the quality index of every level comes
+# from the bandwidth in the multisource description where it has one, otherwise quality indexes
+# are assumed to be in order of increasing bitrate.
+#
+# How well a controller keeps latency bounded on a constrained link (see --shape-rate):
+#
+#   python testlatency_sweep.py --grid abr=roundrobin,throughput --grid shape-rate=10,20,50 --compare abr -- --tiled --octree_bits 8 --octree_bits 10 --duration 60
+#
+
+class AbrController:
+    def __init__(self, n_tile : int, n_quality : int, order : Optional[List[int]] = None, window : float = 2.0):
+        self.n_tile = n_tile
+        self.n_quality = n_quality
+        self.order = order or list(range(n_quality))
+        self.window = window
+        # Observations come from the receive loop and the decoder threads
+        self.lock = threading.Lock()
+        self.level = [self.order.index(0) if 0 in self.order else 0] * n_tile
+        self.fetches : List[Deque[tuple[float, int]]] = [collections.deque() for _ in range(n_tile)]
+        self.latencies : Deque[tuple[float, float]] = collections.deque()
+        self.min_latency : Optional[float] = None
+        self.buffer_depth = [0] * n_tile
+
+    def observe_fetch(self, tile : int, wallclock : float, nbytes : int) -> None:
+        with self.lock:
+            fetches = self.fetches[tile]
+            fetches.append((wallclock, nbytes))
+            while fetches and fetches[0][0] < wallclock - self.window:
+                fetches.popleft()
+
+    def observe_frame(self, wallclock : float, latency : float) -> None:
+        with self.lock:
+            self.latencies.append((wallclock, latency))
+            while self.latencies and self.latencies[0][0] < wallclock - self.window:
+                self.latencies.popleft()
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+
+    def observe_buffer(self, tile : int, depth : int) -> None:
+        self.buffer_depth[tile] = depth
+
+    def throughput(self, tile : int) -> float:
+        # Bytes per second over the window
+        with self.lock:
+            fetches = list(self.fetches[tile])
+        if len(fetches) < 2:
+            return 0
+        duration = fetches[-1][0] - fetches[0][0]
+        return sum(nbytes for _, nbytes in fetches[1:]) / duration if duration > 0 else 0
+
+    def latency_drift(self) -> float:
+        with self.lock:
+            latencies = [latency for _, latency in self.latencies]
+            min_latency = self.min_latency
+        if not latencies or min_latency is None:
+            return 0
+        return statistics.median(latencies) - min_latency
+
+    def quality(self, tile : int) -> int:
+        return self.order[self.level[tile]]
+
+    def decide(self, now : float) -> Dict[int, int]:
+        # Tiles to switch, with their new quality index. The base controller keeps every tile
+        # at its current quality.
+        return {}
+
+    def switched(self, tile : int, quality : int) -> None:
+        self.level[tile] = self.order.index(quality)
+        with self.lock:
+            # Throughput at the old quality says nothing about the new one
+            self.fetches[tile].clear()
+
+class RoundRobinController(AbrController):
+    #
+    # The blind switcher: every `interval` seconds all tiles go to the next quality index.
+    #
+    def __init__(self, n_tile : int, n_quality : int, order : Optional[List[int]] = None, interval : float = 5.0):
+        super().__init__(n_tile, n_quality, order)
+        self.interval = interval
+        self.next_switch : Optional[float] = None
+
+    def decide(self, now : float) -> Dict[int, int]:
+        if self.next_switch is None:
+            self.next_switch = now + self.interval
+        if now < self.next_switch or self.n_quality < 2:
+            return {}
+        self.next_switch = now + self.interval
+        return {tile: (self.quality(tile) + 1) % self.n_quality for tile in range(self.n_tile)}
+
+class ThroughputController(AbrController):
+    #
+    # Steps one tile down when the latency drifts up or decoder input queues up: the link does not
+    # keep up, and what it does deliver is taken as the link capacity. Steps one tile up when the
+    # latency is back at its minimum and the estimated bitrate of the next level fits within the
+    # capacity estimate with some headroom. At most one switch per `hold` seconds, so every
+    # switch can take effect before the next decision.
+    #
+    def __init__(self, n_tile : int, n_quality : int, order : Optional[List[int]] = None, window : float = 2.0, drift_high : float = 0.5, drift_low : float = 0.1, buffer_high : int = 3, hold : float = 2.0, headroom : float = 1.25, level_ratio : float = 2.0):
+        super().__init__(n_tile, n_quality, order, window)
+        self.drift_high = drift_high
+        self.drift_low = drift_low
+        self.buffer_high = buffer_high
+        self.hold = hold
+        self.headroom = headroom
+        # Assumed bitrate ratio between consecutive levels, until both have been measured
+        self.level_ratio = level_ratio
+        self.capacity : Optional[float] = None
+        self.start : Optional[float] = None
+        self.last_switch : Optional[float] = None
+        self.level_since = [0.0] * n_tile
+        # Measured bytes per second per (tile, level)
+        self.bitrates : Dict[tuple[int, int], float] = {}
+
+    def _estimate(self, tile : int, level : int) -> float:
+        if (tile, level) in self.bitrates:
+            return self.bitrates[(tile, level)]
+        current = self.level[tile]
+        known = self.bitrates.get((tile, current), self.throughput(tile))
+        return known * self.level_ratio ** (level - current)
+
+    def decide(self, now : float) -> Dict[int, int]:
+        if self.start is None:
+            self.start = now
+        if now - self.start < self.window:
+            # Nothing measured yet
+            return {}
+        throughputs = [self.throughput(tile) for tile in range(self.n_tile)]
+        for tile in range(self.n_tile):
+            # Learn the bitrate of a level once the tile has been on it for a full window
+            if throughputs[tile] > 0 and now - self.level_since[tile] >= self.window:
+                self.bitrates[(tile, self.level[tile])] = throughputs[tile]
+        if self.last_switch is not None and now - self.last_switch < self.hold:
+            return {}
+        total = sum(throughputs)
+        drift = self.latency_drift()
+        congested = drift > self.drift_high or max(self.buffer_depth, default=0) > self.buffer_high
+        decision : Dict[int, int] = {}
+        if congested:
+            self.capacity = total
+            candidates = [tile for tile in range(self.n_tile) if self.level[tile] > 0]
+            if candidates:
+                tile = max(candidates, key=lambda t: (self.level[t], throughputs[t]))
+                decision[tile] = self.order[self.level[tile] - 1]
+        elif drift < self.drift_low:
+            if self.capacity is not None and total > self.capacity:
+                # Delivering more than we thought the link could
+                self.capacity = total
+            candidates = [tile for tile in range(self.n_tile) if self.level[tile] < self.n_quality - 1]
+            if candidates:
+                tile = min(candidates, key=lambda t: (self.level[t], throughputs[t]))
+                extra = self._estimate(tile, self.level[tile] + 1) - throughputs[tile]
+                if self.capacity is None or (total + extra) * self.headroom <= self.capacity:
+                    decision[tile] = self.order[self.level[tile] + 1]
+        if decision:
+            self.last_switch = now
+        return decision
+
+    def switched(self, tile : int, quality : int) -> None:
+        super().switched(tile, quality)
+        self.level_since[tile] = self.last_switch or 0.0
+
+ABR_CONTROLLERS = {
+    "roundrobin": RoundRobinController,
+    "throughput": ThroughputController,
+}
+
+def quality_order(description : Any) -> Optional[List[int]]:
+    # Quality indexes from lowest to highest bitrate, from the bandwidth of the first tile's qualities
+    try:
+        bandwidths = []
+        for quality in description[0]:
+            bandwidth = quality.get("bandwidth") if isinstance(quality, dict) else getattr(quality, "bandwidth", None)
+            if bandwidth is None:
+                return None
+            bandwidths.append(bandwidth)
+    except (IndexError, KeyError, TypeError):
+        return None
+    return sorted(range(len(bandwidths)), key=lambda index: bandwidths[index])
+
+def create_abr_controller(args : argparse.Namespace, n_tile : int, n_quality : int, description : Any = None) -> Optional[AbrController]:
+    # --switch-interval without --abr is the round robin controller
+    name = args.abr
+    if name == "off" and args.switch_interval:
+        name = "roundrobin"
+    if name == "off":
+        return None
+    order = quality_order(description)
+    if name == "viewport":
+        from testlatency_viewport import create_viewport_controller
+        return create_viewport_controller(args, n_tile, n_quality, order, description)
+    if name == "roundrobin":
+        return RoundRobinController(n_tile, n_quality, order, args.switch_interval or 5.0)
+    return ABR_CONTROLLERS[name](n_tile, n_quality, order)
@@ -1,8 +1,14 @@
 import sys
-from typing import NamedTuple
+import argparse
+import itertools
+from typing import Any, NamedTuple, Optional
 import statistics
 from testlatency_receiver import ReceiverStatistics
 from testlatency_sender import SenderStatistics
+from testlatency_probes import StageStatistics, STAGE_FED, STAGE_PUSHED, STAGE_FETCHED, STAGE_READY, STAGE_DECODED
+from testlatency_histogram import LatencyHistogram, ReceiverMetrics
+from testlatency_steadystate import SteadyStateDetector
+from testlatency_clocksync import ClockOffset
 
 class AnalyserResults(NamedTuple):
     count_total : int
@@ -13,11 +19,86 @@ class AnalyserResults(NamedTuple):
     latency_max : float
     latency_avg : float
     latency_stddev : float
-    
+    latency_p50 : float
+    latency_p90 : float
+    latency_p99 : float
+    latency_p999 : float
+    interval_avg : float
+    interval_stddev : float
+    interval_jitter : float
+    stall_count : int
+    stall_max : float
+    clock_offset : float
+    clock_error : float
+
+class AggregateResults(NamedTuple):
+    count_receivers : int
+    count_failed : int
+    loss_avg : float
+    loss_max : float
+    latency_p50 : float
+    latency_p90 : float
+    latency_p99 : float
+    latency_p999 : float
+    latency_p99_worst : float
+
+class StageResults(NamedTuple):
+    stage : str
+    count : int
+    latency_min : float
+    latency_p50 : float
+    latency_p90 : float
+    latency_p99 : float
+    latency_max : float
+    latency_avg : float
+
+#
+# Hops in pipeline order, and the names of the stages between consecutive hops.
+# captured and released come from the sender and receiver statistics, the others from
+# the stage statistics collected by the probes.
+#
+HOPS = ["captured", STAGE_FED, STAGE_PUSHED, STAGE_FETCHED, STAGE_DECODED, "released"]
+STAGE_NAMES = {
+    STAGE_FED: "feed",
+    STAGE_PUSHED: "encode",
+    STAGE_FETCHED: "relay",
+    STAGE_DECODED: "decode",
+    "released": "synchronize",
+}
+RECEIVER_STAGES = {STAGE_FETCHED, STAGE_READY, STAGE_DECODED}
+
 class Analyser:
-    def __init__(self, receiver_statistics: list[ReceiverStatistics], sender_statistics: list[SenderStatistics]):
+    def __init__(self, receiver_statistics: list[ReceiverStatistics], sender_statistics: list[SenderStatistics], stage_statistics: Optional[list[StageStatistics]] = None, receiver_metrics: Optional[ReceiverMetrics] = None, clock_offset: Optional[ClockOffset] = None):
         self.receiver_statistics = receiver_statistics
         self.sender_statistics = sender_statistics
+        self.stage_statistics = stage_statistics if stage_statistics is not None else []
+        self.receiver_metrics = receiver_metrics
+        # Receiver wallclocks are converted to the sender clock by adding the offset
+        self.clock_offset = clock_offset
+        self.offset = clock_offset.offset if clock_offset else 0.0
+        self.steady_state : Optional[SteadyStateDetector] = None
+
+    def _detect_steady_state(self, latencies : Any) -> int:
+        # Warm-up end index, in receiver order. Also finds later regime changes and spikes.
+        # Post-hoc only: the latencies need the sender statistics and the clock offset.
+        self.steady_state = SteadyStateDetector()
+        self.steady_state.extend(latencies)
+        return self.steady_state.finish()
+
+    def _get_receiver_metrics(self, start : int = 0) -> ReceiverMetrics:
+        #
+        # Interval, jitter and stall metrics from receiver frame `start` on. Without warm-up to
+        # skip those collected live are used, otherwise (or when they were not collected live,
+        # e.g. statistics from elsewhere) the receiver statistics are replayed.
+        #
+        if self.receiver_metrics is not None and start == 0:
+            return self.receiver_metrics
+        metrics = ReceiverMetrics()
+        for stat in itertools.islice(self.receiver_statistics, start, None):
+            metrics.record(stat.timestamp, stat.receiver_wallclock)
+        if start == 0:
+            self.receiver_metrics = metrics
+        return metrics
         
     def _gendicts(self):
         self.receiver_dict : dict[float, ReceiverStatistics] = {}
@@ -46,32 +127,126 @@ class Analyser:
                     count_lost_running += 1
                 else:
                     count_lost_initial += 1
-        latencies : list[float] = []
+        #
+        # The latencies are only kept by the steady state detector, which needs the series, in a
+        # compact array. Min, max, mean, stddev and percentiles all come from the histogram.
+        #
+        self.steady_state = SteadyStateDetector()
         for recv in self.receiver_statistics:
             if recv.timestamp not in self.sender_dict:
                 print(f"testlatency: received frame {recv.timestamp} not found in sender statistics", file=sys.stderr)
                 continue
             send = self.sender_dict[recv.timestamp]
-            latency = recv.receiver_wallclock - send.sender_wallclock
-            latencies.append(latency)
-        if ignore_initial_latencies and latencies:
-            full_average = statistics.mean(latencies) if latencies else 0
-            first_below_average = len(latencies)
-            for first_below_average in range(1, len(latencies)):
-                if latencies[first_below_average] < full_average:
-                    break
-            latencies = latencies[first_below_average:-1]
-        else:
-            first_below_average = 0
-        latency_min = min(latencies) if latencies else 0
-        latency_max = max(latencies) if latencies else 0
-        latency_avg = statistics.mean(latencies) if latencies else 0
-        latency_stddev = statistics.stdev(latencies) if len(latencies) > 1 else 0
-        return AnalyserResults(count_total, count_lost_initial, count_lost_running, first_below_average, latency_min, latency_max, latency_avg, latency_stddev)
+            self.steady_state.add(recv.receiver_wallclock + self.offset - send.sender_wallclock)
+        n_latencies = len(self.steady_state.values)
+        warmup_end = self.steady_state.finish() if n_latencies else 0
+        if not n_latencies:
+            self.steady_state = None
+        if not ignore_initial_latencies:
+            warmup_end = 0
+        histogram = LatencyHistogram()
+        if self.steady_state is not None:
+            for latency in itertools.islice(self.steady_state.values, warmup_end, None):
+                histogram.record(latency)
+        steady_start = self._receiver_index(warmup_end) if warmup_end else 0
+        latency_min = histogram.min if histogram.count else 0
+        latency_max = histogram.max if histogram.count else 0
+        latency_avg = histogram.mean()
+        latency_stddev = histogram.stddev()
+        return self._results(count_total, count_lost_initial, count_lost_running, warmup_end,
+            latency_min, latency_max, latency_avg, latency_stddev, histogram, steady_start)
+
+    def _receiver_index(self, n : int) -> int:
+        # Receiver index of the n-th frame with a latency, that is found in the sender statistics
+        for index, recv in enumerate(self.receiver_statistics):
+            if recv.timestamp in self.sender_dict:
+                if n == 0:
+                    return index
+                n -= 1
+        return len(self.receiver_statistics)
+
+    def _results(self, count_total : int, count_lost_initial : int, count_lost_running : int, latency_ignored_count : int,
+            latency_min : float, latency_max : float, latency_avg : float, latency_stddev : float, histogram : LatencyHistogram, steady_start : int = 0) -> AnalyserResults:
+        # Intervals, jitter and stalls over the same steady state window as the latencies
+        metrics = self._get_receiver_metrics(steady_start)
+        intervals = metrics.interval_histogram
+        self.latency_histogram = histogram
+        return AnalyserResults(
+            count_total, count_lost_initial, count_lost_running, latency_ignored_count,
+            latency_min, latency_max, latency_avg, latency_stddev,
+            histogram.percentile(0.5), histogram.percentile(0.9), histogram.percentile(0.99), histogram.percentile(0.999),
+            intervals.mean(), intervals.stddev(), metrics.jitter,
+            metrics.stall_count(), metrics.stall_max(),
+            self.offset, self.clock_offset.error if self.clock_offset else 0.0
+        )
     
+    def _genhops(self) -> dict[int, dict[str, float]]:
+        #
+        # Per frame timestamp, the wallclock time at which each hop was passed.
+        # For multi-stream and multi-tile hops the last stream or tile is what holds up the frame.
+        #
+        hops : dict[int, dict[str, float]] = {}
+        for send in self.sender_statistics:
+            hops.setdefault(send.timestamp, {})["captured"] = send.sender_wallclock
+        for stage in self.stage_statistics:
+            frame_hops = hops.setdefault(stage.timestamp, {})
+            wallclock = stage.wallclock + self.offset if stage.stage in RECEIVER_STAGES else stage.wallclock
+            if wallclock > frame_hops.get(stage.stage, 0):
+                frame_hops[stage.stage] = wallclock
+        for recv in self.receiver_statistics:
+            hops.setdefault(recv.timestamp, {})["released"] = recv.receiver_wallclock + self.offset
+        return hops
+
+    def analyse_stages(self) -> list[StageResults]:
+        hops = self._genhops()
+        durations : dict[str, list[float]] = {}
+        for frame_hops in hops.values():
+            if "captured" not in frame_hops or "released" not in frame_hops:
+                continue
+            for previous, hop in zip(HOPS, HOPS[1:]):
+                if previous in frame_hops and hop in frame_hops:
+                    durations.setdefault(STAGE_NAMES[hop], []).append(frame_hops[hop] - frame_hops[previous])
+            durations.setdefault("total", []).append(frame_hops["released"] - frame_hops["captured"])
+        results : list[StageResults] = []
+        for name in list(STAGE_NAMES.values()) + ["total"]:
+            if name not in durations:
+                continue
+            histogram = LatencyHistogram()
+            for value in durations[name]:
+                histogram.record(value)
+            results.append(StageResults(
+                name,
+                histogram.count,
+                histogram.min,
+                histogram.percentile(0.5),
+                histogram.percentile(0.9),
+                histogram.percentile(0.99),
+                histogram.max,
+                histogram.mean()
+            ))
+        return results
+
+    def print_stages(self, stage_results: list[StageResults]):
+        print(f"testlatency: {'stage':<12} {'count':>6} {'min':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'avg':>7}")
+        for r in stage_results:
+            print(f"testlatency: {r.stage:<12} {r.count:>6} {r.latency_min:>7.3f} {r.latency_p50:>7.3f} {r.latency_p90:>7.3f} {r.latency_p99:>7.3f} {r.latency_max:>7.3f} {r.latency_avg:>7.3f}")
+
     def print(self, results: AnalyserResults):
         print(f"testlatency: count_total={results.count_total}, count_lost_initial={results.count_lost_initial}, count_lost_running={results.count_lost_running}, latency_ignored_count={results.latency_ignored_count}, latency_min={results.latency_min:.3f}, latency_max={results.latency_max:.3f}, latency_avg={results.latency_avg:.3f}, latency_stddev={results.latency_stddev:.3f}")
+        if self.clock_offset:
+            print(f"testlatency: clock_offset={results.clock_offset:.6f}, clock_error={results.clock_error:.6f}")
+        print(f"testlatency: latency_p50={results.latency_p50:.3f}, latency_p90={results.latency_p90:.3f}, latency_p99={results.latency_p99:.3f}, latency_p999={results.latency_p999:.3f}, interval_avg={results.interval_avg:.3f}, interval_stddev={results.interval_stddev:.3f}, interval_jitter={results.interval_jitter:.3f}, stall_count={results.stall_count}, stall_max={results.stall_max:.3f}")
         
+    def print_steady_state(self):
+        if self.steady_state is None:
+            return
+        print(f"testlatency: warmup: {self.steady_state.reason}")
+        for event in self.steady_state.regime_changes():
+            print(f"testlatency: regime change at frame {event.index}: {event.reason}")
+        spikes = self.steady_state.spikes()
+        if spikes:
+            print(f"testlatency: spikes: count={len(spikes)}, max={max(event.value for event in spikes):.3f}, frames={[event.index for event in spikes[:10]]}{'...' if len(spikes) > 10 else ''}")
+
     def judge(self, results: AnalyserResults) -> bool:
         if results.count_total == 0:
             print("testlatency: judge: no data received", file=sys.stderr)
@@ -83,4 +258,52 @@ class Analyser:
             print(f"testlatency: judge: {results.count_lost_running} running frames lost, more than 10% of total frames", file=sys.stderr)
             return False
 
-        return True
\ No newline at end of file
+        return True
+
+def analyse(args : argparse.Namespace, receiver_statistics : Any, sender_statistics : Any, stage_statistics : list[StageStatistics], receiver_metrics : Optional[ReceiverMetrics] = None, clock_offset : Optional[ClockOffset] = None) -> tuple[bool, AnalyserResults]:
+    analyser = get_analyser_class(args.analyser)(receiver_statistics, sender_statistics, stage_statistics, receiver_metrics, clock_offset)
+    results = analyser.analyse(not args.all_latencies)
+    analyser.print(results)
+    analyser.print_steady_state()
+    analyser.print_stages(analyser.analyse_stages())
+    if args.print_latencies:
+        print(f"testlatency: all_receiver_latencies = [")
+        for rs in receiver_statistics:
+            latency = rs.receiver_wallclock + analyser.offset - (rs.timestamp / 1000.0)
+            print(f"\t{latency:.3f},")
+        print(f"]")
+    return analyser.judge(results), results
+
+def get_analyser_class(name : str) -> type[Analyser]:
+    if name == "numpy":
+        from testlatency_analyse_numpy import NumpyAnalyser
+        return NumpyAnalyser
+    return Analyser
+
+def aggregate(analysers : list[Analyser], results : list[AnalyserResults]) -> AggregateResults:
+    #
+    # Combine the results of several receivers of the same stream: latency percentiles over
+    # all frames of all receivers, plus average and worst loss and worst per-receiver p99.
+    #
+    histogram = LatencyHistogram()
+    for analyser in analysers:
+        histogram.merge(analyser.latency_histogram)
+    losses = [r.count_lost_running / r.count_total if r.count_total else 1.0 for r in results]
+    count_failed = 0
+    for analyser, r in zip(analysers, results):
+        if not analyser.judge(r):
+            count_failed += 1
+    return AggregateResults(
+        len(results),
+        count_failed,
+        statistics.mean(losses) if losses else 0,
+        max(losses) if losses else 0,
+        histogram.percentile(0.5),
+        histogram.percentile(0.9),
+        histogram.percentile(0.99),
+        histogram.percentile(0.999),
+        max((r.latency_p99 for r in results), default=0)
+    )
+
+def print_aggregate(label : str, results : AggregateResults):
+    print(f"testlatency: {label}: receivers={results.count_receivers}, failed={results.count_failed}, loss_avg={results.loss_avg:.3f}, loss_max={results.loss_max:.3f}, latency_p50={results.latency_p50:.3f}, latency_p90={results.latency_p90:.3f}, latency_p99={results.latency_p99:.3f}, latency_p999={results.latency_p999:.3f}, latency_p99_worst={results.latency_p99_worst:.3f}")
@@ -0,0 +1,136 @@
+import sys
+from typing import Any, Optional
+import numpy as np
+from testlatency_analyse import Analyser, AnalyserResults
+from testlatency_histogram import LatencyHistogram, ReceiverMetrics
+from testlatency_receiver import ReceiverStatistics
+from testlatency_sender import SenderStatistics
+from testlatency_probes import StageStatistics
+from testlatency_clocksync import ClockOffset
+
+def statistics_columns(statistics : Any, fields : list[str]) -> dict[str, np.ndarray]:
+    #
+    # Columnar view of a statistics sequence. Recorders that already store their data
+    # in columns provide them directly, lists of NamedTuples are converted once.
+    #
+    if hasattr(statistics, "columns"):
+        columns = statistics.columns()
+        return {field: np.asarray(columns[field], dtype=np.float64) for field in fields}
+    n = len(statistics)
+    return {
+        field: np.fromiter((getattr(stat, field) for stat in statistics), dtype=np.float64, count=n)
+        for field in fields
+    }
+
+def histogram_from_array(values : np.ndarray) -> LatencyHistogram:
+    histogram = LatencyHistogram()
+    if values.size == 0:
+        return histogram
+    indices = np.zeros(values.size, dtype=np.int64)
+    above = values > histogram.lowest
+    indices[above] = np.minimum(
+        histogram.n_buckets - 1,
+        (np.log(values[above] / histogram.lowest) / histogram.log_base).astype(np.int64) + 1
+    )
+    counts = np.bincount(indices, minlength=histogram.n_buckets)
+    for i in np.nonzero(counts)[0]:
+        histogram.counts[int(i)] = int(counts[i])
+    histogram.count = int(values.size)
+    histogram.min = float(values.min())
+    histogram.max = float(values.max())
+    histogram._mean = float(values.mean())
+    histogram._m2 = float(((values - histogram._mean) ** 2).sum())
+    return histogram
+
+class NumpyAnalyser(Analyser):
+    #
+    # Same results as Analyser, but the sender/receiver join, loss classification and
+    # latency computation are done on columnar NumPy arrays with sort + searchsorted
+    # in stead of per-frame Python dictionaries.
+    #
+    def __init__(self, receiver_statistics: list[ReceiverStatistics], sender_statistics: list[SenderStatistics], stage_statistics: Optional[list[StageStatistics]] = None, receiver_metrics: Optional[ReceiverMetrics] = None, clock_offset: Optional[ClockOffset] = None):
+        super().__init__(receiver_statistics, sender_statistics, stage_statistics, receiver_metrics, clock_offset)
+        self.receiver_columns = statistics_columns(receiver_statistics, ["timestamp", "receiver_wallclock"])
+        self.sender_columns = statistics_columns(sender_statistics, ["timestamp", "sender_wallclock"])
+
+    def _get_receiver_metrics(self, start : int = 0) -> ReceiverMetrics:
+        if self.receiver_metrics is not None and start == 0:
+            return self.receiver_metrics
+        timestamps = self.receiver_columns["timestamp"][start:]
+        wallclocks = self.receiver_columns["receiver_wallclock"][start:]
+        metrics = ReceiverMetrics()
+        intervals = np.diff(wallclocks)
+        metrics.interval_histogram = histogram_from_array(intervals)
+        if intervals.size:
+            # Closed form of the recursive jitter filter J += (|D| - J) / 16
+            transit_deltas = np.abs(intervals - np.diff(timestamps) / 1000.0)
+            weights = (15.0 / 16.0) ** np.arange(intervals.size - 1, -1, -1)
+            metrics.jitter = float((transit_deltas * weights).sum() / 16)
+            metrics.last_wallclock = float(wallclocks[-1])
+            metrics.last_timestamp = int(timestamps[-1])
+        if start == 0:
+            self.receiver_metrics = metrics
+        return metrics
+
+    def analyse(self, ignore_initial_latencies : bool = False) -> AnalyserResults:
+        send_ts = self.sender_columns["timestamp"]
+        send_wallclock = self.sender_columns["sender_wallclock"]
+        recv_ts = self.receiver_columns["timestamp"]
+        recv_wallclock = self.receiver_columns["receiver_wallclock"]
+        count_total = int(send_ts.size)
+        #
+        # Unique sender timestamps. Like the dict based analyser, the last duplicate provides the
+        # wallclock and the first duplicate determines the position in sender order.
+        #
+        order = np.argsort(send_ts, kind="stable")
+        sorted_ts = send_ts[order]
+        boundary = sorted_ts[1:] != sorted_ts[:-1]
+        is_last = np.concatenate((boundary, [True])) if count_total else np.zeros(0, dtype=bool)
+        is_first = np.concatenate(([True], boundary)) if count_total else np.zeros(0, dtype=bool)
+        unique_ts = sorted_ts[is_last]
+        unique_last_index = order[is_last]
+        unique_first_index = order[is_first]
+        n_duplicates = count_total - unique_ts.size
+        if n_duplicates:
+            print(f"testlatency: {n_duplicates} duplicate sender timestamps", file=sys.stderr)
+        n_duplicates = int(recv_ts.size - np.unique(recv_ts).size)
+        if n_duplicates:
+            print(f"testlatency: {n_duplicates} duplicate receiver timestamps", file=sys.stderr)
+        #
+        # Loss classification, in sender order
+        #
+        received_ts = np.unique(recv_ts)
+        pos = np.minimum(np.searchsorted(received_ts, unique_ts), max(0, received_ts.size - 1))
+        received = received_ts[pos] == unique_ts if received_ts.size else np.zeros(unique_ts.size, dtype=bool)
+        received = received[np.argsort(unique_first_index, kind="stable")]
+        if received.any():
+            first_received = int(np.argmax(received))
+            count_lost_initial = first_received
+            count_lost_running = int((~received[first_received:]).sum())
+        else:
+            count_lost_initial = int(received.size)
+            count_lost_running = 0
+        #
+        # Latencies, in receiver order
+        #
+        pos = np.minimum(np.searchsorted(unique_ts, recv_ts), max(0, unique_ts.size - 1))
+        found = unique_ts[pos] == recv_ts if unique_ts.size else np.zeros(recv_ts.size, dtype=bool)
+        n_missing = int((~found).sum())
+        if n_missing:
+            print(f"testlatency: {n_missing} received frames not found in sender statistics", file=sys.stderr)
+        latencies = recv_wallclock[found] + self.offset - send_wallclock[unique_last_index[pos[found]]]
+        warmup_end = self._detect_steady_state(latencies.tolist()) if latencies.size else 0
+        steady_start = 0
+        if ignore_initial_latencies:
+            latencies = latencies[warmup_end:]
+            if warmup_end:
+                found_index = np.flatnonzero(found)
+                steady_start = int(found_index[warmup_end]) if warmup_end < found_index.size else int(recv_ts.size)
+        else:
+            warmup_end = 0
+        latency_min = float(latencies.min()) if latencies.size else 0
+        latency_max = float(latencies.max()) if latencies.size else 0
+        latency_avg = float(latencies.mean()) if latencies.size else 0
+        latency_stddev = float(latencies.std(ddof=1)) if latencies.size > 1 else 0
+        return self._results(count_total, count_lost_initial, count_lost_running, warmup_end,
+            latency_min, latency_max, latency_avg, latency_stddev, histogram_from_array(latencies), steady_start)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+from testlatency_probes import STAGE_PUSHED
+
+#
+# Real bandwidth per stream and per quality variant, from the encoded sizes the RawSinkProbe
+# records in the pushed stage. The stream index of a pushed buffer tells the tile and the
+# encoder parameters: the encoder adds one stream per tile, octree_bits and jpeg_quality,
+# in that nesting order, and announces each with add_streamDesc(tile, ...), so within a tile
+# the n-th stream is the n-th (octree_bits, jpeg_quality) combination.
+#
+
+# sizeof(cwipc_point): x, y, z as float, r, g, b and the tile mask as bytes
+RAW_POINT_SIZE = 16
+
+class StreamVariant(NamedTuple):
+    stream : int
+    tile : int
+    octree_bits : int  # -1 for the encoder default
+    jpeg_quality : int  # -1 for the encoder default
+
+class BandwidthResults(NamedTuple):
+    octree_bits : int
+    jpeg_quality : int
+    streams : int
+    frames : int
+    nbytes : int
+    bitrate : float
+    bytes_per_frame : float
+    bytes_per_point : float
+    compression_ratio : float
+
+def stream_variants(stream_tiles : List[int], octree_bits : Optional[List[int]], jpeg_quality : Optional[List[int]]) -> List[StreamVariant]:
+    octree_bits = octree_bits or [-1]
+    jpeg_quality = jpeg_quality or [-1]
+    per_tile : Dict[int, int] = {}
+    variants = []
+    for stream, tile in enumerate(stream_tiles):
+        quality = per_tile.get(tile, 0)
+        per_tile[tile] = quality + 1
+        variants.append(StreamVariant(
+            stream,
+            tile,
+            octree_bits[(quality // len(jpeg_quality)) % len(octree_bits)],
+            jpeg_quality[quality % len(jpeg_quality)],
+        ))
+    return variants
+
+def _streams_filename(sender_name : str) -> str:
+    return f"testlatency_{sender_name}_streams.json"
+
+def save_stream_variants(args : argparse.Namespace, sender_name : str, variants : List[StreamVariant]) -> None:
+    # Next to the statistics logs, for --mode analyse and --isolation process
+    document = [variant._asdict() for variant in variants]
+    if args.collector:
+        from testlatency_collector import send_document
+        send_document(args.collector, _streams_filename(sender_name), document)
+    elif args.logdir:
+        with open(os.path.join(args.logdir, _streams_filename(sender_name)), "w") as fp:
+            json.dump(document, fp, indent=2)
+
+def load_stream_variants(logdir : str, sender_name : str) -> List[StreamVariant]:
+    path = os.path.join(logdir, _streams_filename(sender_name))
+    if not os.path.exists(path):
+        return []
+    with open(path) as fp:
+        return [StreamVariant(**variant) for variant in json.load(fp)]
+
+def analyse_bandwidth(stage_statistics : Any, sender_statistics : Any, variants : List[StreamVariant]) -> List[BandwidthResults]:
+    #
+    # Per (octree_bits, jpeg_quality) variant, over all its tiles. The raw size of a frame is its
+    # point count times RAW_POINT_SIZE, the tiles of one variant together encode all points.
+    #
+    if len(sender_statistics) < 2:
+        return []
+    duration = sender_statistics[-1].sender_wallclock - sender_statistics[0].sender_wallclock
+    point_counts = {send.timestamp: send.sender_count for send in sender_statistics}
+    average_count = sum(point_counts.values()) / len(point_counts)
+    by_stream = {variant.stream: variant for variant in variants}
+    nbytes : Dict[tuple[int, int], int] = {}
+    timestamps : Dict[tuple[int, int], set] = {}
+    streams : Dict[tuple[int, int], set] = {}
+    for stage in stage_statistics:
+        if stage.stage != STAGE_PUSHED:
+            continue
+        variant = by_stream.get(stage.tile)
+        key = (variant.octree_bits, variant.jpeg_quality) if variant else (-1, -1)
+        nbytes[key] = nbytes.get(key, 0) + stage.nbytes
+        timestamps.setdefault(key, set()).add(stage.timestamp)
+        streams.setdefault(key, set()).add(stage.tile)
+    results = []
+    for key in sorted(nbytes):
+        frames = len(timestamps[key])
+        points = sum(point_counts.get(timestamp, average_count) for timestamp in timestamps[key])
+        total = nbytes[key]
+        results.append(BandwidthResults(
+            key[0],
+            key[1],
+            len(streams[key]),
+            frames,
+            total,
+            total * 8 / duration if duration > 0 else 0,
+            total / frames if frames else 0,
+            total / points if points else 0,
+            points * RAW_POINT_SIZE / total if total else 0,
+        ))
+    return results
+
+def print_bandwidth(results : List[BandwidthResults]) -> None:
+    for r in results:
+        octree_bits = r.octree_bits if r.octree_bits >= 0 else "default"
+        jpeg_quality = r.jpeg_quality if r.jpeg_quality >= 0 else "default"
+        print(f"testlatency: bandwidth: octree_bits={octree_bits}, jpeg_quality={jpeg_quality}: streams={r.streams}, frames={r.frames}, Mbps={r.bitrate / 1e6:.3f}, bytes_per_frame={r.bytes_per_frame:.0f}, bytes_per_point={r.bytes_per_point:.3f}, compression_ratio={r.compression_ratio:.2f}")
+
+def bandwidth_columns(results : List[BandwidthResults]) -> Dict[str, Any]:
+    # For write_results: plain column names for a single variant, suffixed with the variant otherwise
+    columns : Dict[str, Any] = {}
+    for r in results:
+        suffix = "" if len(results) == 1 else f"_{r.octree_bits}_{r.jpeg_quality}"
+        columns[f"bitrate{suffix}"] = r.bitrate
+        columns[f"bytes_per_point{suffix}"] = r.bytes_per_point
+        columns[f"compression_ratio{suffix}"] = r.compression_ratio
+    return columns
@@ -0,0 +1,54 @@
+import sys
+import argparse
+import random
+import time
+from testlatency_analyse import Analyser
+from testlatency_analyse_numpy import NumpyAnalyser
+from testlatency_receiver import ReceiverStatistics
+from testlatency_sender import SenderStatistics
+
+#
+# Compare the dict based and the NumPy based analysers on synthetic statistics
+# that look like a long soak run: fixed fps, some initial and some running loss.
+#
+
+def generate(n_frames : int, fps : int, loss : float) -> tuple[list[ReceiverStatistics], list[SenderStatistics]]:
+    rng = random.Random(n_frames)
+    start = 1_700_000_000.0
+    sender_statistics : list[SenderStatistics] = []
+    receiver_statistics : list[ReceiverStatistics] = []
+    for num in range(n_frames):
+        wallclock = start + num / fps
+        timestamp = int(wallclock * 1000)
+        sender_statistics.append(SenderStatistics(timestamp, wallclock, num, 4000))
+        if num < fps or rng.random() < loss:
+            continue
+        latency = 0.120 + rng.expovariate(1 / 0.010)
+        receiver_statistics.append(ReceiverStatistics(timestamp, wallclock + latency, len(receiver_statistics), 4000))
+    return receiver_statistics, sender_statistics
+
+def timed(analyser_class : type[Analyser], receiver_statistics : list[ReceiverStatistics], sender_statistics : list[SenderStatistics]) -> tuple[float, object]:
+    # Includes construction, so conversion to columns is part of the NumPy analyser cost
+    start = time.perf_counter()
+    analyser = analyser_class(receiver_statistics, sender_statistics)
+    results = analyser.analyse(True)
+    return time.perf_counter() - start, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the testlatency analysers.")
+    parser.add_argument("--frames", type=int, action="append", metavar="N", help="Number of sender frames (repeatable, default: 10000, 100000, 1000000)")
+    parser.add_argument("--fps", type=int, default=30, help="Synthetic frame rate (default: 30)")
+    parser.add_argument("--loss", type=float, default=0.01, help="Fraction of frames lost while running (default: 0.01)")
+    args = parser.parse_args()
+    ok = True
+    for n_frames in args.frames or [10_000, 100_000, 1_000_000]:
+        receiver_statistics, sender_statistics = generate(n_frames, args.fps, args.loss)
+        dict_time, dict_results = timed(Analyser, receiver_statistics, sender_statistics)
+        numpy_time, numpy_results = timed(NumpyAnalyser, receiver_statistics, sender_statistics)
+        same = all(abs(a - b) < 1e-9 for a, b in zip(dict_results, numpy_results))  # type: ignore
+        ok = ok and same
+        print(f"testlatency: benchmark: frames={n_frames}, dict={dict_time:.3f}s, numpy={numpy_time:.3f}s, speedup={dict_time / numpy_time:.1f}x, identical={same}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+#
+# NTP-like clock offset estimation between the sender and receiver hosts, so latencies can be
+# computed when they do not share a clock. The sender runs a ClockSyncServer on a UDP port,
+# the receiver does a number of request/response exchanges and keeps the one with the smallest
+# round trip: its offset is within +/- half that round trip of the true offset.
+#
+# The receiver estimates again once the stream has ended, so the sender keeps answering after
+# it has finished, until the receiver says it is done or --clock-sync-linger seconds have passed.
+#
+
+PACKET = struct.Struct("<ddd")
+# Second field of the request that tells the server this receiver needs no more answers
+DONE = -1.0
+
+class ClockOffset(NamedTuple):
+    offset : float  # sender clock minus receiver clock, in seconds
+    error : float  # bound on the error of offset
+    rtt : float
+    wallclock : float  # receiver time of the estimate
+
+CLOCKSYNC_FILENAME = "testlatency_clocksync.json"
+
+class ClockSyncServer(threading.Thread):
+    def __init__(self, port : int, host : str = ""):
+        super().__init__(daemon=True)
+        self.name = "testlatency.ClockSyncServer"
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.5)
+        self.stop_requested = False
+        self.done = threading.Event()
+
+    def stop(self):
+        self.stop_requested = True
+
+    def linger(self, timeout : float) -> None:
+        # Keep answering until a receiver is done with its end estimate, or for at most `timeout` seconds
+        self.done.wait(timeout)
+        self.stop()
+
+    def run(self):
+        while not self.stop_requested:
+            try:
+                data, address = self.socket.recvfrom(PACKET.size)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            t1 = time.time()
+            if len(data) != PACKET.size:
+                continue
+            t0, flag, _ = PACKET.unpack(data)
+            if flag == DONE:
+                self.done.set()
+                continue
+            self.socket.sendto(PACKET.pack(t0, t1, time.time()), address)
+        self.socket.close()
+
+def estimate_offset(host : str, port : int, exchanges : int = 16, timeout : float = 1.0, done : bool = False) -> Optional[ClockOffset]:
+    # With `done`, tell the server afterwards that this was the last estimate
+    samples : List[ClockOffset] = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        for _ in range(exchanges):
+            t0 = time.time()
+            try:
+                s.sendto(PACKET.pack(t0, 0, 0), (host, port))
+                data = s.recv(PACKET.size)
+            except OSError:
+                continue
+            t3 = time.time()
+            echoed_t0, t1, t2 = PACKET.unpack(data)
+            if echoed_t0 != t0:
+                # Late answer to an earlier request
+                continue
+            rtt = (t3 - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - t3)) / 2
+            samples.append(ClockOffset(offset, rtt / 2, rtt, t3))
+            time.sleep(0.01)
+        if done:
+            try:
+                s.sendto(PACKET.pack(time.time(), DONE, 0), (host, port))
+            except OSError:
+                pass
+    if not samples:
+        return None
+    return min(samples, key=lambda sample: sample.rtt)
+
+def combine_offsets(before : Optional[ClockOffset], after : Optional[ClockOffset]) -> Optional[ClockOffset]:
+    #
+    # Estimates from the start and the end of a run: use their average, and widen the error
+    # bound with half the drift between them.
+    #
+    if before is None or after is None:
+        return before or after
+    drift = abs(after.offset - before.offset)
+    return ClockOffset(
+        (before.offset + after.offset) / 2,
+        max(before.error, after.error) + drift / 2,
+        min(before.rtt, after.rtt),
+        after.wallclock
+    )
+
+def save_clock_offset(logdir : str, offset : ClockOffset) -> None:
+    with open(os.path.join(logdir, CLOCKSYNC_FILENAME), "w") as fp:
+        json.dump(offset._asdict(), fp, indent=2)
+
+def load_clock_offset(logdir : str) -> Optional[ClockOffset]:
+    path = os.path.join(logdir, CLOCKSYNC_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fp:
+        return ClockOffset(**json.load(fp))
+
+def print_clock_offset(label : str, offset : Optional[ClockOffset]) -> None:
+    if offset is None:
+        print(f"testlatency: clocksync: {label}: no answer from the clock sync server", file=sys.stderr)
+        return
+    print(f"testlatency: clocksync: {label}: offset={offset.offset:.6f}, error={offset.error:.6f}, rtt={offset.rtt:.6f}", file=sys.stderr)
@@ -0,0 +1,178 @@
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from testlatency_recorder import FrameRecorder, StageRecorder
+from testlatency_statlog import StatisticsLogWriter, statistics_log_path
+
+#
+# Statistics collection over a TCP socket, for sender and receiver processes that do not share
+# a file system. Every recorder opens one connection to the collector (--mode collect) and sends
+# a JSON header line followed by its records, packed exactly as in a statistics log. The collector
+# writes them into statistics logs in its --logdir, so --mode analyse works on them unchanged.
+# A connection whose header has a "document" in stead of a record format carries one JSON file.
+# The collector only listens on localhost unless --collector-host says otherwise.
+#
+
+def parse_address(address : str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+class CollectorStream:
+    def __init__(self, address : str, header : Dict[str, Any]):
+        self.socket = socket.create_connection(parse_address(address))
+        self.socket.sendall((json.dumps(header) + "\n").encode())
+
+    def send(self, data : bytes) -> None:
+        self.socket.sendall(data)
+
+    def close(self) -> None:
+        self.socket.close()
+
+class _CollectorRecording:
+    #
+    # Keeps the records in memory (for analysis in this process), and sends them in batches
+    # of one flush interval, so the hot loop does not do a system call per record.
+    #
+    def _start_stream(self, address : str, name : str, fmt : str, fields : tuple[str, ...], labels : List[str], flush_interval : float) -> None:
+        self.record_struct = struct.Struct("<" + fmt)
+        self.stream = CollectorStream(address, {"name": name, "format": fmt, "fields": list(fields), "labels": labels})
+        self.buffer = bytearray()
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+
+    def _send(self, wallclock : float, *row : Any) -> None:
+        self.buffer += self.record_struct.pack(*row)
+        if wallclock - self.last_flush >= self.flush_interval:
+            self._flush()
+            self.last_flush = wallclock
+
+    def _flush(self) -> None:
+        if self.buffer:
+            try:
+                self.stream.send(bytes(self.buffer))
+            except OSError as e:
+                print(f"testlatency: collector: cannot send statistics: {e}", file=sys.stderr)
+            self.buffer.clear()
+
+    def close(self) -> None:
+        self._flush()
+        self.stream.close()
+
+class CollectorFrameRecorder(_CollectorRecording, FrameRecorder):
+    def __init__(self, address : str, name : str, record_type : type, flush_interval : float = 1.0):
+        FrameRecorder.__init__(self, record_type)
+        self._start_stream(address, name, "qdqq", self.fields, [], flush_interval)
+
+    def record(self, timestamp : int, wallclock : float, num : int, count : int) -> None:
+        FrameRecorder.record(self, timestamp, wallclock, num, count)
+        self._send(wallclock, timestamp, wallclock, num, count)
+
+class CollectorStageRecorder(_CollectorRecording, StageRecorder):
+    def __init__(self, address : str, name : str, record_type : type, stages : list[str], flush_interval : float = 1.0):
+        StageRecorder.__init__(self, record_type, stages)
+        self._start_stream(address, name, "qbqdq", self.fields, stages, flush_interval)
+
+    def record(self, timestamp : int, stage : str, tile : int, wallclock : float, nbytes : int) -> None:
+        StageRecorder.record(self, timestamp, stage, tile, wallclock, nbytes)
+        with self.lock:
+            self._send(wallclock, timestamp, self.stage_index[stage], tile, wallclock, nbytes)
+
+def send_document(address : str, filename : str, document : Any) -> None:
+    stream = CollectorStream(address, {"document": filename})
+    stream.send(json.dumps(document).encode())
+    stream.close()
+
+class _AnyRecord:
+    # Stand-in record type: the collector only needs the field names
+    def __init__(self, fields : List[str]):
+        self._fields = tuple(fields)
+
+def _check_name(name : Any) -> str:
+    # Names come from the network: they must not lead out of --logdir
+    if not isinstance(name, str) or not name or name != os.path.basename(name) or "/" in name or os.sep in name or ".." in name:
+        raise ValueError(f"invalid statistics name {name!r}")
+    return name
+
+class StatisticsCollector(threading.Thread):
+    #
+    # Accepts recorder connections until stopped, or until `idle_timeout` seconds after the
+    # last connection closed.
+    #
+    def __init__(self, port : int, logdir : str, idle_timeout : float = 5.0, host : str = "127.0.0.1"):
+        super().__init__(daemon=True)
+        self.name = "testlatency.StatisticsCollector"
+        self.logdir = logdir
+        self.idle_timeout = idle_timeout
+        self.server = socket.create_server((host, port))
+        self.server.settimeout(0.5)
+        self.stop_requested = False
+        self.lock = threading.Lock()
+        self.active = 0
+        self.streams : List[str] = []
+        self.last_close : Optional[float] = None
+
+    def stop(self):
+        self.stop_requested = True
+
+    def run(self):
+        while not self.stop_requested:
+            try:
+                connection, _ = self.server.accept()
+            except socket.timeout:
+                with self.lock:
+                    idle = self.active == 0 and self.last_close is not None and time.time() - self.last_close > self.idle_timeout
+                if idle:
+                    break
+                continue
+            with self.lock:
+                self.active += 1
+            threading.Thread(target=self._receive, args=(connection,), daemon=True).start()
+        self.server.close()
+        while True:
+            with self.lock:
+                if not self.active:
+                    break
+            time.sleep(0.1)
+
+    def _receive(self, connection : socket.socket) -> None:
+        try:
+            reader = connection.makefile("rb")
+            header = json.loads(reader.readline())
+            if "document" in header:
+                with open(os.path.join(self.logdir, _check_name(header["document"])), "wb") as fp:
+                    fp.write(reader.read())
+                with self.lock:
+                    self.streams.append(header["document"])
+                return
+            writer = StatisticsLogWriter(
+                statistics_log_path(self.logdir, _check_name(header["name"])),
+                _AnyRecord(header["fields"]),
+                header["format"],
+                header["labels"]
+            )
+            with self.lock:
+                self.streams.append(header["name"])
+            size = writer.record_struct.size
+            pending = b""
+            while True:
+                data = reader.read1(65536)
+                if not data:
+                    break
+                pending += data
+                whole = len(pending) - len(pending) % size
+                if whole:
+                    writer.append_packed(time.time(), pending[:whole])
+                    pending = pending[whole:]
+            writer.close()
+        except (OSError, ValueError) as e:
+            print(f"testlatency: collector: connection failed: {e}", file=sys.stderr)
+        finally:
+            connection.close()
+            with self.lock:
+                self.active -= 1
+                self.last_close = time.time()
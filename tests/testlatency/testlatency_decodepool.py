@@ -0,0 +1,158 @@
+import concurrent.futures
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Optional
+import cwipc
+import cwipc.codec
+
+#
+# Tiled streams decode every tile with its own cwipc_source_decoder, each with its own thread, so
+# with many tiles more decoders compete for the cores than there are cores. With --decode-pool the
+# tiles share one pool of --decode-workers decode threads (default: one per available core).
+# Every tile keeps a reader that fetches its buffers and hands them to the pool, and allows at
+# most --decode-queue buffers in decoding or decoded but not yet taken by the synchronizer: when
+# that many are out the reader stops fetching, so a slow synchronizer leaves buffers in the lldplay
+# source instead of piling up decoded point clouds. Each worker thread keeps its own decoder.
+#
+# End-to-end latency against tile count and decode workers:
+#
+#   python testlatency_sweep.py --grid tiles=1,2,4 --grid decode-pool=false,true --grid decode-workers=1,2,4 --compare decode-pool -- --tiled --duration 20
+#
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class DecodePool:
+    def __init__(self, workers : int = 0, verbose : bool = False):
+        self.workers = workers or available_cores()
+        self.verbose = verbose
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="testlatency.DecodePool")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.decoders : list[Any] = []
+        self.count_decoded = 0
+        self.count_failed = 0
+        self.decode_time = 0.0
+
+    def submit(self, packet : bytes) -> concurrent.futures.Future:
+        return self.executor.submit(self._decode, packet)
+
+    def _decode(self, packet : bytes) -> tuple[Optional[cwipc.cwipc_wrapper], float]:
+        # The point cloud, and when it was ready
+        start = time.time()
+        decoder = getattr(self.local, "decoder", None)
+        if decoder is None:
+            decoder = cwipc.codec.cwipc_new_decoder()
+            self.local.decoder = decoder
+            with self.lock:
+                self.decoders.append(decoder)
+        decoder.feed(packet)
+        pc = decoder.get() if decoder.available(True) else None
+        ready = time.time()
+        with self.lock:
+            self.decode_time += ready - start
+            if pc is None:
+                self.count_failed += 1
+            else:
+                self.count_decoded += 1
+        return pc, ready
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self.lock:
+            decoders, self.decoders = self.decoders, []
+        for decoder in decoders:
+            decoder.free()
+
+    def statistics(self) -> None:
+        mean = self.decode_time / self.count_decoded if self.count_decoded else 0
+        print(f"testlatency: decode pool: workers={self.workers}, decoded={self.count_decoded}, failed={self.count_failed}, decode_mean={mean:.4f}", file=sys.stderr)
+
+class PooledDecoder:
+    #
+    # Drop-in for cwipc_source_decoder on one tile source, decoding on a shared DecodePool.
+    # Decoded point clouds come out in fetch order, whatever order the workers finish in.
+    #
+    def __init__(self, source : Any, pool : DecodePool, depth : int = 2, verbose : bool = False):
+        self.source = source
+        self.pool = pool
+        self.verbose = verbose
+        self.queue : queue.Queue[concurrent.futures.Future] = queue.Queue()
+        # One slot per buffer in decoding or decoded, given back when get() takes it
+        self.slots = threading.Semaphore(max(1, depth))
+        self.pending : Optional[concurrent.futures.Future] = None
+        # When the point cloud last returned by get() was decoded, for the ready hop
+        self.last_ready : Optional[float] = None
+        self.reader : Optional[threading.Thread] = None
+        self.running = False
+        self.reader_done = False
+        self.count_fetched = 0
+        self.count_backpressure = 0
+
+    def start(self) -> None:
+        self.source.start()
+        self.running = True
+        self.reader = threading.Thread(target=self._run, name="testlatency.PooledDecoder", daemon=True)
+        self.reader.start()
+
+    def _run(self) -> None:
+        while self.running and not self.source.eof():
+            # Wait for room before fetching, so the buffer stays in the source until then
+            if not self.slots.acquire(blocking=False):
+                self.count_backpressure += 1
+                while self.running and not self.slots.acquire(timeout=0.1):
+                    pass
+                if not self.running:
+                    break
+            packet = self.source.get() if self.source.available(True) else None
+            if packet is None:
+                self.slots.release()
+                continue
+            self.count_fetched += 1
+            self.queue.put(self.pool.submit(packet))
+        self.reader_done = True
+
+    def stop(self) -> None:
+        self.running = False
+        if self.reader:
+            self.reader.join()
+            self.reader = None
+        self.source.stop()
+
+    def free(self) -> None:
+        # The tile source belongs to the multisource, which frees it
+        self.pending = None
+
+    def eof(self) -> bool:
+        return self.reader_done and self.pending is None and self.queue.empty()
+
+    def available(self, wait : bool) -> bool:
+        if self.pending is None:
+            try:
+                self.pending = self.queue.get(block=wait, timeout=0.1 if wait else None)
+            except queue.Empty:
+                return False
+        return True
+
+    def get(self) -> Optional[cwipc.cwipc_wrapper]:
+        # Blocks until the next point cloud is decoded, or the stream has ended
+        while not self.available(True):
+            if self.eof():
+                return None
+        assert self.pending
+        future, self.pending = self.pending, None
+        try:
+            pc, self.last_ready = future.result()
+        except concurrent.futures.CancelledError:
+            return None
+        finally:
+            self.slots.release()
+        return pc
+
+    def statistics(self) -> None:
+        print(f"testlatency: pooled decoder: fetched={self.count_fetched}, backpressure={self.count_backpressure}", file=sys.stderr)
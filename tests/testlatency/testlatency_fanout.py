@@ -0,0 +1,164 @@
+import argparse
+import bisect
+import concurrent.futures
+import copy
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Any, List, Optional
+from testlatency_receiver import ReceiverThread, ReceiverStatistics
+from testlatency_analyse import Analyser, AnalyserResults, AggregateResults, aggregate, print_aggregate, get_analyser_class
+from testlatency_histogram import LatencyHistogram
+from testlatency_statlog import StatisticsLogReader, statistics_log_path
+from testlatency_clocksync import ClockOffset
+
+#
+# Many receivers (viewers) pulling the same MPD from lldash-relay.
+# Every cwipc_source_lldplay decodes on its own, so receivers are spread over a pool of
+# worker processes, each running its share of ReceiverThreads concurrently.
+# Statistics come back through the statistics logs, in --logdir or a temporary directory of the session.
+#
+
+def _run_receivers(args : argparse.Namespace, session : int, names : List[str], start_times : List[float], stop_event : Any, worker_pids : Any) -> List[int]:
+    # Runs in a worker process
+    worker_pids.append(os.getpid())
+    threads : List[ReceiverThread] = []
+    for name, start_time in zip(names, start_times):
+        while time.time() < start_time and not stop_event.is_set():
+            time.sleep(min(0.1, start_time - time.time()))
+        if stop_event.is_set():
+            break
+        thread = ReceiverThread(args, name, session)
+        thread.start()
+        threads.append(thread)
+    while any(thread.is_alive() for thread in threads):
+        if stop_event.is_set():
+            for thread in threads:
+                thread.stop()
+        for thread in threads:
+            thread.join(0.1)
+    return [thread.exit_status for thread in threads] + [-1] * (len(names) - len(threads))
+
+class ReceiverPool(threading.Thread):
+    def __init__(self, args : argparse.Namespace, n_receivers : int, prefix : str, session : int, statdir : str):
+        super().__init__(daemon=True)
+        self.name = "testlatency.ReceiverPool"
+        self.args = args
+        self.n_receivers = n_receivers
+        self.session = session
+        self.n_processes = max(1, min(n_receivers, args.receiver_processes or os.cpu_count() or 1))
+        self.receiver_names = [f"{prefix}{i}" for i in range(n_receivers)]
+        self.exit_status = -1
+        self.exit_statuses : List[int] = []
+        self.statdir = statdir
+        # The spawn context does not inherit our running threads and native state
+        self.mp_context = multiprocessing.get_context("spawn")
+        # The manager process only runs from start() until the receivers are done
+        self.manager : Optional[Any] = None
+        self.stop_event : Optional[Any] = None
+        self.stop_requested = False
+        # Between stop() and the manager shutdown at the end of run()
+        self.lock = threading.Lock()
+        # For resource sampling
+        self.worker_pids : Any = []
+
+    def start(self):
+        self.manager = self.mp_context.Manager()
+        self.stop_event = self.manager.Event()
+        if self.stop_requested:
+            self.stop_event.set()
+        self.worker_pids = self.manager.list()
+        super().start()
+
+    def stop(self):
+        with self.lock:
+            self.stop_requested = True
+            if self.stop_event is not None:
+                self.stop_event.set()
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            # Keep the worker pids for the last resource sample
+            assert self.manager is not None
+            with self.lock:
+                self.worker_pids = list(self.worker_pids)
+                self.stop_event = None
+            self.manager.shutdown()
+            self.manager = None
+
+    def _run(self):
+        worker_args = copy.copy(self.args)
+        worker_args.logdir = self.statdir
+        start = time.time()
+        start_times = [start + i * self.args.receiver_ramp for i in range(self.n_receivers)]
+        if self.args.verbose:
+            print(f"testlatency: receiver pool: {self.n_receivers} receivers in {self.n_processes} processes", file=sys.stderr)
+        futures = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.n_processes, mp_context=self.mp_context) as pool:
+            for p in range(self.n_processes):
+                names = self.receiver_names[p::self.n_processes]
+                times = start_times[p::self.n_processes]
+                futures.append(pool.submit(_run_receivers, worker_args, self.session, names, times, self.stop_event, self.worker_pids))
+            statuses = [0] * self.n_receivers
+            for p, future in enumerate(futures):
+                try:
+                    for i, status in zip(range(p, self.n_receivers, self.n_processes), future.result()):
+                        statuses[i] = status
+                except Exception as e:
+                    print(f"testlatency: receiver pool: worker {p} failed: {e}", file=sys.stderr)
+                    for i in range(p, self.n_receivers, self.n_processes):
+                        statuses[i] = -1
+        self.exit_statuses = statuses
+        self.exit_status = 0 if all(status == 0 for status in statuses) else 1
+
+    def receiver_statistics(self) -> List[StatisticsLogReader]:
+        result = []
+        for name in self.receiver_names:
+            path = statistics_log_path(self.statdir, name)
+            if os.path.exists(path):
+                result.append(StatisticsLogReader(path, ReceiverStatistics))
+        return result
+
+def analyse_fanout(args : argparse.Namespace, receiver_statistics : List[Any], sender_statistics : Any, label : str = "all receivers", clock_offset : Optional[ClockOffset] = None) -> AggregateResults:
+    analysers : List[Analyser] = []
+    results : List[AnalyserResults] = []
+    analyser_class = get_analyser_class(args.analyser)
+    for i, statistics in enumerate(receiver_statistics):
+        analyser = analyser_class(statistics, sender_statistics, clock_offset=clock_offset)
+        r = analyser.analyse(not args.all_latencies)
+        analysers.append(analyser)
+        results.append(r)
+        if args.verbose or len(receiver_statistics) <= 16:
+            print(f"testlatency: receiver {i}: count={len(statistics)}, count_lost_running={r.count_lost_running}, latency_p50={r.latency_p50:.3f}, latency_p99={r.latency_p99:.3f}, latency_max={r.latency_max:.3f}")
+    aggregated = aggregate(analysers, results)
+    print_aggregate(label, aggregated)
+    print_scaling(receiver_statistics, sender_statistics, clock_offset)
+    return aggregated
+
+def print_scaling(receiver_statistics : List[Any], sender_statistics : Any, clock_offset : Optional[ClockOffset] = None):
+    #
+    # Latency as a function of the number of concurrently active receivers. With --receiver-ramp
+    # receivers join one by one, so a single run shows how the relay degrades with viewer count.
+    # As in the Analyser, the clock offset converts receiver wallclocks to the sender clock.
+    #
+    offset = clock_offset.offset if clock_offset else 0.0
+    sender_wallclocks = {send.timestamp: send.sender_wallclock for send in sender_statistics}
+    firsts = sorted(statistics[0].receiver_wallclock for statistics in receiver_statistics if len(statistics))
+    lasts = sorted(statistics[-1].receiver_wallclock for statistics in receiver_statistics if len(statistics))
+    histograms : dict[int, LatencyHistogram] = {}
+    for statistics in receiver_statistics:
+        for recv in statistics:
+            if recv.timestamp not in sender_wallclocks:
+                continue
+            # Joined at or before this frame, minus those that already left
+            active = bisect.bisect_right(firsts, recv.receiver_wallclock) - bisect.bisect_left(lasts, recv.receiver_wallclock)
+            histograms.setdefault(active, LatencyHistogram()).record(recv.receiver_wallclock + offset - sender_wallclocks[recv.timestamp])
+    if len(histograms) <= 1:
+        return
+    for active in sorted(histograms):
+        h = histograms[active]
+        print(f"testlatency: active_receivers={active}: frames={h.count}, latency_p50={h.percentile(0.5):.3f}, latency_p99={h.percentile(0.99):.3f}, latency_max={h.max:.3f}")
@@ -0,0 +1,114 @@
+import array
+import math
+from typing import Optional
+
+class LatencyHistogram:
+    #
+    # Fixed-memory log-bucketed histogram, in the spirit of HdrHistogram.
+    # Bucket boundaries grow geometrically by (1 + precision), so every recorded value
+    # is reproduced with at most `precision` relative error, whatever the run length.
+    # Values below `lowest` (including negative ones) go into bucket 0, values above `highest`
+    # into the last bucket. Exact min, max, mean and stddev are kept on the side.
+    #
+    def __init__(self, lowest : float = 0.0001, highest : float = 1000.0, precision : float = 0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.log_base = math.log1p(precision)
+        self.n_buckets = int(math.log(highest / lowest) / self.log_base) + 2
+        self.counts = array.array('Q', bytes(8 * self.n_buckets))
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def _index(self, value : float) -> int:
+        if value <= self.lowest:
+            return 0
+        return min(self.n_buckets - 1, int(math.log(value / self.lowest) / self.log_base) + 1)
+
+    def _value(self, index : int) -> float:
+        if index == 0:
+            return self.lowest
+        # Geometric middle of the bucket
+        return self.lowest * math.exp((index - 0.5) * self.log_base)
+
+    def record(self, value : float) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        # Welford's online algorithm, numerically stable
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+
+    def merge(self, other : "LatencyHistogram") -> None:
+        assert self.n_buckets == other.n_buckets and self.lowest == other.lowest
+        if other.count == 0:
+            return
+        for i in range(self.n_buckets):
+            self.counts[i] += other.counts[i]
+        total = self.count + other.count
+        delta = other._mean - self._mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / total
+        self._mean += delta * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self) -> float:
+        return self._mean if self.count else 0
+
+    def stddev(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0
+
+    def percentile(self, fraction : float) -> float:
+        if self.count == 0:
+            return 0
+        wanted = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for i in range(self.n_buckets):
+            seen += self.counts[i]
+            if seen >= wanted:
+                return min(self.max, max(self.min, self._value(i)))
+        return self.max
+
+    def count_above(self, threshold : float) -> int:
+        first = self._index(threshold) + 1
+        return sum(self.counts[first:])
+
+class ReceiverMetrics:
+    #
+    # Incrementally updated receiver-side metrics, O(1) memory per run: frame interval
+    # histogram plus RFC 3550 style interarrival jitter (smoothed difference between receive
+    # interval and timestamp interval). Latency is not kept here: the Analyser needs the sender
+    # wallclocks, the clock offset and the warm-up, so it works from the statistics.
+    #
+    def __init__(self):
+        self.interval_histogram = LatencyHistogram()
+        self.jitter = 0.0
+        self.last_wallclock : Optional[float] = None
+        self.last_timestamp : Optional[int] = None
+
+    def record(self, timestamp_ms : int, wallclock : float) -> None:
+        if self.last_wallclock is not None and self.last_timestamp is not None:
+            interval = wallclock - self.last_wallclock
+            self.interval_histogram.record(interval)
+            transit_delta = interval - (timestamp_ms - self.last_timestamp) / 1000.0
+            self.jitter += (abs(transit_delta) - self.jitter) / 16
+        self.last_wallclock = wallclock
+        self.last_timestamp = timestamp_ms
+
+    def stall_threshold(self, factor : float = 2.0) -> float:
+        return factor * self.interval_histogram.percentile(0.5)
+
+    def stall_count(self, factor : float = 2.0) -> int:
+        if self.interval_histogram.count == 0:
+            return 0
+        return self.interval_histogram.count_above(self.stall_threshold(factor))
+
+    def stall_max(self) -> float:
+        return self.interval_histogram.max if self.interval_histogram.count else 0
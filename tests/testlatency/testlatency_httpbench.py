@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import datetime
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from typing import List, NamedTuple, Optional
+from testlatency_histogram import LatencyHistogram
+from testlatency_server import mpd_url
+
+#
+# Relay-only benchmark: pure asyncio HTTP/1.1 clients that poll the MPD and pull segments
+# from lldash-relay, without any cwipc decoding. One event loop easily drives thousands of
+# connections, so this scales much further than full receivers on one machine.
+#
+
+class HttpResponse(NamedTuple):
+    status : int
+    start : float
+    ttfb : float
+    duration : float
+    nbytes : int
+    chunk_times : List[float]
+    body : bytes
+
+class HttpConnection:
+    #
+    # One persistent (keep-alive) connection. Responses may be chunked, which is how the relay
+    # delivers low-latency segments while they are still being produced: we record the arrival
+    # time of every chunk.
+    #
+    def __init__(self, host : str, port : int):
+        self.host = host
+        self.port = port
+        self.reader : Optional[asyncio.StreamReader] = None
+        self.writer : Optional[asyncio.StreamWriter] = None
+
+    async def _connect(self) -> None:
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method : str, path : str, body : Optional[bytes] = None, keep_body : bool = False) -> HttpResponse:
+        await self._connect()
+        assert self.reader and self.writer
+        headers = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if body is not None:
+            headers += f"Content-Length: {len(body)}\r\n"
+        self.writer.write((headers + "\r\n").encode())
+        if body is not None:
+            self.writer.write(body)
+        start = time.time()
+        try:
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("connection closed by server")
+            ttfb = time.time() - start
+            status = int(status_line.split()[1])
+            content_length = -1
+            chunked = False
+            close = False
+            while True:
+                line = (await self.reader.readline()).strip()
+                if not line:
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                name = name.strip().lower()
+                value = value.strip().lower()
+                if name == "content-length":
+                    content_length = int(value)
+                elif name == "transfer-encoding" and "chunked" in value:
+                    chunked = True
+                elif name == "connection" and value == "close":
+                    close = True
+            chunk_times : List[float] = []
+            parts : List[bytes] = []
+            nbytes = 0
+            if chunked:
+                while True:
+                    size = int((await self.reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        await self.reader.readline()
+                        break
+                    data = await self.reader.readexactly(size)
+                    await self.reader.readline()
+                    chunk_times.append(time.time() - start)
+                    nbytes += size
+                    if keep_body:
+                        parts.append(data)
+            elif content_length >= 0:
+                while nbytes < content_length:
+                    data = await self.reader.read(min(65536, content_length - nbytes))
+                    if not data:
+                        raise ConnectionError("connection closed during body")
+                    chunk_times.append(time.time() - start)
+                    nbytes += len(data)
+                    if keep_body:
+                        parts.append(data)
+            else:
+                close = True
+                while True:
+                    data = await self.reader.read(65536)
+                    if not data:
+                        break
+                    chunk_times.append(time.time() - start)
+                    nbytes += len(data)
+                    if keep_body:
+                        parts.append(data)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            await self.close()
+            raise
+        if close:
+            await self.close()
+        return HttpResponse(status, start, ttfb, time.time() - start, nbytes, chunk_times, b"".join(parts))
+
+class Track(NamedTuple):
+    media : str
+    representation_id : str
+    start_number : int
+    segment_duration : float
+
+class Manifest(NamedTuple):
+    tracks : List[Track]
+    availability_start : Optional[float]
+    update_period : Optional[float]
+
+def parse_duration(value : str) -> Optional[float]:
+    # ISO 8601 durations as used in MPDs, e.g. PT1S or PT1M30.5S
+    match = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", value.strip())
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds or 0)
+
+def parse_mpd(data : bytes) -> Manifest:
+    #
+    # Find one track per adaptation set (its first representation), and the availability start time
+    # and minimum update period of a live MPD, if any.
+    #
+    root = ET.fromstring(data)
+    namespace = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+    availability_start = None
+    if "availabilityStartTime" in root.attrib:
+        stamp = root.attrib["availabilityStartTime"].replace("Z", "+00:00")
+        availability_start = datetime.datetime.fromisoformat(stamp).timestamp()
+    update_period = parse_duration(root.attrib["minimumUpdatePeriod"]) if "minimumUpdatePeriod" in root.attrib else None
+    tracks : List[Track] = []
+    for adaptation_set in root.iter(namespace + "AdaptationSet"):
+        representation = adaptation_set.find(namespace + "Representation")
+        if representation is None:
+            continue
+        template = representation.find(namespace + "SegmentTemplate")
+        if template is None:
+            template = adaptation_set.find(namespace + "SegmentTemplate")
+        if template is None or "media" not in template.attrib:
+            continue
+        timescale = int(template.attrib.get("timescale", "1"))
+        duration = int(template.attrib.get("duration", "0")) / timescale
+        tracks.append(Track(
+            template.attrib["media"],
+            representation.attrib.get("id", ""),
+            int(template.attrib.get("startNumber", "1")),
+            duration
+        ))
+    return Manifest(tracks, availability_start, update_period)
+
+def segment_path(base_path : str, track : Track, number : int) -> str:
+    def number_format(match : re.Match) -> str:
+        return (match.group(1) or "%d") % number
+    media = track.media.replace("$RepresentationID$", track.representation_id)
+    media = re.sub(r"\$Number(%0\d+d)?\$", number_format, media)
+    return urllib.parse.urljoin(base_path, media)
+
+class HttpBenchResults(NamedTuple):
+    clients : int
+    requests : int
+    errors : int
+    not_ready : int
+    segments : int
+    nbytes : int
+    duration : float
+    ttfb : LatencyHistogram
+    download : LatencyHistogram
+    chunk_interval : LatencyHistogram
+    segment_delay : LatencyHistogram
+
+class HttpBenchmark:
+    def __init__(self, args : argparse.Namespace, session : int = 0):
+        self.args = args
+        url = urllib.parse.urlparse(mpd_url(args, session))
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port or 80
+        self.mpd_path = url.path
+        self.stop_requested = False
+        self.requests = 0
+        self.errors = 0
+        self.not_ready = 0
+        self.segments = 0
+        self.nbytes = 0
+        self.ttfb = LatencyHistogram()
+        self.download = LatencyHistogram()
+        self.chunk_interval = LatencyHistogram()
+        self.segment_delay = LatencyHistogram()
+
+    async def _fetch_mpd(self, connection : HttpConnection, retry : bool = True) -> Optional[Manifest]:
+        while not self.stop_requested:
+            try:
+                response = await connection.request("GET", self.mpd_path, keep_body=True)
+                self.requests += 1
+                if response.status == 200:
+                    manifest = parse_mpd(response.body)
+                    if manifest.tracks:
+                        return manifest
+            except (OSError, asyncio.IncompleteReadError, ValueError, ET.ParseError):
+                self.errors += 1
+            if not retry:
+                break
+            await asyncio.sleep(self.args.http_poll_interval)
+        return None
+
+    async def _pull(self, track : Track, availability_start : Optional[float]) -> None:
+        connection = HttpConnection(self.host, self.port)
+        number = track.start_number
+        if availability_start is not None and track.segment_duration > 0:
+            # Start at the live edge
+            number += max(0, int((time.time() - availability_start) / track.segment_duration))
+        stale_since = time.time()
+        stale_timeout = max(2.0, 3 * track.segment_duration)
+        try:
+            while not self.stop_requested:
+                path = segment_path(self.mpd_path, track, number)
+                try:
+                    response = await connection.request("GET", path)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    self.errors += 1
+                    await asyncio.sleep(self.args.http_poll_interval)
+                    continue
+                self.requests += 1
+                if response.status == 404:
+                    # Not published yet. With --long-poll the relay holds the request in stead.
+                    self.not_ready += 1
+                    if time.time() - stale_since > stale_timeout:
+                        # Probably an old segment that the relay already dropped: move one towards the live edge,
+                        # and give that one the full timeout too
+                        number += 1
+                        stale_since = time.time()
+                    await asyncio.sleep(self.args.http_poll_interval)
+                    continue
+                if response.status != 200:
+                    self.errors += 1
+                    number += 1
+                    continue
+                stale_since = time.time()
+                self.segments += 1
+                self.nbytes += response.nbytes
+                self.ttfb.record(response.ttfb)
+                self.download.record(response.duration)
+                for previous, current in zip(response.chunk_times, response.chunk_times[1:]):
+                    self.chunk_interval.record(current - previous)
+                if availability_start is not None and track.segment_duration > 0:
+                    # First byte relative to the moment the segment started being produced
+                    produced = availability_start + (number - track.start_number) * track.segment_duration
+                    self.segment_delay.record(response.start + response.ttfb - produced)
+                number += 1
+        finally:
+            await connection.close()
+
+    async def _client(self) -> None:
+        #
+        # Like a DASH client, re-fetch a live MPD every minimumUpdatePeriod. When its timeline changed,
+        # for example at every rate step of --mode publish, continue at the live edge of the new one.
+        #
+        connection = HttpConnection(self.host, self.port)
+        manifest = await self._fetch_mpd(connection)
+        try:
+            while manifest is not None and not self.stop_requested:
+                pulls = [asyncio.ensure_future(self._pull(track, manifest.availability_start)) for track in manifest.tracks]
+                if not manifest.update_period:
+                    await asyncio.gather(*pulls)
+                    break
+                changed = None
+                while changed is None and not self.stop_requested and not all(pull.done() for pull in pulls):
+                    await asyncio.sleep(manifest.update_period)
+                    update = await self._fetch_mpd(connection, retry=False)
+                    if update is not None and update[:2] != manifest[:2]:
+                        changed = update
+                for pull in pulls:
+                    pull.cancel()
+                await asyncio.gather(*pulls, return_exceptions=True)
+                manifest = changed
+        finally:
+            await connection.close()
+
+    async def run_async(self, duration : float) -> HttpBenchResults:
+        start = time.time()
+        clients = [asyncio.ensure_future(self._client()) for _ in range(self.args.http_clients)]
+        while time.time() - start < duration and not self.stop_requested:
+            await asyncio.sleep(0.1)
+        self.stop_requested = True
+        await asyncio.wait(clients, timeout=max(1.0, self.args.long_poll / 1000.0 + 1.0))
+        for client in clients:
+            client.cancel()
+        return HttpBenchResults(
+            self.args.http_clients, self.requests, self.errors, self.not_ready, self.segments, self.nbytes,
+            time.time() - start, self.ttfb, self.download, self.chunk_interval, self.segment_delay
+        )
+
+def _raise_file_limit() -> None:
+    # Thousands of connections need thousands of file descriptors
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class HttpBenchThread(threading.Thread):
+    #
+    # Drop-in for ReceiverThread in a session
+    #
+    def __init__(self, args : argparse.Namespace, session : int = 0):
+        super().__init__(daemon=True)
+        self.name = "testlatency.HttpBenchThread"
+        self.args = args
+        self.exit_status = -1
+        self.benchmark = HttpBenchmark(args, session)
+        self.results : Optional[HttpBenchResults] = None
+
+    def stop(self):
+        self.benchmark.stop_requested = True
+
+    def run(self):
+        _raise_file_limit()
+        if self.args.verbose:
+            print(f"testlatency: httpbench: {self.args.http_clients} clients", file=sys.stderr)
+        self.results = asyncio.run(self.benchmark.run_async(self.args.duration))
+        self.exit_status = 0
+
+def print_httpbench(results : HttpBenchResults) -> None:
+    mbps = results.nbytes / results.duration / 1e6 if results.duration else 0
+    print(f"testlatency: httpbench: clients={results.clients}, requests={results.requests}, errors={results.errors}, not_ready={results.not_ready}, segments={results.segments}, MBps={mbps:.3f}")
+    for name, h in [("ttfb", results.ttfb), ("download", results.download), ("chunk_interval", results.chunk_interval), ("segment_delay", results.segment_delay)]:
+        if h.count:
+            print(f"testlatency: httpbench: {name}: count={h.count}, min={h.min:.3f}, p50={h.percentile(0.5):.3f}, p90={h.percentile(0.9):.3f}, p99={h.percentile(0.99):.3f}, max={h.max:.3f}")
+
+def judge_httpbench(results : HttpBenchResults) -> bool:
+    if results.segments == 0:
+        print("testlatency: judge: httpbench received no segments", file=sys.stderr)
+        return False
+    if results.errors > 0.01 * results.requests:
+        print(f"testlatency: judge: httpbench {results.errors} errors, more than 1% of requests", file=sys.stderr)
+        return False
+    return True
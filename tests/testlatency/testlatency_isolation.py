@@ -0,0 +1,116 @@
+import argparse
+import copy
+import multiprocessing
+import sys
+import threading
+from typing import Any, Optional
+from testlatency_sender import SenderThread, SenderStatistics
+from testlatency_receiver import ReceiverThread, ReceiverStatistics
+from testlatency_probes import StageStatistics
+from testlatency_statlog import StatisticsLogReader, statistics_log_path
+
+#
+# --isolation process: the sender and the receiver each run in their own interpreter, so the
+# Python work in one loop does not hold the GIL while the other is trying to take its timestamp.
+# Statistics are shared through the memory mapped statistics logs: the child writes them, we
+# map the same files and can read them while the child is still running.
+#
+
+def _run_in_process(thread_class : type, args : argparse.Namespace, name : str, session : int, stop_event : Any, exit_status : Any) -> None:
+    # Runs in the child process
+    thread = thread_class(args, name, session)
+    thread.start()
+    while thread.is_alive():
+        if stop_event.is_set():
+            thread.stop()
+        thread.join(0.1)
+    exit_status.value = thread.exit_status
+
+class IsolatedThread(threading.Thread):
+    #
+    # Drop-in for SenderThread or ReceiverThread: runs it in a spawned process and exposes
+    # its statistics logs as `statistics` and `stage_statistics`. The logs are written to
+    # `statdir`, which belongs to the caller.
+    #
+    def __init__(self, thread_class : type, record_type : type, args : argparse.Namespace, name : str, session : int, statdir : str):
+        super().__init__(daemon=True)
+        self.name = f"testlatency.Isolated{thread_class.__name__}"
+        self.args = args
+        self.thread_class = thread_class
+        self.record_type = record_type
+        self.process_name = name
+        self.session = session
+        self.statdir = statdir
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.stop_event = self.mp_context.Event()
+        self.process_exit_status = self.mp_context.Value("i", -1)
+        self.exit_status = -1
+        self.pid : Optional[int] = None
+        self.metrics = None
+        self._statistics : Optional[StatisticsLogReader] = None
+        self._stage_statistics : Optional[StatisticsLogReader] = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        child_args = copy.copy(self.args)
+        child_args.logdir = self.statdir
+        child_args.collector = ""
+        process = self.mp_context.Process(
+            target=_run_in_process,
+            args=(self.thread_class, child_args, self.process_name, self.session, self.stop_event, self.process_exit_status),
+            name=self.name,
+            daemon=True
+        )
+        process.start()
+        self.pid = process.pid
+        process.join()
+        if process.exitcode != 0:
+            print(f"testlatency: {self.process_name} process exited with exit code {process.exitcode}", file=sys.stderr)
+            self.exit_status = process.exitcode or 1
+        else:
+            self.exit_status = self.process_exit_status.value
+
+    def _open_log(self, name : str, record_type : type) -> Optional[StatisticsLogReader]:
+        path = statistics_log_path(self.statdir, name)
+        try:
+            return StatisticsLogReader(path, record_type, live=True)
+        except (OSError, ValueError):
+            # Not created yet, or its header is still being written
+            return None
+
+    @property
+    def statistics(self) -> Any:
+        # Readable while the process runs: every access picks up the records added since the last
+        if self._statistics is None:
+            self._statistics = self._open_log(self.process_name, self.record_type)
+        else:
+            self._statistics.refresh()
+        return self._statistics if self._statistics is not None else []
+
+    @property
+    def stage_statistics(self) -> Any:
+        if self._stage_statistics is None:
+            self._stage_statistics = self._open_log(f"{self.process_name}_stages", StageStatistics)
+        else:
+            self._stage_statistics.refresh()
+        return self._stage_statistics if self._stage_statistics is not None else []
+
+    def log_statistics(self, suffix : str, record_type : type) -> Any:
+        # Any other statistics log of the thread, such as the receiver "switches", once the process is done
+        reader = self._open_log(f"{self.process_name}_{suffix}", record_type)
+        return reader if reader is not None else []
+
+    def close(self) -> None:
+        # Unmap the statistics logs, once they have been analysed
+        for reader in (self._statistics, self._stage_statistics):
+            if reader is not None:
+                reader.close()
+        self._statistics = self._stage_statistics = None
+
+def isolated_sender(args : argparse.Namespace, name : str, session : int, statdir : str) -> IsolatedThread:
+    return IsolatedThread(SenderThread, SenderStatistics, args, name, session, statdir)
+
+def isolated_receiver(args : argparse.Namespace, name : str, session : int, statdir : str) -> IsolatedThread:
+    return IsolatedThread(ReceiverThread, ReceiverStatistics, args, name, session, statdir)
@@ -0,0 +1,128 @@
+import argparse
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+from testlatency_receiver import ReceiverThread
+from testlatency_histogram import LatencyHistogram
+from testlatency_probes import STAGE_FETCHED, STAGE_DECODED
+from testlatency_steadystate import SteadyStateDetector, EVENT_WARMUP_END
+
+#
+# Join (tune-in) benchmark: receivers repeatedly join the running stream, stay for a while
+# and leave again. For every join we measure how long it takes until the first segment data
+# arrives, until the first frame is decoded and delivered, and until the latency has settled.
+#
+
+class JoinResults(NamedTuple):
+    join : int
+    frames : int
+    time_to_first_fetch : float
+    time_to_first_decode : float
+    time_to_first_frame : float
+    time_to_converge : float
+    first_latency : float
+    steady_latency : float
+
+def analyse_join(join : int, start_time : float, receiver : ReceiverThread, sender_wallclocks : Dict[int, float]) -> JoinResults:
+    first_fetch = first_decode = -1.0
+    for stage in receiver.stage_statistics:
+        if stage.stage == STAGE_FETCHED and (first_fetch < 0 or stage.wallclock < first_fetch):
+            first_fetch = stage.wallclock
+        elif stage.stage == STAGE_DECODED and (first_decode < 0 or stage.wallclock < first_decode):
+            first_decode = stage.wallclock
+    frames = list(receiver.statistics)
+    latencies = [recv.receiver_wallclock - sender_wallclocks[recv.timestamp] for recv in frames if recv.timestamp in sender_wallclocks]
+    wallclocks = [recv.receiver_wallclock for recv in frames if recv.timestamp in sender_wallclocks]
+    # Joins are short, so use smaller windows than for a whole run
+    detector = SteadyStateDetector(window=10)
+    detector.extend(latencies)
+    warmup_end = detector.finish()
+    converged = any(event.kind == EVENT_WARMUP_END for event in detector.events)
+    return JoinResults(
+        join,
+        len(frames),
+        first_fetch - start_time if first_fetch >= 0 else -1,
+        first_decode - start_time if first_decode >= 0 else -1,
+        frames[0].receiver_wallclock - start_time if frames else -1,
+        wallclocks[warmup_end] - start_time if converged else -1,
+        latencies[0] if latencies else -1,
+        detector.baseline if converged and detector.baseline is not None else statistics.median(latencies) if latencies else -1,
+    )
+
+class JoinBenchmark(threading.Thread):
+    #
+    # Drop-in for ReceiverThread in a session. Every join is a fresh ReceiverThread, so a fresh
+    # cwipc_source_lldplay that has to fetch the MPD and find the live edge.
+    #
+    def __init__(self, args : argparse.Namespace, sender : Any, prefix : str = "", session : int = 0):
+        super().__init__(daemon=True)
+        self.name = "testlatency.JoinBenchmark"
+        self.args = args
+        # The sender thread, its statistics are only read after every join (they may be a log another process is writing)
+        self.sender = sender
+        # Sender wallclock per timestamp, extended after every join with what the sender recorded since
+        self.sender_wallclocks : Dict[int, float] = {}
+        self.sender_index = 0
+        self.prefix = prefix
+        self.session = session
+        self.exit_status = -1
+        self.stop_requested = False
+        self.current : Optional[ReceiverThread] = None
+        self.results : List[JoinResults] = []
+
+    def stop(self):
+        self.stop_requested = True
+        if self.current:
+            self.current.stop()
+
+    def run(self):
+        self.exit_status = 0
+        for join in range(self.args.joins):
+            if self.stop_requested:
+                break
+            receiver = ReceiverThread(self.args, f"{self.prefix}join{join}", self.session)
+            self.current = receiver
+            start_time = time.time()
+            receiver.start()
+            deadline = start_time + self.args.join_duration
+            while receiver.is_alive() and time.time() < deadline and not self.stop_requested:
+                receiver.join(0.1)
+            receiver.stop()
+            receiver.join()
+            self.current = None
+            if receiver.exit_status != 0:
+                self.exit_status = receiver.exit_status
+            self._update_sender_wallclocks()
+            result = analyse_join(join, start_time, receiver, self.sender_wallclocks)
+            self.results.append(result)
+            if self.args.verbose:
+                print(f"testlatency: join {join}: {result}", file=sys.stderr)
+            time.sleep(self.args.join_interval)
+
+    def _update_sender_wallclocks(self) -> None:
+        #
+        # The sender is still recording: read the new records one by one, by index, so we never
+        # hold on to its storage while it grows it.
+        #
+        statistics = self.sender.statistics
+        count = len(statistics)
+        for index in range(self.sender_index, count):
+            send = statistics[index]
+            self.sender_wallclocks[send.timestamp] = send.sender_wallclock
+        self.sender_index = count
+
+def print_joins(results : List[JoinResults]) -> bool:
+    for name in ["time_to_first_fetch", "time_to_first_decode", "time_to_first_frame", "time_to_converge", "first_latency", "steady_latency"]:
+        h = LatencyHistogram()
+        for r in results:
+            value = getattr(r, name)
+            if value >= 0:
+                h.record(value)
+        if h.count:
+            print(f"testlatency: joins: {name}: count={h.count}, min={h.min:.3f}, p50={h.percentile(0.5):.3f}, p90={h.percentile(0.9):.3f}, p99={h.percentile(0.99):.3f}, max={h.max:.3f}")
+    failed = sum(1 for r in results if r.frames == 0)
+    unconverged = sum(1 for r in results if r.frames > 0 and r.time_to_converge < 0)
+    print(f"testlatency: joins: count={len(results)}, failed={failed}, unconverged={unconverged}")
+    return len(results) > 0 and failed == 0
@@ -0,0 +1,208 @@
+import collections
+import http.server
+import sys
+import threading
+import time
+from typing import Callable, Deque, Dict, NamedTuple, Optional
+
+#
+# Live metrics during a run: rolling-window fps, latency percentiles, loss and bandwidth,
+# updated from the sender and receiver report() calls and served in Prometheus text format
+# on http://<--metrics-host>:<--metrics-port>/metrics, so long soak runs can be watched and alerted on.
+# Receivers running in --receivers worker processes are not included. Loss is per receiver, against
+# the frames sent in its own session.
+#
+
+class MetricsSnapshot(NamedTuple):
+    window : float
+    frames_sent : int
+    frames_received : int
+    fps_sent : float
+    fps_received : float
+    latency_p50 : float
+    latency_p90 : float
+    latency_p99 : float
+    latency_max : float
+    loss : float
+    ingest_bytes_per_second : float
+
+class RollingMetrics:
+    def __init__(self, window : float = 10.0, grace : float = 1.0):
+        self.window = window
+        #
+        # Frames sent less recently than the rolling p99 latency, or `grace` seconds when that is
+        # shorter, may still be underway: they are not counted as lost
+        #
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.sent : Dict[int, Deque[tuple[float, int]]] = {}
+        self.received : Dict[str, Deque[tuple[float, int]]] = {}
+        self.receiver_sessions : Dict[str, int] = {}
+        self.latencies : Deque[tuple[float, float]] = collections.deque()
+        self.pushed : Deque[tuple[float, int]] = collections.deque()
+
+    def _trim(self, queue : Deque, now : float) -> None:
+        while queue and queue[0][0] < now - self.window:
+            queue.popleft()
+
+    def record_sent(self, session : int, timestamp : int, wallclock : float) -> None:
+        with self.lock:
+            self.frames_sent += 1
+            sent = self.sent.setdefault(session, collections.deque())
+            sent.append((wallclock, int(timestamp)))
+            self._trim(sent, wallclock)
+
+    def record_pushed(self, nbytes : int, wallclock : float) -> None:
+        with self.lock:
+            self.pushed.append((wallclock, nbytes))
+            self._trim(self.pushed, wallclock)
+
+    def record_received(self, receiver_name : str, session : int, timestamp_ms : int, wallclock : float) -> None:
+        with self.lock:
+            self.frames_received += 1
+            self.receiver_sessions[receiver_name] = session
+            received = self.received.setdefault(receiver_name, collections.deque())
+            received.append((wallclock, timestamp_ms))
+            self._trim(received, wallclock)
+            # Sender and receivers share the clock, the timestamp is the capture time
+            self.latencies.append((wallclock, wallclock - timestamp_ms / 1000.0))
+            self._trim(self.latencies, wallclock)
+
+    def snapshot(self) -> MetricsSnapshot:
+        now = time.time()
+        with self.lock:
+            for queue in [self.latencies, self.pushed] + list(self.sent.values()) + list(self.received.values()):
+                self._trim(queue, now)
+            latencies = sorted(latency for _, latency in self.latencies)
+            def percentile(fraction : float) -> float:
+                return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0
+            grace = max(self.grace, percentile(0.99))
+            losses = []
+            for receiver_name, received in self.received.items():
+                sent = self.sent.get(self.receiver_sessions[receiver_name], ())
+                due = [timestamp for wallclock, timestamp in sent if wallclock < now - grace]
+                timestamps = set(timestamp for _, timestamp in received)
+                if due:
+                    losses.append(sum(1 for timestamp in due if timestamp not in timestamps) / len(due))
+            n_receivers = max(1, len(self.received))
+            pushed = sum(nbytes for _, nbytes in self.pushed)
+            return MetricsSnapshot(
+                self.window,
+                self.frames_sent,
+                self.frames_received,
+                sum(len(sent) for sent in self.sent.values()) / self.window,
+                sum(len(received) for received in self.received.values()) / n_receivers / self.window,
+                percentile(0.5),
+                percentile(0.9),
+                percentile(0.99),
+                latencies[-1] if latencies else 0,
+                sum(losses) / len(losses) if losses else 0,
+                pushed / self.window,
+            )
+
+    def prometheus(self) -> str:
+        s = self.snapshot()
+        lines = [
+            "# HELP testlatency_frames_sent_total Frames captured and fed to the encoder",
+            "# TYPE testlatency_frames_sent_total counter",
+            f"testlatency_frames_sent_total {s.frames_sent}",
+            "# HELP testlatency_frames_received_total Frames delivered, summed over all receivers",
+            "# TYPE testlatency_frames_received_total counter",
+            f"testlatency_frames_received_total {s.frames_received}",
+            f"# HELP testlatency_fps Frames per second over the last {s.window:g} seconds",
+            "# TYPE testlatency_fps gauge",
+            f'testlatency_fps{{side="sender"}} {s.fps_sent:.3f}',
+            f'testlatency_fps{{side="receiver"}} {s.fps_received:.3f}',
+            f"# HELP testlatency_latency_seconds Capture to delivery latency over the last {s.window:g} seconds",
+            "# TYPE testlatency_latency_seconds gauge",
+            f'testlatency_latency_seconds{{quantile="0.5"}} {s.latency_p50:.6f}',
+            f'testlatency_latency_seconds{{quantile="0.9"}} {s.latency_p90:.6f}',
+            f'testlatency_latency_seconds{{quantile="0.99"}} {s.latency_p99:.6f}',
+            f'testlatency_latency_seconds{{quantile="1"}} {s.latency_max:.6f}',
+            f"# HELP testlatency_loss_ratio Fraction of the frames sent in its session over the last {s.window:g} seconds not received, averaged over receivers",
+            "# TYPE testlatency_loss_ratio gauge",
+            f"testlatency_loss_ratio {s.loss:.6f}",
+            f"# HELP testlatency_ingest_bytes_per_second Encoded bytes pushed to the relay per second over the last {s.window:g} seconds",
+            "# TYPE testlatency_ingest_bytes_per_second gauge",
+            f"testlatency_ingest_bytes_per_second {s.ingest_bytes_per_second:.1f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+_live_metrics : Optional[RollingMetrics] = None
+
+def enable_live_metrics(window : float) -> RollingMetrics:
+    global _live_metrics
+    _live_metrics = RollingMetrics(window)
+    return _live_metrics
+
+def live_metrics() -> Optional[RollingMetrics]:
+    # The metrics of this run, or None when live metrics are disabled
+    return _live_metrics
+
+class MetricsServer(threading.Thread):
+    #
+    # Serves /metrics, and optionally aborts the run (through `abort`) when the rolling p99 latency
+    # or loss exceeds a threshold, once the first window after the first received frame has passed.
+    #
+    def __init__(self, metrics : RollingMetrics, port : int, abort : Optional[Callable[[str], None]] = None, abort_latency : float = 0, abort_loss : float = 0, host : str = "127.0.0.1"):
+        super().__init__(daemon=True)
+        self.name = "testlatency.MetricsServer"
+        self.metrics = metrics
+        self.abort = abort
+        self.abort_latency = abort_latency
+        self.abort_loss = abort_loss
+        self.stop_requested = False
+        self.aborted : Optional[str] = None
+        metrics_text = metrics.prometheus
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd : Optional[http.server.ThreadingHTTPServer] = None
+        if port:
+            self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+            self.httpd.daemon_threads = True
+
+    def stop(self):
+        self.stop_requested = True
+        if self.httpd:
+            self.httpd.shutdown()
+
+    def run(self):
+        if self.httpd:
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        first_received : Optional[float] = None
+        while not self.stop_requested:
+            time.sleep(1)
+            if not self.abort or self.aborted:
+                continue
+            if first_received is None:
+                if self.metrics.frames_received:
+                    first_received = time.time()
+                continue
+            if time.time() - first_received < self.metrics.window:
+                continue
+            s = self.metrics.snapshot()
+            reason = None
+            if self.abort_latency and s.latency_p99 > self.abort_latency:
+                reason = f"rolling latency_p99={s.latency_p99:.3f} above {self.abort_latency:.3f}"
+            elif self.abort_loss and s.loss > self.abort_loss:
+                reason = f"rolling loss={s.loss:.3f} above {self.abort_loss:.3f}"
+            if reason:
+                self.aborted = reason
+                print(f"testlatency: metrics: aborting run: {reason}", file=sys.stderr)
+                self.abort(reason)
@@ -0,0 +1,178 @@
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, List, NamedTuple, Optional
+
+#
+# Pipeline hops we can observe from Python, in pipeline order.
+# Sender side:
+#   captured:  source.get() returned (this is SenderStatistics.sender_wallclock)
+#   fed:       encoder.feed() returned (point cloud queued for the encoder)
+#   pushed:    encoded data for one stream handed to the lldpkg packager
+# Receiver side:
+#   fetched:   raw data for one tile returned by the lldplay source
+#   ready:     decoder had the point cloud for one tile ready
+#   decoded:   decoder returned the point cloud for one tile (to the synchronizer, when tiled)
+#   released:  pc_source.get() returned (this is ReceiverStatistics.receiver_wallclock)
+#
+STAGE_FED = "fed"
+STAGE_PUSHED = "pushed"
+STAGE_FETCHED = "fetched"
+STAGE_READY = "ready"
+STAGE_DECODED = "decoded"
+STAGES = [STAGE_FED, STAGE_PUSHED, STAGE_FETCHED, STAGE_READY, STAGE_DECODED]
+
+class StageStatistics(NamedTuple):
+    timestamp : int
+    stage : str
+    tile : int
+    wallclock : float
+    nbytes : int
+
+StageReporter = Callable[[int, str, int, float, int], None]
+
+class RawSinkProbe:
+    #
+    # Wraps the raw sink (cwipc_sink_lldpkg) that the encoder feeds. Encoded frames arrive
+    # in the same order as the point clouds were fed to the encoder (nodrop), one feed per stream,
+    # so the timestamp of each encoded buffer is found by matching against a FIFO of fed timestamps.
+    #
+    def __init__(self, sink : Any, reporter : StageReporter):
+        self.sink = sink
+        self.reporter = reporter
+        self.n_streams = 0
+        # Tile number of every stream, in stream index order
+        self.stream_tiles : List[int] = []
+        self.stream_in_frame = 0
+        self.pending : Deque[int] = deque()
+
+    def __getattr__(self, name : str) -> Any:
+        return getattr(self.sink, name)
+
+    def add_streamDesc(self, *args, **kwargs) -> Any:
+        self.n_streams += 1
+        self.stream_tiles.append(args[0] if args else kwargs.get("tilenum", 0))
+        return self.sink.add_streamDesc(*args, **kwargs)
+
+    def expect(self, timestamp : int) -> None:
+        self.pending.append(timestamp)
+
+    def feed(self, data : Any, *args, **kwargs) -> Any:
+        rv = self.sink.feed(data, *args, **kwargs)
+        now = time.time()
+        stream_index = kwargs.get("stream_index", self.stream_in_frame)
+        timestamp = self.pending[0] if self.pending else -1
+        self.reporter(timestamp, STAGE_PUSHED, stream_index, now, len(data))
+        self.stream_in_frame += 1
+        if self.stream_in_frame >= max(1, self.n_streams):
+            self.stream_in_frame = 0
+            if self.pending:
+                self.pending.popleft()
+        return rv
+
+class RawSourceProbe:
+    #
+    # Wraps a raw (per-tile) lldplay source. The decoder turns every buffer into exactly one
+    # point cloud, in order, so we only remember when each buffer arrived and how big it was.
+    # The matching SourceProbe pops these once it knows the timestamp of the point cloud.
+    #
+    def __init__(self, source : Any):
+        self.source = source
+        self.arrivals : Deque[tuple[float, int]] = deque()
+
+    def __getattr__(self, name : str) -> Any:
+        return getattr(self.source, name)
+
+    def get(self, *args, **kwargs) -> Any:
+        data = self.source.get(*args, **kwargs)
+        if data is not None:
+            self.arrivals.append((time.time(), len(data)))
+        return data
+
+    def pop_arrival(self) -> Optional[tuple[float, int]]:
+        if not self.arrivals:
+            return None
+        return self.arrivals.popleft()
+
+class SourceProbe:
+    #
+    # Wraps a (per-tile) decoder and reports the fetched, ready and decoded hops for every point cloud.
+    # The synchronizer takes the tiles of a frame from their decoders one by one, so the decoded hop
+    # says when it got round to a tile, not when the tile was decoded. The ready hop is exact when the
+    # decoder records when it finished (PooledDecoder.last_ready), otherwise it is the first time the
+    # point cloud was seen available, by the synchronizer or, with --ready-poll, by a ReadyPoller.
+    # The lock keeps the poller off the decoder while the synchronizer uses it.
+    #
+    def __init__(self, source : Any, raw_probe : RawSourceProbe, tile : int, reporter : StageReporter):
+        self.source = source
+        self.raw_probe = raw_probe
+        self.tile = tile
+        self.reporter = reporter
+        self.lock = threading.Lock()
+        self.ready_at : Optional[float] = None
+
+    def __getattr__(self, name : str) -> Any:
+        return getattr(self.source, name)
+
+    def available(self, wait : bool) -> bool:
+        with self.lock:
+            rv = self.source.available(wait)
+            if rv and self.ready_at is None:
+                self.ready_at = time.time()
+        return rv
+
+    def poll(self) -> None:
+        # Skip the tile while the synchronizer is waiting for it or taking it
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.ready_at is None and self.source.available(False):
+                self.ready_at = time.time()
+        finally:
+            self.lock.release()
+
+    def get(self, *args, **kwargs) -> Any:
+        with self.lock:
+            # Not seen available before: it became ready while we waited for it
+            ready_at, self.ready_at = self.ready_at, None
+            pc = self.source.get(*args, **kwargs)
+        if pc is None:
+            return pc
+        now = time.time()
+        ready = getattr(self.source, "last_ready", None) or ready_at or now
+        timestamp = pc.timestamp()
+        arrival = self.raw_probe.pop_arrival()
+        if arrival is not None:
+            fetched, nbytes = arrival
+            self.reporter(timestamp, STAGE_FETCHED, self.tile, fetched, nbytes)
+        self.reporter(timestamp, STAGE_READY, self.tile, min(ready, now), 0)
+        self.reporter(timestamp, STAGE_DECODED, self.tile, now, 0)
+        return pc
+
+class ReadyPoller(threading.Thread):
+    #
+    # With --ready-poll: polls the decoders of all tiles for the ready hop, so it does not depend
+    # on when the synchronizer asks. Resolution is `interval`, at the cost of a thread that takes
+    # the GIL every interval on the receive path it measures.
+    #
+    def __init__(self, probes : List[SourceProbe], interval : float = 0.002):
+        super().__init__(daemon=True)
+        self.name = "testlatency.ReadyPoller"
+        self.probes = probes
+        self.interval = interval
+        self.stop_requested = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def run(self):
+        while not self.stop_requested:
+            for probe in self.probes:
+                try:
+                    probe.poll()
+                except Exception as e:
+                    # Decoder stopped underneath us
+                    print(f"testlatency: ready poller: tile {probe.tile}: {e}, polling stopped", file=sys.stderr)
+                    return
+            time.sleep(self.interval)
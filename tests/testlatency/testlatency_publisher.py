@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+import urllib.parse
+from typing import List, NamedTuple
+from testlatency_histogram import LatencyHistogram
+from testlatency_httpbench import HttpConnection
+from testlatency_server import mpd_url
+
+#
+# Synthetic segment publisher: feeds lldash-relay directly over HTTP, without packager or encoder,
+# so the relay ingest ceiling can be measured. Segment payloads are random bytes of a configurable
+# size, or prerecorded segment files. Uploads go over a pool of persistent connections, paced at
+# a target rate, and every rate in --publish-rates is one step of the saturation curve.
+# Segment numbers continue across steps: every step publishes an MPD whose timeline starts at
+# its first segment, and --http-clients follow it when they re-fetch the MPD.
+#
+
+MPD_TEMPLATE = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic" availabilityStartTime="{start}" minimumUpdatePeriod="PT1S" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period id="0" start="PT0S">
+    <AdaptationSet mimeType="application/octet-stream">
+      <Representation id="synthetic" bandwidth="{bandwidth}">
+        <SegmentTemplate media="{name}_$RepresentationID$_$Number$.m4s" timescale="1000000" duration="{duration}" startNumber="{start_number}"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+class PublishStepResults(NamedTuple):
+    target_rate : float
+    segments : int
+    errors : int
+    late : int
+    nbytes : int
+    duration : float
+    request_latency : LatencyHistogram
+
+class SegmentPublisher:
+    def __init__(self, args : argparse.Namespace, session : int = 0):
+        self.args = args
+        url = urllib.parse.urlparse(mpd_url(args, session))
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port or 80
+        self.mpd_path = url.path
+        self.name = os.path.splitext(os.path.basename(url.path))[0]
+        self.payloads = self._load_payloads()
+        self.number = 1
+        self.stop_requested = False
+
+    def _load_payloads(self) -> List[bytes]:
+        if self.args.publish_dir:
+            payloads = []
+            for filename in sorted(os.listdir(self.args.publish_dir)):
+                with open(os.path.join(self.args.publish_dir, filename), "rb") as fp:
+                    payloads.append(fp.read())
+            if payloads:
+                return payloads
+            print(f"testlatency: publisher: no segments in {self.args.publish_dir}, using synthetic payload", file=sys.stderr)
+        return [os.urandom(self.args.publish_size)]
+
+    def _segment_path(self, number : int) -> str:
+        return urllib.parse.urljoin(self.mpd_path, f"{self.name}_synthetic_{number}.m4s")
+
+    async def publish_mpd(self, rate : float) -> None:
+        start = datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+        average_size = sum(len(p) for p in self.payloads) / len(self.payloads)
+        mpd = MPD_TEMPLATE.format(
+            start=start,
+            bandwidth=int(average_size * rate * 8),
+            name=self.name,
+            duration=int(1000000 / rate),
+            start_number=self.number
+        )
+        connection = HttpConnection(self.host, self.port)
+        try:
+            response = await connection.request(self.args.publish_method, self.mpd_path, mpd.encode())
+            if response.status >= 300:
+                print(f"testlatency: publisher: MPD upload returned status {response.status}", file=sys.stderr)
+        finally:
+            await connection.close()
+
+    async def run_step(self, rate : float, duration : float) -> PublishStepResults:
+        #
+        # Upload segments at `rate` per second for `duration` seconds. A segment whose upload cannot
+        # start on time because all connections are busy counts as late: the relay is saturated.
+        #
+        pool : asyncio.Queue[HttpConnection] = asyncio.Queue()
+        for _ in range(self.args.publish_connections):
+            pool.put_nowait(HttpConnection(self.host, self.port))
+        request_latency = LatencyHistogram()
+        counters = {"segments": 0, "errors": 0, "late": 0, "nbytes": 0}
+
+        async def upload(number : int, payload : bytes, due : float) -> None:
+            connection = await pool.get()
+            if time.time() - due > 1 / rate:
+                counters["late"] += 1
+            try:
+                response = await connection.request(self.args.publish_method, self._segment_path(number), payload)
+                if response.status >= 300:
+                    counters["errors"] += 1
+                else:
+                    counters["segments"] += 1
+                    counters["nbytes"] += len(payload)
+                    request_latency.record(response.duration)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                counters["errors"] += 1
+            finally:
+                pool.put_nowait(connection)
+
+        start = time.time()
+        tasks = []
+        index = 0
+        while not self.stop_requested:
+            due = start + index / rate
+            if due - start >= duration:
+                break
+            delay = due - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            payload = self.payloads[self.number % len(self.payloads)]
+            tasks.append(asyncio.ensure_future(upload(self.number, payload, due)))
+            self.number += 1
+            index += 1
+        await asyncio.gather(*tasks)
+        elapsed = max(time.time() - start, duration)
+        while not pool.empty():
+            await pool.get_nowait().close()
+        return PublishStepResults(rate, counters["segments"], counters["errors"], counters["late"], counters["nbytes"], elapsed, request_latency)
+
+    async def run_async(self) -> List[PublishStepResults]:
+        results : List[PublishStepResults] = []
+        for rate in self.args.publish_rates:
+            await self.publish_mpd(rate)
+            step = await self.run_step(rate, self.args.publish_step_duration)
+            print_publish_step(step)
+            results.append(step)
+        return results
+
+def print_publish_step(step : PublishStepResults) -> None:
+    achieved = step.segments / step.duration if step.duration else 0
+    mbps = step.nbytes / step.duration / 1e6 if step.duration else 0
+    h = step.request_latency
+    print(f"testlatency: publisher: target_rate={step.target_rate:.1f}, achieved_rate={achieved:.1f}, MBps={mbps:.3f}, errors={step.errors}, late={step.late}, request_p50={h.percentile(0.5):.4f}, request_p99={h.percentile(0.99):.4f}, request_max={h.max if h.count else 0:.4f}")
+
+def saturation_point(results : List[PublishStepResults]) -> float:
+    # Highest target rate that was still achieved within 5%, without errors
+    best = 0.0
+    for step in results:
+        achieved = step.segments / step.duration if step.duration else 0
+        if step.errors == 0 and achieved >= 0.95 * step.target_rate:
+            best = max(best, step.target_rate)
+    return best
@@ -10,6 +10,14 @@ import cwipc.net.source_passthrough
 import cwipc.net.source_lldplay
 import cwipc.net.source_decoder
 import cwipc.net.source_synchronizer
+from testlatency_server import mpd_url
+from testlatency_statlog import frame_recorder, stage_recorder
+from testlatency_probes import StageStatistics, STAGES, STAGE_FETCHED, RawSourceProbe, SourceProbe, ReadyPoller
+from testlatency_histogram import ReceiverMetrics
+from testlatency_metrics import live_metrics
+from testlatency_switches import SwitchStatistics
+from testlatency_abr import AbrController, create_abr_controller
+from testlatency_decodepool import DecodePool, PooledDecoder
 from typing import Optional, NamedTuple, List, Dict, Any
 
 class ReceiverStatistics(NamedTuple):
@@ -18,24 +26,34 @@ class ReceiverStatistics(NamedTuple):
     receiver_num : int
     receiver_count : int
 class ReceiverThread(threading.Thread):
-    def __init__(self, args: argparse.Namespace):
+    def __init__(self, args: argparse.Namespace, receiver_name : str = "receiver", session : int = 0):
         super().__init__(daemon=True)
         self.name = "testlatency.ReceiverThread"
         self.args = args
+        self.receiver_name = receiver_name
+        self.session = session
         self.exit_status = -1
         self.needs_synchronizer = self.args.tiled or self.args.synchronizer
         self.pc_source : Optional[cwipc_source_abstract] = None
         self.raw_multisource : Optional[cwipc_rawmultisource_abstract] = None
-        self.statistics : List[ReceiverStatistics] = []
+        self.statistics = frame_recorder(args, receiver_name, ReceiverStatistics)
+        self.stage_statistics = stage_recorder(args, f"{receiver_name}_stages", StageStatistics, STAGES)
+        self.switch_statistics = frame_recorder(args, f"{receiver_name}_switches", SwitchStatistics)
+        self.metrics = ReceiverMetrics()
+        self.live_metrics = live_metrics()
         self.n_tile : int = 1
         self.n_quality : int = 1
         self.cur_quality : int = 0
+        self.tile_quality : List[int] = [0]
+        self.raw_probes : List[RawSourceProbe] = []
+        self.abr : Optional[AbrController] = None
+        self.decode_pool : Optional[DecodePool] = None
+        self.ready_poller : Optional[ReadyPoller] = None
         self.stop_requested = False
         self.last_timestamp : Optional[int] = None
-        self.next_quality_switch_time : Optional[float] = None
 
     def init(self):
-        url = "http://127.0.0.1:9000/lldash_testlatency.mpd"
+        url = mpd_url(self.args, self.session)
         if self.args.uncompressed:
             decoder_factory = cwipc.net.source_passthrough.cwipc_source_passthrough
         else:
@@ -50,21 +68,39 @@ class ReceiverThread(threading.Thread):
             self.n_quality = len(description[0])
             if self.args.verbose:
                 print(f"testlatency: receiver: multisource has {self.n_quality} qualities", file=sys.stderr)
+            if self.args.decode_pool and not self.args.uncompressed:
+                self.decode_pool = DecodePool(self.args.decode_workers, verbose=self.args.debug)
+                if self.args.verbose:
+                    print(f"testlatency: receiver: decoding {self.n_tile} tiles on {self.decode_pool.workers} workers", file=sys.stderr)
             decoders : List[cwipc_source_abstract] = []
             for i in range(self.n_tile):
-                raw_source = self.raw_multisource.get_tile_source(i)
-                decoder = decoder_factory(raw_source, verbose=self.args.debug)
-                decoders.append(decoder)
+                raw_source = RawSourceProbe(self.raw_multisource.get_tile_source(i))
+                self.raw_probes.append(raw_source)
+                if self.decode_pool:
+                    decoder = PooledDecoder(raw_source, self.decode_pool, self.args.decode_queue, verbose=self.args.debug)
+                else:
+                    decoder = decoder_factory(raw_source, verbose=self.args.debug)
+                decoders.append(SourceProbe(decoder, raw_source, i, self.report_stage))
             self.pc_source = cwipc.net.source_synchronizer.cwipc_source_synchronizer(self.raw_multisource, decoders, verbose=self.args.debug)
+            if not self.decode_pool and self.args.ready_poll > 0:
+                # Pooled decoders know when they finished, the others can be watched
+                self.ready_poller = ReadyPoller(decoders, self.args.ready_poll / 1000)  # type: ignore
+            self.tile_quality = [0] * self.n_tile
+            self.abr = create_abr_controller(self.args, self.n_tile, self.n_quality, description)
         else:
-            raw_source = cwipc.net.source_lldplay.cwipc_source_lldplay(url, verbose=self.args.debug)
-            self.pc_source = decoder_factory(raw_source, verbose=self.args.debug)
+            raw_source = RawSourceProbe(cwipc.net.source_lldplay.cwipc_source_lldplay(url, verbose=self.args.debug))
+            decoder = decoder_factory(raw_source, verbose=self.args.debug)
+            self.pc_source = SourceProbe(decoder, raw_source, 0, self.report_stage)
         assert self.pc_source
         self.pc_source.start()
+        if self.ready_poller:
+            self.ready_poller.start()
+        if (self.args.abr != "off" or self.args.switch_interval) and not self.raw_multisource:
+            print("testlatency: receiver: quality selection needs a tiled or --synchronizer stream, ignored", file=sys.stderr)
+        if self.args.decode_pool and not self.decode_pool:
+            print("testlatency: receiver: --decode-pool needs a tiled or --synchronizer compressed stream, ignored", file=sys.stderr)
         if self.args.switch_initial:
             self.switch_quality()
-        if self.args.switch_interval:
-            self.next_quality_switch_time = time.time() + self.args.switch_interval
 
     def stop(self):
         self.stop_requested = True
@@ -72,10 +108,22 @@ class ReceiverThread(threading.Thread):
     def close(self):
         if self.args.verbose:
             self.pc_source.statistics()
+        if self.ready_poller:
+            self.ready_poller.stop()
+            self.ready_poller.join()
+            self.ready_poller = None
         if self.pc_source:
             self.pc_source.stop()
             self.pc_source.free()
             self.pc_source = None
+        if self.decode_pool:
+            if self.args.verbose:
+                self.decode_pool.statistics()
+            self.decode_pool.shutdown()
+            self.decode_pool = None
+        self.statistics.close()
+        self.stage_statistics.close()
+        self.switch_statistics.close()
 
     def report(self, num : int, timestamp_ms : int, count : int):
         now = time.time()
@@ -87,7 +135,17 @@ class ReceiverThread(threading.Thread):
         if self.args.verbose:
             print(f"testlatency: receiver: now={now}, timestamp={timestamp_ms}, receiver_num={num}, receiver_pointcount={count}, latency={latency}, delta={delta}", file=sys.stderr)
         self.last_timestamp = timestamp_ms
-        self.statistics.append(ReceiverStatistics(timestamp_ms, now, num, count))
+        self.statistics.record(timestamp_ms, now, num, count)
+        self.metrics.record(timestamp_ms, now)
+        if self.abr:
+            self.abr.observe_frame(now, latency / 1000.0)
+        if self.live_metrics:
+            self.live_metrics.record_received(self.receiver_name, self.session, timestamp_ms, now)
+
+    def report_stage(self, timestamp : int, stage : str, tile : int, wallclock : float, nbytes : int):
+        self.stage_statistics.record(timestamp, stage, tile, wallclock, nbytes)
+        if self.abr and stage == STAGE_FETCHED:
+            self.abr.observe_fetch(tile, wallclock, nbytes)
         
     def run(self):
         if self.args.debug:
@@ -100,8 +158,8 @@ class ReceiverThread(threading.Thread):
         while not self.pc_source.eof() and not self.stop_requested:
             if not self.pc_source.available(True):
                 continue
-            if self.next_quality_switch_time != None and time.time() > self.next_quality_switch_time:
-                self.switch_quality()
+            if self.abr:
+                self.run_abr()
             pc = self.pc_source.get()
             if pc == None:
                 if not self.pc_source.eof():
@@ -123,8 +181,26 @@ class ReceiverThread(threading.Thread):
         self.cur_quality = next_qualIdx
         if self.args.verbose:
             print(f"testlatency: receiver: select quality {self.cur_quality} for {self.n_tile} tiles", file=sys.stderr)
+        now = time.time()
         for tileIdx in range(self.n_tile):
-            self.raw_multisource.select_tile_quality(tileIdx, self.cur_quality)
-        if self.args.switch_interval:
-            self.next_quality_switch_time = time.time() + self.args.switch_interval
+            self.select_tile_quality(tileIdx, self.cur_quality, now)
+
+    def select_tile_quality(self, tileIdx : int, qualIdx : int, now : float) -> None:
+        assert self.raw_multisource
+        self.raw_multisource.select_tile_quality(tileIdx, qualIdx)
+        self.switch_statistics.record(tileIdx, now, self.tile_quality[tileIdx], qualIdx)
+        self.tile_quality[tileIdx] = qualIdx
+        if self.abr:
+            self.abr.switched(tileIdx, qualIdx)
+
+    def run_abr(self) -> None:
+        assert self.abr
+        for tileIdx, raw_probe in enumerate(self.raw_probes):
+            # Fetched but not yet decoded
+            self.abr.observe_buffer(tileIdx, len(raw_probe.arrivals))
+        now = time.time()
+        for tileIdx, qualIdx in self.abr.decide(now).items():
+            if self.args.verbose:
+                print(f"testlatency: receiver: abr: select quality {qualIdx} for tile {tileIdx}", file=sys.stderr)
+            self.select_tile_quality(tileIdx, qualIdx, now)
         
\ No newline at end of file
@@ -0,0 +1,97 @@
+import array
+import threading
+from typing import Any, Iterator, NamedTuple
+
+class StatisticsRecorder:
+    #
+    # Columnar statistics store for the hot capture/receive loops. Every field of `record_type`
+    # is kept in its own preallocated array.array, grown a chunk at a time, so recording a frame
+    # only stores numbers into existing slots and does not allocate a Python object per frame.
+    # Reading back behaves like a list of `record_type` NamedTuples, and columns() gives
+    # copies of the columns for vectorized analysis: a view would keep the recorder from growing.
+    #
+    def __init__(self, record_type : type, typecodes : str, chunk_size : int = 4096):
+        assert len(typecodes) == len(record_type._fields)
+        self.record_type = record_type
+        self.fields : tuple[str, ...] = record_type._fields
+        self.chunk_size = chunk_size
+        self._chunks = [array.array(tc, bytes(array.array(tc).itemsize * chunk_size)) for tc in typecodes]
+        self._columns = [array.array(tc, chunk) for tc, chunk in zip(typecodes, self._chunks)]
+        self._length = 0
+        self._capacity = chunk_size
+
+    def _grow(self) -> None:
+        for column, chunk in zip(self._columns, self._chunks):
+            column.extend(chunk)
+        self._capacity += self.chunk_size
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _row(self, index : int) -> tuple:
+        return tuple(column[index] for column in self._columns)
+
+    def __getitem__(self, index : int) -> Any:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("statistics index out of range")
+        return self.record_type(*self._row(index))
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(self._length):
+            yield self.record_type(*self._row(index))
+
+    def columns(self) -> dict[str, array.array]:
+        length = self._length
+        return {field: column[:length] for field, column in zip(self.fields, self._columns)}
+
+    def close(self) -> None:
+        pass
+
+class FrameRecorder(StatisticsRecorder):
+    #
+    # For SenderStatistics and ReceiverStatistics: (timestamp, wallclock, num, count)
+    #
+    def __init__(self, record_type : type, chunk_size : int = 4096):
+        super().__init__(record_type, "qdqq", chunk_size)
+        self._timestamps, self._wallclocks, self._nums, self._counts = self._columns
+
+    def record(self, timestamp : int, wallclock : float, num : int, count : int) -> None:
+        n = self._length
+        if n == self._capacity:
+            self._grow()
+        self._timestamps[n] = timestamp
+        self._wallclocks[n] = wallclock
+        self._nums[n] = num
+        self._counts[n] = count
+        self._length = n + 1
+
+class StageRecorder(StatisticsRecorder):
+    #
+    # For StageStatistics: (timestamp, stage, tile, wallclock, nbytes). Stage names are stored
+    # as an index into `stages`. Stage hops are reported from encoder, decoder and synchronizer
+    # threads as well as our own, so recording is serialized with a lock.
+    #
+    def __init__(self, record_type : type, stages : list[str], chunk_size : int = 4096):
+        super().__init__(record_type, "qbqdq", chunk_size)
+        self.stages = stages
+        self.stage_index = {stage: i for i, stage in enumerate(stages)}
+        self._timestamps, self._stages, self._tiles, self._wallclocks, self._nbytes = self._columns
+        self.lock = threading.Lock()
+
+    def record(self, timestamp : int, stage : str, tile : int, wallclock : float, nbytes : int) -> None:
+        with self.lock:
+            n = self._length
+            if n == self._capacity:
+                self._grow()
+            self._timestamps[n] = timestamp
+            self._stages[n] = self.stage_index[stage]
+            self._tiles[n] = tile
+            self._wallclocks[n] = wallclock
+            self._nbytes[n] = nbytes
+            self._length = n + 1
+
+    def _row(self, index : int) -> tuple:
+        row = super()._row(index)
+        return (row[0], self.stages[row[1]]) + row[2:]
@@ -0,0 +1,188 @@
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+#
+# Resource usage of the components of a run, sampled from /proc (Linux only): CPU time, resident
+# memory and I/O bytes of the relay process and of the sender and receiver sides, so servers can
+# be sized from measured numbers. A side is a set of processes, or of threads in this process:
+# a thread has its own CPU time and I/O counters, but shares the memory of the process. A thread
+# side only counts the Python thread, not the native encoder and decoder threads it drives, so
+# the per-stream and per-viewer CPU figures are only given for sides that are whole processes
+# (--isolation process, or --receivers pools), and are -1 otherwise. Then the CPU of this whole
+# process per stream, native threads included, is the nearest figure: sender and receiver together.
+# I/O bytes are the bytes passed to read and write system calls (rchar/wchar), which for the relay
+# and the sender and receiver loops are mostly socket bytes.
+#
+
+class ResourceUsage(NamedTuple):
+    label : str
+    duration : float
+    cpu_seconds : float
+    cpu_percent : float
+    rss_max : int
+    rss_avg : float
+    read_bytes : int
+    write_bytes : int
+    threads : bool  # Some targets were threads, not processes
+
+# A target is a process id, or a (process id, thread id) pair
+Target = tuple[int, Optional[int]]
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def have_proc() -> bool:
+    return os.path.exists("/proc/self/stat")
+
+def _proc_dir(target : Target) -> str:
+    pid, tid = target
+    return f"/proc/{pid}/task/{tid}" if tid is not None else f"/proc/{pid}"
+
+def read_cpu(target : Target) -> float:
+    # utime + stime in seconds. The command name may contain spaces, so split after its closing parenthesis.
+    with open(_proc_dir(target) + "/stat") as fp:
+        fields = fp.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def read_rss(pid : int) -> int:
+    with open(f"/proc/{pid}/statm") as fp:
+        return int(fp.read().split()[1]) * PAGE_SIZE
+
+def read_io(target : Target) -> tuple[int, int]:
+    counters = {}
+    with open(_proc_dir(target) + "/io") as fp:
+        for line in fp:
+            name, _, value = line.partition(":")
+            counters[name] = int(value)
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+class _SideCounters:
+    def __init__(self):
+        # Last seen cumulative counters per target, so targets that have exited still count
+        self.cpu : Dict[Target, float] = {}
+        self.io : Dict[Target, tuple[int, int]] = {}
+        self.first_cpu : Dict[Target, float] = {}
+        self.first_io : Dict[Target, tuple[int, int]] = {}
+        self.rss_samples : List[int] = []
+        self.threads = False
+
+class ResourceSampler(threading.Thread):
+    #
+    # Samples every `interval` seconds until stopped. Sides are given as functions that return
+    # their current targets, because processes and threads come and go during a run.
+    #
+    def __init__(self, interval : float = 1.0):
+        super().__init__(daemon=True)
+        self.name = "testlatency.ResourceSampler"
+        self.interval = interval
+        self.sides : Dict[str, Callable[[], List[Target]]] = {}
+        self.counters : Dict[str, _SideCounters] = {}
+        self.start_time : Optional[float] = None
+        self.end_time : Optional[float] = None
+        self.stop_event = threading.Event()
+
+    def add_side(self, label : str, targets : Callable[[], List[Target]]) -> None:
+        self.sides[label] = targets
+        self.counters[label] = _SideCounters()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        self.start_time = time.time()
+        while True:
+            self.sample()
+            if self.stop_event.wait(self.interval):
+                break
+        self.sample()
+        self.end_time = time.time()
+
+    def sample(self) -> None:
+        for label, targets in self.sides.items():
+            counters = self.counters[label]
+            rss = 0
+            for target in targets():
+                try:
+                    cpu = read_cpu(target)
+                    io = read_io(target)
+                    if target[1] is None:
+                        rss += read_rss(target[0])
+                except (OSError, ValueError, IndexError):
+                    # Exited, or not ours to read
+                    continue
+                if target[1] is not None:
+                    counters.threads = True
+                counters.first_cpu.setdefault(target, cpu)
+                counters.first_io.setdefault(target, io)
+                counters.cpu[target] = cpu
+                counters.io[target] = io
+            counters.rss_samples.append(rss)
+
+    def usage(self) -> List[ResourceUsage]:
+        assert self.start_time is not None
+        duration = (self.end_time or time.time()) - self.start_time
+        result = []
+        for label, counters in self.counters.items():
+            cpu = sum(counters.cpu[target] - counters.first_cpu[target] for target in counters.cpu)
+            read = sum(counters.io[target][0] - counters.first_io[target][0] for target in counters.io)
+            written = sum(counters.io[target][1] - counters.first_io[target][1] for target in counters.io)
+            rss = counters.rss_samples
+            result.append(ResourceUsage(
+                label,
+                duration,
+                cpu,
+                100 * cpu / duration if duration > 0 else 0,
+                max(rss, default=0),
+                sum(rss) / len(rss) if rss else 0,
+                read,
+                written,
+                counters.threads,
+            ))
+        return result
+
+class CapacityResults(NamedTuple):
+    streams : int
+    viewers : int
+    relay_cpu_percent_per_stream : float
+    sender_cpu_percent_per_stream : float
+    receiver_cpu_percent_per_viewer : float
+    relay_MBps_per_viewer : float
+    relay_MB_per_session : float
+    harness_cpu_percent_per_stream : float  # This process: threads of sender and receiver together
+
+def capacity(usage : List[ResourceUsage], streams : int, viewers : int) -> CapacityResults:
+    by_label = {u.label: u for u in usage}
+    def cpu(label : str, n : int) -> float:
+        if label in by_label and by_label[label].threads:
+            return -1
+        return by_label[label].cpu_percent / n if label in by_label and n else 0
+    relay = by_label.get("relay")
+    return CapacityResults(
+        streams,
+        viewers,
+        cpu("relay", streams),
+        cpu("sender", streams),
+        cpu("receiver", viewers),
+        relay.write_bytes / relay.duration / 1e6 / viewers if relay and relay.duration > 0 and viewers else 0,
+        relay.rss_max / 1e6 / streams if relay and streams else 0,
+        cpu("testlatency", streams),
+    )
+
+def print_resources(usage : List[ResourceUsage], results : CapacityResults) -> None:
+    for u in usage:
+        mbps_read = u.read_bytes / u.duration / 1e6 if u.duration > 0 else 0
+        mbps_write = u.write_bytes / u.duration / 1e6 if u.duration > 0 else 0
+        rss = f", rss_max_MB={u.rss_max / 1e6:.1f}, rss_avg_MB={u.rss_avg / 1e6:.1f}" if u.rss_max else ""
+        scope = " (Python threads only)" if u.threads else ""
+        print(f"testlatency: resources: {u.label}{scope}: cpu_seconds={u.cpu_seconds:.2f}, cpu_percent={u.cpu_percent:.1f}{rss}, read_MBps={mbps_read:.3f}, write_MBps={mbps_write:.3f}")
+    def per(value : float) -> str:
+        return f"{value:.2f}" if value >= 0 else "n/a"
+    print(f"testlatency: resources: streams={results.streams}, viewers={results.viewers}, relay_cpu_percent_per_stream={results.relay_cpu_percent_per_stream:.2f}, sender_cpu_percent_per_stream={per(results.sender_cpu_percent_per_stream)}, receiver_cpu_percent_per_viewer={per(results.receiver_cpu_percent_per_viewer)}, relay_MBps_per_viewer={results.relay_MBps_per_viewer:.3f}, relay_MB_per_session={results.relay_MB_per_session:.1f}, harness_cpu_percent_per_stream={results.harness_cpu_percent_per_stream:.2f}")
+    if results.sender_cpu_percent_per_stream < 0 or results.receiver_cpu_percent_per_viewer < 0:
+        print("testlatency: resources: sender and receiver CPU per stream needs --isolation process (or --receivers pools for the receivers), harness_cpu_percent_per_stream has them together")
+
+def warn_no_proc() -> None:
+    print("testlatency: resources: /proc is not available, no resource usage is sampled", file=sys.stderr)
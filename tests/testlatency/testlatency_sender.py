@@ -8,6 +8,11 @@ from cwipc.net.abstract import cwipc_sink_abstract, cwipc_rawsink_abstract
 import cwipc.net.sink_lldpkg
 import cwipc.net.sink_encoder
 import cwipc.net.sink_passthrough
+from testlatency_server import mpd_url
+from testlatency_statlog import frame_recorder, stage_recorder
+from testlatency_probes import StageStatistics, STAGES, RawSinkProbe, STAGE_FED, STAGE_PUSHED
+from testlatency_metrics import live_metrics
+from testlatency_bandwidth import StreamVariant, stream_variants, save_stream_variants
 
 
 class SenderStatistics(NamedTuple):
@@ -18,16 +23,22 @@ class SenderStatistics(NamedTuple):
 
 class SenderThread(threading.Thread):
 
-    def __init__(self, args : argparse.Namespace):
+    def __init__(self, args : argparse.Namespace, sender_name : str = "sender", session : int = 0):
         super().__init__(daemon=True)
         self.name = "testlatency.SenderThread"
         self.args = args
+        self.sender_name = sender_name
+        self.session = session
         self.exit_status = -1
         self.alive = True
         self.source : Optional[cwipc.cwipc_tiledsource_wrapper] = None
         self.encoder : Optional[cwipc_sink_abstract] = None
         self.sender : Optional[cwipc_rawsink_abstract] = None
-        self.statistics : List[SenderStatistics] = []
+        self.sender_probe : Optional[RawSinkProbe] = None
+        self.statistics = frame_recorder(args, sender_name, SenderStatistics)
+        self.stage_statistics = stage_recorder(args, f"{sender_name}_stages", StageStatistics, STAGES)
+        self.live_metrics = live_metrics()
+        self.stream_variants : List[StreamVariant] = []
         self.stop_requested = False
 
     def init(self):
@@ -39,7 +50,7 @@ class SenderThread(threading.Thread):
         #
         # Create sender
         #
-        url = "http://127.0.0.1:9000/lldash_testlatency.mpd"
+        url = mpd_url(self.args, self.session)
         nodrop = True
         if self.args.debug:
             print(f"testlatency: sender: creating cwipc_sink_lldpkg({url}, ...)", file=sys.stderr)
@@ -59,6 +70,8 @@ class SenderThread(threading.Thread):
             td = [self.source.get_tileinfo_dict(i) for i in range(tilecount)] # type: ignore
             tiledescriptions = filter(lambda e: e['cameraMask'] != 0, td)
             tiledescriptions = list(tiledescriptions)
+            if self.args.tiles:
+                tiledescriptions = tiledescriptions[:self.args.tiles]
         n_tiles = len(tiledescriptions) if tiledescriptions else 1
         n_quality = len(jpeg_quality) if jpeg_quality and type(jpeg_quality) == list else 1
         n_octree_bits = len(octree_bits) if octree_bits and type(octree_bits) == list else 1
@@ -73,8 +86,11 @@ class SenderThread(threading.Thread):
             encoder_factory = cwipc.net.sink_passthrough.cwipc_sink_passthrough
         else:
             encoder_factory = cwipc.net.sink_encoder.cwipc_sink_encoder
-        
-        self.encoder = encoder_factory(self.sender, self.args.debug, nodrop)
+        #
+        # Interpose a probe between encoder and packager, so we can see when encoded frames are pushed.
+        #
+        self.sender_probe = RawSinkProbe(self.sender, self.report_stage)
+        self.encoder = encoder_factory(self.sender_probe, self.args.debug, nodrop)
         self.encoder.set_producer(self)
         #
         # Set encoder parameter sets
@@ -110,12 +126,25 @@ class SenderThread(threading.Thread):
             self.source.free()
         self.source = None
         self.sender = None
+        if self.sender_probe:
+            self.stream_variants = stream_variants(self.sender_probe.stream_tiles, self.args.octree_bits, self.args.jpeg_quality)
+            save_stream_variants(self.args, self.sender_name, self.stream_variants)
+        self.sender_probe = None
+        self.statistics.close()
+        self.stage_statistics.close()
         
     def report(self, num : int, timestamp : float, count : int):
         now = time.time()
         if self.args.verbose:
             print(f"testlatency: sender: now={now}, timestamp={timestamp}, sender_num={num}, sender_pointcount={count}", file=sys.stderr)
-        self.statistics.append(SenderStatistics(timestamp, now, num, count))
+        self.statistics.record(timestamp, now, num, count)
+        if self.live_metrics:
+            self.live_metrics.record_sent(self.session, timestamp, now)
+
+    def report_stage(self, timestamp : int, stage : str, tile : int, wallclock : float, nbytes : int):
+        self.stage_statistics.record(timestamp, stage, tile, wallclock, nbytes)
+        if self.live_metrics and stage == STAGE_PUSHED:
+            self.live_metrics.record_pushed(nbytes, wallclock)
         
     def run(self):
         if self.args.debug:
@@ -124,6 +153,7 @@ class SenderThread(threading.Thread):
         assert self.source
         assert self.encoder
         assert self.sender
+        assert self.sender_probe
         start_time = time.time()
         num = 0
         self.exit_status = 0
@@ -138,8 +168,11 @@ class SenderThread(threading.Thread):
                 print("testlatency: Sender source returned None, exiting...", file=sys.stderr)
                 self.exit_status = 1
                 break
-            self.report(num, pc.timestamp(), pc.count())
+            timestamp = pc.timestamp()
+            self.report(num, timestamp, pc.count())
+            self.sender_probe.expect(timestamp)
             self.encoder.feed(pc)
+            self.report_stage(timestamp, STAGE_FED, 0, time.time(), 0)
             num += 1
         if self.args.verbose:
             print(f"testlatency: sent {num} point clouds in {time.time()-start_time} seconds.", file=sys.stderr)
@@ -19,7 +19,7 @@ class SenderThread(threading.Thread):
             "--count", "450",
             "--fps", "15", 
             "--synthetic", 
-            "--bin2dash", "http://127.0.0.1:9000/", 
+            "--bin2dash", f"http://127.0.0.1:{self.args.port}/", 
         ]
         if self.args.seg_dur > 0:
             cmd_line += ["--seg_dur", str(self.args.seg_dur)]
@@ -1,9 +1,39 @@
 import threading
 import argparse
+import socket
 import subprocess
 import sys
+import time
+import urllib.error
+import urllib.request
 from typing import Optional
 
+def mpd_url(args : argparse.Namespace, session : int = 0) -> str:
+    # Every publishing session gets its own MPD on the relay
+    name = "lldash_testlatency" if session == 0 else f"lldash_testlatency_{session}"
+    return f"http://127.0.0.1:{args.port}/{name}.mpd"
+
+def free_port() -> int:
+    # Let the OS pick an unused port. Another process could grab it before the relay binds it,
+    # but the relay then fails to start, which wait_listening() reports.
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def is_listening(port : int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+def is_published(url : str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (OSError, urllib.error.URLError):
+        return False
+
 class ServerThread(threading.Thread):
     def __init__(self, args: argparse.Namespace):
         super().__init__(daemon=True)
@@ -12,6 +42,7 @@ class ServerThread(threading.Thread):
         self.process : Optional[subprocess.Popen[str]] = None
         self.exit_status = -1
         self.did_terminate = False
+        self.time_to_listen : Optional[float] = None
 
     def run(self):
         serverproc_stderr = None
@@ -23,7 +54,7 @@ class ServerThread(threading.Thread):
             print("testlatency: server: Starting server...", file=sys.stderr)
         cmdline = [
             "lldash-relay.exe", 
-            "--port", "9000"
+            "--port", str(self.args.port)
         ]
         if self.args.long_poll:
             cmdline += ["--long-poll", str(self.args.long_poll)]
@@ -41,6 +72,19 @@ class ServerThread(threading.Thread):
             # Expected exit status for SIGTERM, or 1 on Windows.
             self.exit_status = 0
         
+    def wait_listening(self, timeout : float = 10) -> bool:
+        # Poll until the relay accepts connections. False if it exited or did not listen in time.
+        start = time.time()
+        deadline = start + timeout
+        while time.time() < deadline:
+            if not self.is_alive() or (self.process is not None and self.process.poll() is not None):
+                return False
+            if self.process is not None and is_listening(self.args.port):
+                self.time_to_listen = time.time() - start
+                return True
+            time.sleep(0.05)
+        return False
+
     def stop(self):
         if self.process:
             self.did_terminate = True
@@ -0,0 +1,288 @@
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, List, NamedTuple, Optional, Union
+from testlatency_sender import SenderThread
+from testlatency_receiver import ReceiverThread
+from testlatency_fanout import ReceiverPool, analyse_fanout
+from testlatency_analyse import AnalyserResults, analyse
+from testlatency_httpbench import HttpBenchThread, print_httpbench, judge_httpbench
+from testlatency_join import JoinBenchmark, print_joins
+from testlatency_isolation import IsolatedThread, isolated_sender, isolated_receiver
+from testlatency_probes import STAGE_PUSHED
+from testlatency_server import mpd_url, is_published
+from testlatency_resources import Target, CapacityResults
+from testlatency_bandwidth import BandwidthResults, analyse_bandwidth, print_bandwidth, bandwidth_columns, load_stream_variants
+from testlatency_switches import SwitchStatistics, SwitchResults, analyse_switches, print_switches, switch_columns
+from testlatency_viewport import ViewportResults, analyse_viewport, print_viewport
+from testlatency_tiles import TileResults, SkewResults, analyse_tiles, print_tiles, tile_columns
+
+class SessionResults(NamedTuple):
+    session : int
+    ok : bool
+    frames_sent : int
+    frames_received : int
+    loss : float
+    latency_p50 : float
+    latency_p99 : float
+    bytes_pushed : int
+    duration : float
+    time_to_mpd : float
+    time_to_first_frame : float
+
+class Session:
+    #
+    # One publishing session: a sender with its own MPD on the relay, and its receiver(s).
+    #
+    def __init__(self, args : argparse.Namespace, session : int, receiver_port : Optional[int] = None):
+        self.session = session
+        prefix = f"session{session}_" if args.senders > 1 else ""
+        sender_args = args
+        if session == 0 and args.hot_session_npoints:
+            sender_args = copy.copy(args)
+            sender_args.npoints = args.hot_session_npoints
+        # With --isolation process the sender and a single receiver each get their own process.
+        # A ReceiverPool already runs its receivers in worker processes.
+        isolated = args.isolation == "process"
+        # Without --logdir their statistics logs go to a temporary directory, removed by close()
+        self.tempdir : Optional[tempfile.TemporaryDirectory] = None
+        def statdir() -> str:
+            if args.logdir:
+                return args.logdir
+            if self.tempdir is None:
+                self.tempdir = tempfile.TemporaryDirectory(prefix="testlatency_")
+            return self.tempdir.name
+        self.sender_thread : Union[SenderThread, IsolatedThread]
+        if isolated:
+            self.sender_thread = isolated_sender(sender_args, prefix + "sender", session, statdir())
+        else:
+            self.sender_thread = SenderThread(sender_args, prefix + "sender", session)
+        self.receiver_thread : Union[ReceiverThread, ReceiverPool, HttpBenchThread, JoinBenchmark, IsolatedThread]
+        # Receivers may reach the relay through another port, such as the --shape-rate proxy
+        if receiver_port:
+            args = copy.copy(args)
+            args.port = receiver_port
+        if args.joins:
+            self.receiver_thread = JoinBenchmark(args, self.sender_thread, prefix, session)
+        elif args.http_clients:
+            self.receiver_thread = HttpBenchThread(args, session)
+        elif args.receivers > 1:
+            self.receiver_thread = ReceiverPool(args, args.receivers, prefix + "receiver", session, statdir())
+        elif isolated:
+            self.receiver_thread = isolated_receiver(args, prefix + "receiver", session, statdir())
+        else:
+            self.receiver_thread = ReceiverThread(args, prefix + "receiver", session)
+        self.results : Optional[SessionResults] = None
+        self.url = mpd_url(sender_args, session)
+        self.sender_start_time : Optional[float] = None
+        self.receiver_start_time : Optional[float] = None
+        self.time_to_mpd : Optional[float] = None
+        self.analyser_results : Optional[AnalyserResults] = None
+        self.bandwidth_results : List[BandwidthResults] = []
+        self.switch_results : List[SwitchResults] = []
+        self.viewport_results : Optional[ViewportResults] = None
+        self.tile_results : List[TileResults] = []
+        self.skew_results : Optional[SkewResults] = None
+
+    def start_sender(self) -> None:
+        self.sender_start_time = time.time()
+        self.sender_thread.start()
+
+    def wait_mpd(self, timeout : float) -> bool:
+        # Poll the relay until the sender has published the MPD. False if the sender stopped or timed out.
+        assert self.sender_start_time
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.sender_thread.is_alive():
+            if is_published(self.url):
+                self.time_to_mpd = time.time() - self.sender_start_time
+                return True
+            time.sleep(0.05)
+        return False
+
+    def start_receiver(self) -> None:
+        self.receiver_start_time = time.time()
+        self.receiver_thread.start()
+
+    def time_to_first_frame(self) -> float:
+        firsts = [statistics[0].receiver_wallclock for statistics in self.receiver_statistics() if len(statistics)]
+        if not firsts or self.receiver_start_time is None:
+            return -1
+        return min(firsts) - self.receiver_start_time
+
+    def viewers(self) -> int:
+        if isinstance(self.receiver_thread, ReceiverPool):
+            return self.receiver_thread.n_receivers
+        if isinstance(self.receiver_thread, HttpBenchThread):
+            return self.receiver_thread.args.http_clients
+        return 1
+
+    def close(self) -> None:
+        # After the analysis: unmap the statistics logs of other processes, and remove them
+        # unless they are in --logdir
+        for thread in (self.sender_thread, self.receiver_thread):
+            if isinstance(thread, IsolatedThread):
+                thread.close()
+        if self.tempdir is not None:
+            self.tempdir.cleanup()
+            self.tempdir = None
+
+    def sender_targets(self) -> List[Target]:
+        # For resource sampling: the sender process, or the sender thread in this process
+        return _targets(self.sender_thread)
+
+    def receiver_targets(self) -> List[Target]:
+        if isinstance(self.receiver_thread, ReceiverPool):
+            return [(pid, None) for pid in list(self.receiver_thread.worker_pids)]
+        if isinstance(self.receiver_thread, JoinBenchmark):
+            return _targets(self.receiver_thread.current) if self.receiver_thread.current else []
+        return _targets(self.receiver_thread)
+
+    def receiver_statistics(self) -> List[Any]:
+        if isinstance(self.receiver_thread, (HttpBenchThread, JoinBenchmark)):
+            return []
+        if isinstance(self.receiver_thread, ReceiverPool):
+            return self.receiver_thread.receiver_statistics()
+        return [self.receiver_thread.statistics]
+
+    def analyse(self, args : argparse.Namespace) -> tuple[bool, SessionResults]:
+        sender_statistics = self.sender_thread.statistics
+        frames_received = sum(len(statistics) for statistics in self.receiver_statistics())
+        if isinstance(self.receiver_thread, HttpBenchThread):
+            # Relay-only: there are no decoded frames, so report segment time-to-first-byte in stead
+            bench = self.receiver_thread.results
+            if bench is None:
+                # Never started, or the benchmark itself failed
+                print(f"testlatency: judge: httpbench session {self.session} produced no results", file=sys.stderr)
+                ok, loss, p50, p99 = False, 1.0, -1.0, -1.0
+                frames_received = 0
+            else:
+                print_httpbench(bench)
+                ok = judge_httpbench(bench)
+                loss = bench.errors / bench.requests if bench.requests else 1.0
+                p50, p99 = bench.ttfb.percentile(0.5), bench.ttfb.percentile(0.99)
+                frames_received = bench.segments
+        elif isinstance(self.receiver_thread, JoinBenchmark):
+            # Every join is analysed on its own, latency is the steady state latency over the joins
+            joins = self.receiver_thread.results
+            ok = print_joins(joins)
+            loss = sum(1 for r in joins if r.frames == 0) / len(joins) if joins else 1.0
+            steady = [r.steady_latency for r in joins if r.steady_latency >= 0]
+            p50 = statistics.median(steady) if steady else -1
+            p99 = max(steady, default=-1)
+            frames_received = sum(r.frames for r in joins)
+        elif isinstance(self.receiver_thread, ReceiverPool):
+            aggregated = analyse_fanout(args, self.receiver_statistics(), sender_statistics, f"session {self.session}")
+            ok = aggregated.count_receivers > 0 and aggregated.count_failed == 0
+            loss, p50, p99 = aggregated.loss_avg, aggregated.latency_p50, aggregated.latency_p99
+        else:
+            ok, results = analyse(
+                args,
+                self.receiver_thread.statistics,
+                sender_statistics,
+                list(self.sender_thread.stage_statistics) + list(self.receiver_thread.stage_statistics),
+                self.receiver_thread.metrics
+            )
+            loss = results.count_lost_running / results.count_total if results.count_total else 1.0
+            p50, p99 = results.latency_p50, results.latency_p99
+            self.analyser_results = results
+        if isinstance(self.sender_thread, IsolatedThread):
+            variants = load_stream_variants(self.sender_thread.statdir, self.sender_thread.process_name)
+        else:
+            variants = self.sender_thread.stream_variants
+        self.bandwidth_results = analyse_bandwidth(self.sender_thread.stage_statistics, sender_statistics, variants)
+        print_bandwidth(self.bandwidth_results)
+        if isinstance(self.receiver_thread, IsolatedThread):
+            switch_statistics = self.receiver_thread.log_statistics("switches", SwitchStatistics)
+        elif isinstance(self.receiver_thread, ReceiverThread):
+            switch_statistics = self.receiver_thread.switch_statistics
+        else:
+            switch_statistics = []
+        if len(switch_statistics):
+            self.switch_results = analyse_switches(
+                switch_statistics,
+                self.receiver_thread.statistics,
+                sender_statistics,
+                self.receiver_thread.stage_statistics,
+                self.sender_thread.stage_statistics,
+                variants
+            )
+            print_switches(self.switch_results)
+        if args.abr == "viewport" and isinstance(self.receiver_thread, (ReceiverThread, IsolatedThread)):
+            self.viewport_results = analyse_viewport(self.sender_thread.stage_statistics, self.receiver_thread.stage_statistics, variants)
+            print_viewport(self.viewport_results)
+        if isinstance(self.receiver_thread, (ReceiverThread, IsolatedThread)):
+            self.tile_results, self.skew_results = analyse_tiles(
+                self.receiver_thread.statistics,
+                sender_statistics,
+                self.receiver_thread.stage_statistics,
+                self.sender_thread.stage_statistics,
+                variants
+            )
+            print_tiles(self.tile_results, self.skew_results)
+        bytes_pushed = sum(stage.nbytes for stage in self.sender_thread.stage_statistics if stage.stage == STAGE_PUSHED)
+        duration = sender_statistics[-1].sender_wallclock - sender_statistics[0].sender_wallclock if len(sender_statistics) > 1 else 0
+        time_to_mpd = self.time_to_mpd if self.time_to_mpd is not None else -1
+        time_to_first_frame = self.time_to_first_frame()
+        print(f"testlatency: startup: session={self.session}, time_to_mpd={time_to_mpd:.3f}, time_to_first_frame={time_to_first_frame:.3f}")
+        self.results = SessionResults(self.session, ok, len(sender_statistics), frames_received, loss, p50, p99, bytes_pushed, duration, time_to_mpd, time_to_first_frame)
+        return ok, self.results
+
+def _targets(thread : Any) -> List[Target]:
+    if isinstance(thread, IsolatedThread):
+        return [(thread.pid, None)] if thread.pid else []
+    return [(os.getpid(), thread.native_id)] if thread.native_id else []
+
+def analyse_sessions(args : argparse.Namespace, sessions : List[Session]) -> bool:
+    #
+    # Per-session results, relay throughput over all sessions, and isolation: a session whose p99
+    # is more than twice the median session p99, or that loses more than 10% of its frames,
+    # is reported as starved.
+    #
+    all_results : List[SessionResults] = []
+    for session in sessions:
+        print(f"testlatency: session {session.session}:")
+        all_results.append(session.analyse(args)[1])
+    duration = max((r.duration for r in all_results), default=0)
+    if duration > 0:
+        frames_per_second = sum(r.frames_received for r in all_results) / duration
+        megabytes_per_second = sum(r.bytes_pushed for r in all_results) / duration / 1e6
+        print(f"testlatency: relay: sessions={len(all_results)}, receive_fps={frames_per_second:.1f}, ingest_MBps={megabytes_per_second:.3f}")
+    median_p99 = statistics.median(r.latency_p99 for r in all_results) if all_results else 0
+    ok = True
+    for r in all_results:
+        starved = r.latency_p99 > 2 * median_p99 or r.loss > 0.1
+        print(f"testlatency: session {r.session}: frames_sent={r.frames_sent}, frames_received={r.frames_received}, loss={r.loss:.3f}, latency_p50={r.latency_p50:.3f}, latency_p99={r.latency_p99:.3f}, p99_vs_median={r.latency_p99 / median_p99 if median_p99 else 0:.2f}, starved={starved}")
+        ok = ok and r.ok and not starved
+    return ok
+
+def write_results(path : str, sessions : List[Session], time_to_listen : Optional[float] = None, capacity : Optional[CapacityResults] = None) -> None:
+    #
+    # Machine-readable results for testlatency_sweep.py: one row per analysed session, with the
+    # AnalyserResults of single-receiver sessions, the achieved throughput and the resource usage of the run.
+    #
+    rows = []
+    for session in sessions:
+        if session.results is None:
+            continue
+        row = session.results._asdict()
+        if session.analyser_results is not None:
+            row.update(session.analyser_results._asdict())
+        duration = session.results.duration
+        row["ingest_bitrate"] = session.results.bytes_pushed * 8 / duration if duration else 0
+        row["receive_fps"] = session.results.frames_received / duration if duration else 0
+        row["time_to_listen"] = time_to_listen if time_to_listen is not None else -1
+        row.update(bandwidth_columns(session.bandwidth_results))
+        row.update(switch_columns(session.switch_results))
+        if session.viewport_results is not None:
+            row.update(session.viewport_results._asdict())
+        row.update(tile_columns(session.tile_results, session.skew_results))
+        if capacity is not None:
+            row.update(capacity._asdict())
+        rows.append(row)
+    with open(path, "w") as fp:
+        json.dump(rows, fp, indent=2)
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import sys
+import threading
+import time
+from typing import Optional
+from testlatency_server import free_port
+
+#
+# Simulated constrained link between the receivers and the relay: a local TCP proxy that forwards
+# everything, and shapes the relay-to-receiver direction with one token bucket shared by all
+# connections, like a single access link. Receivers connect to the proxy port in stead of the relay.
+#
+
+class TokenBucket:
+    def __init__(self, rate : float, burst : int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def consume(self, nbytes : int) -> None:
+        # Connections are served in turn, so one big response cannot starve the others forever
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= nbytes:
+                    self.tokens -= nbytes
+                    return
+                await asyncio.sleep((nbytes - self.tokens) / self.rate)
+
+class ShaperThread(threading.Thread):
+    def __init__(self, listen_port : int, target_port : int, rate : float, burst : int = 65536, target_host : str = "127.0.0.1"):
+        super().__init__(daemon=True)
+        self.name = "testlatency.ShaperThread"
+        self.listen_port = listen_port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.rate = rate
+        self.burst = burst
+        self.loop : Optional[asyncio.AbstractEventLoop] = None
+        self.stop_event : Optional[asyncio.Event] = None
+        self.listening = threading.Event()
+        self.nbytes = 0
+        self.connections = 0
+
+    def stop(self):
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        bucket = TokenBucket(self.rate, self.burst)
+        server = await asyncio.start_server(lambda reader, writer: self._connection(reader, writer, bucket), "127.0.0.1", self.listen_port)
+        self.listening.set()
+        async with server:
+            await self.stop_event.wait()
+
+    async def _connection(self, client_reader : asyncio.StreamReader, client_writer : asyncio.StreamWriter, bucket : TokenBucket) -> None:
+        self.connections += 1
+        try:
+            relay_reader, relay_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError as e:
+            print(f"testlatency: shaper: cannot connect to relay: {e}", file=sys.stderr)
+            client_writer.close()
+            return
+        await asyncio.gather(
+            self._forward(client_reader, relay_writer, None),
+            self._forward(relay_reader, client_writer, bucket),
+        )
+
+    async def _forward(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, bucket : Optional[TokenBucket]) -> None:
+        # Never read more than the bucket can hold, or consume() would wait forever
+        chunk_size = min(65536, self.burst)
+        try:
+            while True:
+                data = await reader.read(chunk_size)
+                if not data:
+                    break
+                if bucket:
+                    await bucket.consume(len(data))
+                    self.nbytes += len(data)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+def start_shaper(args : argparse.Namespace) -> Optional[ShaperThread]:
+    # With --shape-rate: a proxy in front of the relay on a free port, for the receivers to use
+    if not args.shape_rate:
+        return None
+    shaper = ShaperThread(free_port(), args.port, args.shape_rate * 1e6 / 8, args.shape_burst)
+    shaper.start()
+    shaper.listening.wait(5)
+    if args.verbose:
+        print(f"testlatency: shaper: port {shaper.listen_port} to relay port {args.port} at {args.shape_rate} Mbps", file=sys.stderr)
+    return shaper
+
+def print_shaper(shaper : ShaperThread, duration : float) -> None:
+    mbps = shaper.nbytes * 8 / duration / 1e6 if duration > 0 else 0
+    print(f"testlatency: shaper: rate_Mbps={shaper.rate * 8 / 1e6:.3f}, delivered_Mbps={mbps:.3f}, utilization={mbps / (shaper.rate * 8 / 1e6):.2f}, connections={shaper.connections}")
@@ -0,0 +1,251 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+from typing import Any, Iterator, Optional
+from testlatency_recorder import FrameRecorder, StageRecorder
+
+#
+# Fixed-width binary statistics log, written through a shared memory map.
+#
+# Layout: a 256 byte header followed by `count` packed little-endian records.
+# The header holds the record count, record size, struct format, field names and
+# (for stage logs) the stage names. The record count is updated after every record,
+# so whatever was recorded before a crash or kill is still readable: the data lives
+# in the page cache as soon as it is stored. msync() happens once per flush interval
+# (one segment duration), for durability against machine crashes.
+#
+# The writer may remap the log to grow it while other threads read it, so the writer and live
+# readers (that follow a log while it is being written) copy what they need from the map under
+# a lock and never keep a view on it. A reader of a finished log maps it once and gives NumPy
+# columns as zero-copy views on the map.
+#
+MAGIC = b"LLDSTAT1"
+HEADER = struct.Struct("<8sQQ24s96s112s")
+COUNT_OFFSET = 8
+GROW_RECORDS = 65536
+# Records copied at a time when iterating
+ITER_RECORDS = 4096
+
+NUMPY_TYPES = {"q": "<i8", "Q": "<u8", "d": "<f8", "b": "i1"}
+
+class StatisticsLog:
+    #
+    # Read access, shared by the writer and the (read-only) reader.
+    #
+    def __init__(self, path : str, record_type : type):
+        self.path = path
+        self.record_type = record_type
+        self.fields : tuple[str, ...] = record_type._fields
+        self.labels : list[str] = []
+        self.record_struct = struct.Struct("<")
+        self._length = 0
+        self._mm : Optional[mmap.mmap] = None
+        # Held while reading from the map, and while closing or replacing it
+        self._map_lock = threading.Lock()
+        # The map is never replaced, so views on it may be handed out
+        self._fixed_map = False
+
+    def _set_format(self, fmt : str, labels : list[str]) -> None:
+        self.record_struct = struct.Struct("<" + fmt)
+        self.labels = labels
+
+    def _read_header(self) -> None:
+        assert self._mm is not None
+        magic, count, record_size, fmt, fields, labels = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path}: not a testlatency statistics log")
+        fields = fields.rstrip(b"\0").decode().split(",")
+        if tuple(fields) != self.fields:
+            raise ValueError(f"{self.path}: has fields {fields}, expected {list(self.fields)}")
+        labels = labels.rstrip(b"\0").decode()
+        self._set_format(fmt.rstrip(b"\0").decode(), labels.split(",") if labels else [])
+        assert self.record_struct.size == record_size
+        self._length = count
+
+    def _convert(self, row : tuple) -> Any:
+        if self.labels:
+            row = (row[0], self.labels[row[1]]) + row[2:]
+        return self.record_type(*row)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index : int) -> Any:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("statistics index out of range")
+        with self._map_lock:
+            assert self._mm is not None
+            row = self.record_struct.unpack_from(self._mm, HEADER.size + index * self.record_struct.size)
+        return self._convert(row)
+
+    def _copy(self, start : int, end : int) -> bytes:
+        # Records start up to end, copied out of the map
+        size = self.record_struct.size
+        with self._map_lock:
+            assert self._mm is not None
+            return self._mm[HEADER.size + start * size:HEADER.size + end * size]
+
+    def __iter__(self) -> Iterator[Any]:
+        length = self._length
+        for start in range(0, length, ITER_RECORDS):
+            for row in self.record_struct.iter_unpack(self._copy(start, min(length, start + ITER_RECORDS))):
+                yield self._convert(row)
+
+    def columns(self) -> dict[str, Any]:
+        # NumPy arrays on the map when it stays put, otherwise on one copy of the records for all columns
+        import numpy as np
+        dtype = np.dtype({
+            "names": list(self.fields),
+            "formats": [NUMPY_TYPES[code] for code in self.record_struct.format.lstrip("<")]
+        })
+        if self._fixed_map:
+            assert self._mm is not None
+            records = np.frombuffer(self._mm, dtype=dtype, count=self._length, offset=HEADER.size)
+        else:
+            records = np.frombuffer(self._copy(0, self._length), dtype=dtype)
+        return {field: records[field] for field in self.fields}
+
+class StatisticsLogReader(StatisticsLog):
+    #
+    # With `live` the log may still be written, and refresh() picks up what was added since.
+    #
+    def __init__(self, path : str, record_type : type, live : bool = False):
+        super().__init__(path, record_type)
+        with open(path, "rb") as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._fixed_map = not live
+        self._read_header()
+
+    def refresh(self) -> None:
+        # Pick up records appended by a writer that is still running
+        if self._fixed_map:
+            raise ValueError(f"{self.path}: not opened live, cannot refresh")
+        with self._map_lock:
+            assert self._mm is not None
+            count = struct.unpack_from("<Q", self._mm, COUNT_OFFSET)[0]
+            if HEADER.size + count * self.record_struct.size > len(self._mm):
+                # The writer has grown the file since we mapped it. Only then remap: nobody holds
+                # a view on the map, reads copy out of it under the same lock.
+                self._mm.close()
+                with open(self.path, "rb") as fp:
+                    self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._length = min(count, (len(self._mm) - HEADER.size) // self.record_struct.size)
+
+    def close(self) -> None:
+        with self._map_lock:
+            if self._mm is not None:
+                try:
+                    self._mm.close()
+                except BufferError:
+                    # Columns still refer to the map, it is unmapped once they are gone
+                    pass
+                self._mm = None
+
+class StatisticsLogWriter(StatisticsLog):
+    def __init__(self, path : str, record_type : type, fmt : str, labels : Optional[list[str]] = None, flush_interval : float = 1.0):
+        super().__init__(path, record_type)
+        self._set_format(fmt, labels or [])
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        self._fp = open(path, "w+b")
+        self._capacity = 0
+        self._map(GROW_RECORDS)
+        HEADER.pack_into(self._mm, 0, MAGIC, 0, self.record_struct.size, fmt.encode(), ",".join(self.fields).encode(), ",".join(self.labels).encode())
+
+    def _map(self, capacity : int) -> None:
+        with self._map_lock:
+            if self._mm is not None:
+                self._mm.close()
+            self._fp.truncate(HEADER.size + capacity * self.record_struct.size)
+            self._mm = mmap.mmap(self._fp.fileno(), 0)
+            self._capacity = capacity
+
+    def _append(self, wallclock : float, *row : Any) -> None:
+        n = self._length
+        if n == self._capacity:
+            self._map(self._capacity + GROW_RECORDS)
+        assert self._mm is not None
+        self.record_struct.pack_into(self._mm, HEADER.size + n * self.record_struct.size, *row)
+        self._length = n + 1
+        struct.pack_into("<Q", self._mm, COUNT_OFFSET, self._length)
+        if wallclock - self.last_flush >= self.flush_interval:
+            self._mm.flush()
+            self.last_flush = wallclock
+
+    def append_packed(self, wallclock : float, data : bytes) -> None:
+        # Whole records, already packed in our record format (from testlatency_collector)
+        n = len(data) // self.record_struct.size
+        assert n * self.record_struct.size == len(data)
+        while self._length + n > self._capacity:
+            self._map(self._capacity + GROW_RECORDS)
+        assert self._mm is not None
+        offset = HEADER.size + self._length * self.record_struct.size
+        self._mm[offset:offset + len(data)] = data
+        self._length += n
+        struct.pack_into("<Q", self._mm, COUNT_OFFSET, self._length)
+        if wallclock - self.last_flush >= self.flush_interval:
+            self._mm.flush()
+            self.last_flush = wallclock
+
+    def close(self) -> None:
+        #
+        # Trim the preallocated tail and reopen read-only, so the log can still be analysed.
+        #
+        if self._fp.closed:
+            return
+        with self._map_lock:
+            assert self._mm is not None
+            self._mm.flush()
+            self._mm.close()
+            self._fp.truncate(HEADER.size + self._length * self.record_struct.size)
+            self._fp.close()
+            with open(self.path, "rb") as fp:
+                self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+class FrameLogWriter(StatisticsLogWriter):
+    def __init__(self, path : str, record_type : type, flush_interval : float = 1.0):
+        super().__init__(path, record_type, "qdqq", flush_interval=flush_interval)
+
+    def record(self, timestamp : int, wallclock : float, num : int, count : int) -> None:
+        self._append(wallclock, timestamp, wallclock, num, count)
+
+class StageLogWriter(StatisticsLogWriter):
+    def __init__(self, path : str, record_type : type, stages : list[str], flush_interval : float = 1.0):
+        super().__init__(path, record_type, "qbqdq", labels=stages, flush_interval=flush_interval)
+        self.stage_index = {stage: i for i, stage in enumerate(stages)}
+        self.lock = threading.Lock()
+
+    def record(self, timestamp : int, stage : str, tile : int, wallclock : float, nbytes : int) -> None:
+        # Hops are reported from several threads
+        with self.lock:
+            self._append(wallclock, timestamp, self.stage_index[stage], tile, wallclock, nbytes)
+
+def statistics_log_path(logdir : str, name : str) -> str:
+    return os.path.join(logdir, f"testlatency_{name}.stats")
+
+def frame_recorder(args : argparse.Namespace, name : str, record_type : type) -> Any:
+    #
+    # With --collector statistics are kept in memory and streamed to a collector process,
+    # with --logdir they are streamed to a log file, otherwise kept in memory.
+    #
+    if args.collector:
+        from testlatency_collector import CollectorFrameRecorder
+        return CollectorFrameRecorder(args.collector, name, record_type, _flush_interval(args))
+    if not args.logdir:
+        return FrameRecorder(record_type)
+    return FrameLogWriter(statistics_log_path(args.logdir, name), record_type, _flush_interval(args))
+
+def stage_recorder(args : argparse.Namespace, name : str, record_type : type, stages : list[str]) -> Any:
+    if args.collector:
+        from testlatency_collector import CollectorStageRecorder
+        return CollectorStageRecorder(args.collector, name, record_type, stages, _flush_interval(args))
+    if not args.logdir:
+        return StageRecorder(record_type, stages)
+    return StageLogWriter(statistics_log_path(args.logdir, name), record_type, stages, _flush_interval(args))
+
+def _flush_interval(args : argparse.Namespace) -> float:
+    return args.seg_dur / 1000.0 if args.seg_dur else 1.0
@@ -0,0 +1,142 @@
+import array
+import statistics
+from typing import Iterable, List, NamedTuple, Optional
+
+class SteadyStateEvent(NamedTuple):
+    index : int
+    kind : str
+    value : float
+    reason : str
+
+EVENT_WARMUP_END = "warmup_end"
+EVENT_REGIME_CHANGE = "regime_change"
+EVENT_SPIKE = "spike"
+
+class SteadyStateDetector:
+    #
+    # Incremental steady state detection on a latency series, by windowed median convergence.
+    # Samples are grouped in consecutive windows of `window` samples. Warm-up has ended when the
+    # medians of two consecutive windows agree within tolerance; it ends at the first run of
+    # `window // 3` samples that all lie within tolerance of the steady state median.
+    # After warm-up, a window median that stays out of tolerance for `regime_windows` windows
+    # is a regime change (a new baseline), and a single sample above `spike_factor` times the
+    # baseline is a spike. Medians make this insensitive to outliers and to run length.
+    # The analysers and the join benchmark run it after the fact, on the latencies against the
+    # sender wallclocks, which a receiver does not have while it runs. add() processes each
+    # window as soon as it is complete, for a series that is fed as it comes in.
+    #
+    def __init__(self, window : int = 30, tolerance : float = 0.1, absolute_tolerance : float = 0.005, spike_factor : float = 1.5, regime_windows : int = 2):
+        self.window = window
+        self.tolerance = tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.spike_factor = spike_factor
+        self.regime_windows = regime_windows
+        self.values = array.array('d')
+        self.processed = 0
+        self.previous_median : Optional[float] = None
+        self.baseline : Optional[float] = None
+        self.warmup_end : Optional[int] = None
+        self.reason = ""
+        self.events : List[SteadyStateEvent] = []
+        self.deviating : List[tuple[int, float]] = []
+
+    def _within(self, value : float, reference : float) -> bool:
+        return abs(value - reference) <= self.tolerance * reference + self.absolute_tolerance
+
+    def add(self, value : float) -> None:
+        self.values.append(value)
+        if len(self.values) - self.processed >= self.window:
+            self._process()
+
+    def extend(self, values : Iterable[float]) -> None:
+        self.values.extend(values)
+        self._process()
+
+    def _process(self) -> None:
+        while len(self.values) - self.processed >= self.window:
+            self._window(self.processed, self.processed + self.window)
+            self.processed += self.window
+
+    def _window(self, start : int, end : int) -> None:
+        median = statistics.median(self.values[start:end])
+        if self.warmup_end is None:
+            if self.previous_median is not None and self._within(median, self.previous_median):
+                self._converged(start - self.window, end)
+            else:
+                self.previous_median = median
+            return
+        self._spikes(start, end)
+        assert self.baseline is not None
+        if self._within(median, self.baseline):
+            self.deviating = []
+            return
+        self.deviating.append((start, median))
+        if len(self.deviating) >= self.regime_windows:
+            first = self.deviating[0][0]
+            new_baseline = statistics.median(m for _, m in self.deviating)
+            self.events.append(SteadyStateEvent(first, EVENT_REGIME_CHANGE, new_baseline,
+                f"median latency moved from {self.baseline:.3f} to {new_baseline:.3f} for {len(self.deviating)} windows of {self.window} samples"))
+            self.baseline = new_baseline
+            self.deviating = []
+
+    def _converged(self, start : int, end : int) -> None:
+        baseline = statistics.median(self.values[start:end])
+        run = max(1, self.window // 3)
+        warmup_end = start
+        in_run = 0
+        for index in range(end):
+            if self._within(self.values[index], baseline):
+                in_run += 1
+                if in_run == run:
+                    warmup_end = index - run + 1
+                    break
+            else:
+                in_run = 0
+        self.baseline = baseline
+        self.warmup_end = warmup_end
+        self.reason = f"medians of samples {start}-{start + self.window - 1} and {start + self.window}-{end - 1} agree at {baseline:.3f}, first {run} samples within tolerance start at {warmup_end}"
+        self.events.append(SteadyStateEvent(warmup_end, EVENT_WARMUP_END, baseline, self.reason))
+        self._spikes(warmup_end, end)
+
+    def _spikes(self, start : int, end : int) -> None:
+        assert self.baseline is not None
+        limit = self.baseline * self.spike_factor
+        if start >= end or max(self.values[start:end]) <= limit:
+            return
+        for index in range(start, end):
+            value = self.values[index]
+            if value > limit:
+                self.events.append(SteadyStateEvent(index, EVENT_SPIKE, value, f"{value:.3f} is more than {self.spike_factor} times the baseline {self.baseline:.3f}"))
+
+    def finish(self) -> int:
+        #
+        # End of the series: returns the warm-up end index. Short series are retried with a smaller
+        # window; if there is still no convergence nothing is treated as warm-up.
+        #
+        n = len(self.values)
+        if self.warmup_end is None and n >= 8 and max(4, n // 4) < self.window:
+            retry = SteadyStateDetector(max(4, n // 4), self.tolerance, self.absolute_tolerance, self.spike_factor, self.regime_windows)
+            retry.extend(self.values)
+            retry.finish()
+            if retry.warmup_end is not None and retry.events:
+                # Take over its findings, but keep our own window for any later add()
+                self.warmup_end = retry.warmup_end
+                self.reason = retry.reason
+                self.events = retry.events
+                self.baseline = retry.baseline
+                self.deviating = []
+                self.processed = n
+                return retry.warmup_end
+        if self.warmup_end is None:
+            self.warmup_end = 0
+            self.reason = f"no two consecutive windows of {self.window} samples agree within tolerance in {n} samples, nothing ignored"
+        elif self.processed < n:
+            self._spikes(self.processed, n)
+            self.processed = n
+        return self.warmup_end
+
+    def regime_changes(self) -> List[SteadyStateEvent]:
+        return [event for event in self.events if event.kind == EVENT_REGIME_CHANGE]
+
+    def spikes(self) -> List[SteadyStateEvent]:
+        return [event for event in self.events if event.kind == EVENT_SPIKE]
@@ -0,0 +1,230 @@
+import sys
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import time
+from typing import Any, List
+
+#
+# Parameter sweep over testlatency.py: run every combination of a parameter grid, cache the
+# results of each completed point so an interrupted sweep resumes where it stopped, and write
+# one results table with the parameters, the analysis results and the throughput of every point.
+#
+#   python testlatency_sweep.py --grid seg_dur=100,500,1000 --grid octree_bits=8,10 -- --duration 10
+#
+# Boolean flags such as --tiled take the values true/false.
+#
+# --compare shows the effect of one parameter with everything else fixed. For example the bias
+# that running sender and receiver as threads in one interpreter adds at high load:
+#
+#   python testlatency_sweep.py --grid isolation=thread,process --grid fps=15,30,60 --grid npoints=10000,100000 --compare isolation -- --duration 20
+#
+
+TESTLATENCY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testlatency.py")
+
+def parse_grid(specs : List[str]) -> dict[str, List[str]]:
+    grid : dict[str, List[str]] = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        if not sep or not values:
+            raise ValueError(f"grid parameter must be name=value,value,...: {spec}")
+        grid[name.lstrip("-")] = values.split(",")
+    return grid
+
+def point_arguments(point : dict[str, str]) -> List[str]:
+    arguments : List[str] = []
+    for name, value in point.items():
+        option = "--" + name
+        if value.lower() in ("true", "false"):
+            if value.lower() == "true":
+                arguments.append(option)
+        else:
+            arguments += [option, value]
+    return arguments
+
+# Options of testlatency.py that fix a port: concurrent runs would all try to listen on it
+PORT_OPTIONS = ["port", "metrics-port", "clock-sync-port"]
+
+def fixed_ports(base_arguments : List[str], grid : dict[str, List[str]]) -> List[str]:
+    # The PORT_OPTIONS that the fixed arguments or the grid set to a port other than 0
+    fixed : List[str] = []
+    for name in PORT_OPTIONS:
+        option = "--" + name
+        values = list(grid.get(name, []))
+        for i, argument in enumerate(base_arguments):
+            if argument == option and i + 1 < len(base_arguments):
+                values.append(base_arguments[i + 1])
+            elif argument.startswith(option + "="):
+                values.append(argument[len(option) + 1:])
+        if any(value != "0" for value in values):
+            fixed.append(option)
+    return fixed
+
+def point_key(point : dict[str, str], base_arguments : List[str]) -> str:
+    # Same parameters and same fixed arguments give the same cache entry
+    description = json.dumps([sorted(point.items()), base_arguments])
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+def run_point(point : dict[str, str], base_arguments : List[str], cachedir : str, repetition : int, run_arguments : List[str]) -> dict[str, Any]:
+    # run_arguments do not influence the results (such as the relay port), so they are not part of the cache key
+    key = point_key(point, base_arguments)
+    cachefile = os.path.join(cachedir, f"{key}_{repetition}.json")
+    if os.path.exists(cachefile):
+        with open(cachefile) as fp:
+            return json.load(fp)
+    logdir = os.path.join(cachedir, f"{key}_{repetition}")
+    os.makedirs(logdir, exist_ok=True)
+    results_file = os.path.join(logdir, "results.json")
+    command = [sys.executable, TESTLATENCY] + base_arguments + point_arguments(point) + run_arguments + ["--results", results_file]
+    start = time.time()
+    with open(os.path.join(logdir, "testlatency.log"), "w") as log:
+        exit_status = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(TESTLATENCY))
+    rows : List[dict[str, Any]] = []
+    if os.path.exists(results_file):
+        with open(results_file) as fp:
+            rows = json.load(fp)
+    entry = {
+        "point": point,
+        "repetition": repetition,
+        "exit_status": exit_status,
+        "wallclock": time.time() - start,
+        "rows": rows,
+    }
+    if rows:
+        # Only completed points are cached, failed ones are retried when the sweep is resumed
+        with open(cachefile + ".tmp", "w") as fp:
+            json.dump(entry, fp, indent=2)
+        os.replace(cachefile + ".tmp", cachefile)
+    return entry
+
+def write_table(path : str, entries : List[dict[str, Any]], parameters : List[str]) -> None:
+    table : List[dict[str, Any]] = []
+    for entry in entries:
+        for row in entry["rows"] or [{}]:
+            table.append({**entry["point"], "repetition": entry["repetition"], "exit_status": entry["exit_status"], **row})
+    columns = parameters + ["repetition", "exit_status"]
+    for row in table:
+        columns += [column for column in row if column not in columns]
+    with open(path, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(table)
+
+def pareto_front(entries : List[dict[str, Any]], x : str, y : str) -> List[dict[str, Any]]:
+    #
+    # Rows for which no other row is at least as good in both x and y (lower is better).
+    # Failed or missing figures are stored as -1 and would beat every real one, so those rows are left out.
+    #
+    def valid(row : dict[str, Any]) -> bool:
+        return all(isinstance(row.get(column), (int, float)) and row[column] >= 0 for column in (x, y))
+    rows = [{**entry["point"], **row} for entry in entries for row in entry["rows"] if valid(row)]
+    front = []
+    for row in rows:
+        dominated = any(
+            other[x] <= row[x] and other[y] <= row[y] and (other[x] < row[x] or other[y] < row[y])
+            for other in rows
+        )
+        if not dominated:
+            front.append(row)
+    return sorted(front, key=lambda row: row[x])
+
+def compare(entries : List[dict[str, Any]], parameter : str, columns : List[str]) -> List[dict[str, Any]]:
+    #
+    # Group the rows on all parameters but `parameter`, average the columns over repetitions
+    # and sessions, and give the difference of every value of `parameter` with its first value.
+    #
+    groups : dict[str, dict[str, dict[str, List[float]]]] = {}
+    others : dict[str, dict[str, str]] = {}
+    values : List[str] = []
+    for entry in entries:
+        point = entry["point"]
+        value = point[parameter]
+        if value not in values:
+            values.append(value)
+        rest = {name: v for name, v in point.items() if name != parameter}
+        key = json.dumps(sorted(rest.items()))
+        others[key] = rest
+        group = groups.setdefault(key, {})
+        for row in entry["rows"]:
+            for column in columns:
+                if column in row:
+                    group.setdefault(value, {}).setdefault(column, []).append(row[column])
+    result = []
+    for key, group in groups.items():
+        if values[0] not in group:
+            continue
+        reference = {column: sum(v) / len(v) for column, v in group[values[0]].items()}
+        for value in values[1:]:
+            if value not in group:
+                continue
+            means = {column: sum(v) / len(v) for column, v in group[value].items()}
+            row : dict[str, Any] = {**others[key], parameter: value}
+            for column in columns:
+                if column in means and column in reference:
+                    row[column] = means[column]
+                    row[f"{column}_delta"] = means[column] - reference[column]
+            result.append(row)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Run testlatency.py over a parameter grid.", epilog="Arguments after -- are passed to every testlatency.py run.")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...", help="Parameter to sweep, with its values (repeatable). NAME is a testlatency.py option without the dashes.")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N", help="Run N points concurrently, each with its own relay on a free port (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N", help="Run every point N times (default: 1)")
+    parser.add_argument("--cachedir", type=str, default="testlatency_sweep", metavar="DIR", help="Directory for cached point results and logs (default: testlatency_sweep)")
+    parser.add_argument("--output", type=str, default="", metavar="FILE", help="Results table, CSV (default: results.csv in --cachedir)")
+    parser.add_argument("--pareto", type=str, default="latency_p50,ingest_bitrate", metavar="X,Y", help="Print the Pareto front over these two result columns, lower is better (default: latency_p50,ingest_bitrate)")
+    parser.add_argument("--compare", type=str, default="", metavar="NAME", help="Print the difference each value of grid parameter NAME makes, relative to its first value, with the other parameters fixed")
+    parser.add_argument("--compare-columns", type=str, default="latency_p50,latency_p99,receive_fps", metavar="C1,C2,...", help="Result columns for --compare (default: latency_p50,latency_p99,receive_fps)")
+    args, base_arguments = parser.parse_known_args()
+    if base_arguments and base_arguments[0] == "--":
+        base_arguments = base_arguments[1:]
+    grid = parse_grid(args.grid)
+    if args.compare and args.compare not in grid:
+        print(f"testlatency: sweep: --compare {args.compare} is not a --grid parameter", file=sys.stderr)
+        return 2
+    run_arguments : List[str] = []
+    if args.jobs > 1:
+        fixed = fixed_ports(base_arguments, grid)
+        if fixed:
+            print(f"testlatency: sweep: --jobs {args.jobs} cannot be used with {', '.join(fixed)}: concurrent runs would use the same port", file=sys.stderr)
+            return 2
+        # Concurrent runs each need their own relay
+        run_arguments = ["--port", "0"]
+    os.makedirs(args.cachedir, exist_ok=True)
+    parameters = list(grid.keys())
+    points = [dict(zip(parameters, values)) for values in itertools.product(*grid.values())]
+    work = [(point, repetition) for point in points for repetition in range(args.repeat)]
+    print(f"testlatency: sweep: {len(points)} points, {len(work)} runs, {args.jobs} concurrent", file=sys.stderr)
+    entries : List[dict[str, Any]] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run_point, point, base_arguments, args.cachedir, repetition, run_arguments): (point, repetition) for point, repetition in work}
+        for future in concurrent.futures.as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            status = "ok" if entry["rows"] else f"failed (exit status {entry['exit_status']})"
+            print(f"testlatency: sweep: {len(entries)}/{len(work)}: {point_arguments(entry['point'])}: {status}", file=sys.stderr)
+    # Keep the table in grid order, not completion order
+    order = {point_key(point, base_arguments): i for i, point in enumerate(points)}
+    entries.sort(key=lambda entry: (order[point_key(entry["point"], base_arguments)], entry["repetition"]))
+    output = args.output or os.path.join(args.cachedir, "results.csv")
+    write_table(output, entries, parameters)
+    print(f"testlatency: sweep: results in {output}")
+    x, _, y = args.pareto.partition(",")
+    for row in pareto_front(entries, x, y):
+        print(f"testlatency: sweep: pareto: {point_arguments({p: row[p] for p in parameters})}: {x}={row[x]}, {y}={row[y]}")
+    if args.compare:
+        reference = grid[args.compare][0]
+        for row in compare(entries, args.compare, args.compare_columns.split(",")):
+            others = {p: row[p] for p in parameters if p != args.compare}
+            deltas = ", ".join(f"{column}={row[column]:.3f} ({row[column + '_delta']:+.3f})" for column in args.compare_columns.split(",") if column in row)
+            print(f"testlatency: sweep: compare: {point_arguments(others)}: {args.compare}={row[args.compare]} vs {reference}: {deltas}")
+    return 0 if all(entry["rows"] for entry in entries) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import statistics
+import sys
+from typing import Any, Dict, List, NamedTuple
+from testlatency_bandwidth import StreamVariant
+from testlatency_probes import STAGE_PUSHED, STAGE_FETCHED
+
+#
+# Cost of quality switches on tiled streams. The receiver records every select_tile_quality()
+# call. Which quality a fetched tile buffer has is found by matching its size against the sizes
+# the sender pushed for that frame and tile, one per quality: the relay delivers the encoded
+# buffers unchanged. When several qualities of a frame and tile have the same size (always with
+# --uncompressed) the quality of such a buffer is unknown. Per switch, all select_tile_quality()
+# calls at the same moment, we report how long until all switched tiles arrive at their new
+# quality, the frames lost or delivered twice, the latency spike and the longest delivery stall.
+#
+
+class SwitchStatistics(NamedTuple):
+    # Same layout as the frame statistics (qdqq), so it can use the frame recorders and logs
+    tile : int
+    switch_wallclock : float
+    from_quality : int
+    to_quality : int
+
+class SwitchResults(NamedTuple):
+    switch : int
+    wallclock : float
+    from_quality : int  # -1 when the tiles switched between different qualities
+    to_quality : int  # -1 when the tiles switched to different qualities
+    transitions : str  # tile:from->to for every switched tile
+    tiles : int
+    tiles_converged : int
+    time_to_new_quality : float
+    frames_lost : int
+    frames_duplicated : int
+    latency_before : float
+    latency_peak : float
+    latency_spike : float
+    stall : float
+    frame_interval : float
+
+# Frames before the switch that give the baseline latency and frame interval
+BASELINE_FRAMES = 30
+# Frames this long after convergence still count towards the switch (latency spike, stall, loss)
+SETTLE = 1.0
+# Without convergence, look this long after the switch
+DEFAULT_SETTLE = 2.0
+
+def fetched_qualities(sender_stages : Any, receiver_stages : Any, variants : List[StreamVariant]) -> Dict[tuple[int, int], int]:
+    # (timestamp, tile) of every fetched tile buffer, to the quality index it was encoded at
+    quality_of_stream : Dict[int, tuple[int, int]] = {}
+    per_tile : Dict[int, int] = {}
+    for variant in variants:
+        quality_of_stream[variant.stream] = (variant.tile, per_tile.get(variant.tile, 0))
+        per_tile[variant.tile] = per_tile.get(variant.tile, 0) + 1
+    sizes : Dict[tuple[int, int, int], set[int]] = {}
+    for stage in sender_stages:
+        if stage.stage == STAGE_PUSHED and stage.tile in quality_of_stream:
+            tile, quality = quality_of_stream[stage.tile]
+            sizes.setdefault((stage.timestamp, tile, stage.nbytes), set()).add(quality)
+    result = {}
+    for stage in receiver_stages:
+        if stage.stage == STAGE_FETCHED:
+            qualities = sizes.get((stage.timestamp, stage.tile, stage.nbytes))
+            # More than one quality of this size: could be either
+            if qualities is not None and len(qualities) == 1:
+                result[(stage.timestamp, stage.tile)] = next(iter(qualities))
+    return result
+
+def analyse_switches(switch_statistics : Any, receiver_statistics : Any, sender_statistics : Any, receiver_stages : Any, sender_stages : Any, variants : List[StreamVariant], offset : float = 0) -> List[SwitchResults]:
+    #
+    # `offset` is added to receiver wallclocks to get sender time, as in the Analyser.
+    #
+    events : Dict[float, List[SwitchStatistics]] = {}
+    for event in switch_statistics:
+        events.setdefault(event.switch_wallclock, []).append(event)
+    if not events:
+        return []
+    sender_wallclocks = {send.timestamp: send.sender_wallclock for send in sender_statistics}
+    sent_timestamps = sorted(sender_wallclocks)
+    frames = list(receiver_statistics)
+    qualities = fetched_qualities(sender_stages, receiver_stages, variants)
+    fetch_wallclocks : Dict[tuple[int, int], float] = {}
+    for stage in receiver_stages:
+        if stage.stage == STAGE_FETCHED:
+            fetch_wallclocks.setdefault((stage.timestamp, stage.tile), stage.wallclock)
+    released = {}
+    for recv in frames:
+        released.setdefault(recv.timestamp, recv.receiver_wallclock)
+    results = []
+    for index, wallclock in enumerate(sorted(events)):
+        tile_events = events[wallclock]
+        #
+        # Convergence: per tile the first frame, released after the switch, whose tile has the new quality
+        #
+        converged = []
+        for event in tile_events:
+            arrivals = [
+                released.get(timestamp, fetch_wallclock)
+                for (timestamp, tile), fetch_wallclock in fetch_wallclocks.items()
+                if tile == event.tile and fetch_wallclock > wallclock and qualities.get((timestamp, tile)) == event.to_quality
+            ]
+            if arrivals:
+                converged.append(min(arrivals) - wallclock)
+        time_to_new_quality = max(converged) if len(converged) == len(tile_events) else -1
+        end = wallclock + (time_to_new_quality + SETTLE if time_to_new_quality >= 0 else DEFAULT_SETTLE)
+        #
+        # Baseline before the switch, and what happened between the switch and a while after convergence
+        #
+        before = [recv for recv in frames if recv.receiver_wallclock <= wallclock][-BASELINE_FRAMES:]
+        gaps_before = [b.receiver_wallclock - a.receiver_wallclock for a, b in zip(before, before[1:])]
+        frame_interval = statistics.median(gaps_before) if gaps_before else 0
+        latencies_before = [recv.receiver_wallclock + offset - sender_wallclocks[recv.timestamp] for recv in before if recv.timestamp in sender_wallclocks]
+        latency_before = statistics.median(latencies_before) if latencies_before else -1
+        during = [recv for recv in frames if wallclock < recv.receiver_wallclock <= end]
+        latencies_during = [recv.receiver_wallclock + offset - sender_wallclocks[recv.timestamp] for recv in during if recv.timestamp in sender_wallclocks]
+        latency_peak = max(latencies_during, default=-1)
+        # The stall runs from the last frame before the switch, through the frames during it, up to the next frame after it
+        after = [recv for recv in frames if recv.receiver_wallclock > end][:1]
+        delivery = [recv.receiver_wallclock for recv in before[-1:] + during + after]
+        stall = max((b - a for a, b in zip(delivery, delivery[1:])), default=0)
+        # Lost: sent between the last frame before and the first frame after the window, but never delivered in it
+        first = before[-1].timestamp if before else (during[0].timestamp if during else None)
+        last = after[0].timestamp if after else (during[-1].timestamp if during else None)
+        frames_lost = 0
+        if first is not None and last is not None:
+            delivered = set(recv.timestamp for recv in during)
+            frames_lost = sum(1 for timestamp in sent_timestamps if first < timestamp < last and timestamp not in delivered)
+        seen = set(recv.timestamp for recv in before)
+        frames_duplicated = 0
+        for recv in during:
+            if recv.timestamp in seen:
+                frames_duplicated += 1
+            seen.add(recv.timestamp)
+        from_qualities = set(event.from_quality for event in tile_events)
+        to_qualities = set(event.to_quality for event in tile_events)
+        results.append(SwitchResults(
+            index,
+            wallclock,
+            from_qualities.pop() if len(from_qualities) == 1 else -1,
+            to_qualities.pop() if len(to_qualities) == 1 else -1,
+            ",".join(f"{event.tile}:{event.from_quality}->{event.to_quality}" for event in tile_events),
+            len(tile_events),
+            len(converged),
+            time_to_new_quality,
+            frames_lost,
+            frames_duplicated,
+            latency_before,
+            latency_peak,
+            latency_peak - latency_before if latency_peak >= 0 and latency_before >= 0 else 0,
+            stall,
+            frame_interval,
+        ))
+    return results
+
+def print_switches(results : List[SwitchResults]) -> None:
+    for r in results:
+        if r.from_quality >= 0 and r.to_quality >= 0:
+            quality = f"{r.from_quality}->{r.to_quality}"
+        else:
+            quality = f"mixed {r.transitions}"
+        print(f"testlatency: switch {r.switch}: quality {quality}, tiles={r.tiles}, converged={r.tiles_converged}, time_to_new_quality={r.time_to_new_quality:.3f}, frames_lost={r.frames_lost}, frames_duplicated={r.frames_duplicated}, latency_before={r.latency_before:.3f}, latency_peak={r.latency_peak:.3f}, latency_spike={r.latency_spike:.3f}, stall={r.stall:.3f}, frame_interval={r.frame_interval:.3f}")
+    if not results:
+        return
+    converged = [r.time_to_new_quality for r in results if r.time_to_new_quality >= 0]
+    print(f"testlatency: switches: count={len(results)}, unconverged={len(results) - len(converged)}, time_to_new_quality_max={max(converged, default=-1):.3f}, frames_lost={sum(r.frames_lost for r in results)}, frames_duplicated={sum(r.frames_duplicated for r in results)}, latency_spike_max={max(r.latency_spike for r in results):.3f}, stall_max={max(r.stall for r in results):.3f}")
+    if len(converged) < len(results) and not any(r.tiles_converged for r in results):
+        print("testlatency: switches: no tile was seen at its new quality, are the sender stage statistics and stream variants available?", file=sys.stderr)
+
+def switch_columns(results : List[SwitchResults]) -> Dict[str, Any]:
+    if not results:
+        return {}
+    converged = [r.time_to_new_quality for r in results if r.time_to_new_quality >= 0]
+    return {
+        "switches": len(results),
+        "switch_time_max": max(converged, default=-1),
+        "switch_frames_lost": sum(r.frames_lost for r in results),
+        "switch_frames_duplicated": sum(r.frames_duplicated for r in results),
+        "switch_latency_spike_max": max(r.latency_spike for r in results),
+        "switch_stall_max": max(r.stall for r in results),
+    }
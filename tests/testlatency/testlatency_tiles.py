@@ -0,0 +1,164 @@
+import collections
+from typing import Any, Dict, List, NamedTuple, Optional
+from testlatency_bandwidth import StreamVariant
+from testlatency_histogram import LatencyHistogram
+from testlatency_probes import STAGE_FETCHED, STAGE_READY, STAGE_DECODED
+from testlatency_switches import fetched_qualities
+
+#
+# Per-tile view of tiled streams. The synchronizer only releases a frame once every tile is
+# decoded, so the frame latency is that of its slowest tile. Per tile we report the latency from
+# capture until its decoder had it ready, and the decode time from fetched to ready. Per frame
+# the skew between the first and the last tile, separately for arriving from the relay (fetched
+# hop) and for decoding (ready hop), and which tile (at which quality) is most often the last one
+# to be decoded: the bottleneck of the synchronizer. The decoded hop, when the synchronizer took
+# a tile, follows the order in which the synchronizer asks for them and is not used for this.
+# Logs without the ready hop fall back to the decoded hop.
+#
+
+class TileResults(NamedTuple):
+    tile : int
+    count : int
+    latency_p50 : float
+    latency_p90 : float
+    latency_p99 : float
+    latency_max : float
+    decode_p50 : float
+    decode_p99 : float
+    count_last_arrived : int
+    count_last_ready : int
+
+class SkewResults(NamedTuple):
+    frames : int
+    arrival_skew_p50 : float
+    arrival_skew_p99 : float
+    arrival_skew_max : float
+    ready_skew_p50 : float
+    ready_skew_p99 : float
+    ready_skew_max : float
+    release_wait_p50 : float
+    release_wait_p99 : float
+    bottleneck_tile : int
+    bottleneck_quality : int  # -1 when unknown
+    bottleneck_fraction : float
+    arrival_bottleneck_tile : int
+    arrival_bottleneck_fraction : float
+
+def _per_frame(stages : Any, stage_name : str, offset : float) -> Dict[int, Dict[int, float]]:
+    frames : Dict[int, Dict[int, float]] = {}
+    for stage in stages:
+        if stage.stage == stage_name:
+            frames.setdefault(stage.timestamp, {}).setdefault(stage.tile, stage.wallclock + offset)
+    return frames
+
+def analyse_tiles(receiver_statistics : Any, sender_statistics : Any, receiver_stages : Any, sender_stages : Any = None, variants : Optional[List[StreamVariant]] = None, offset : float = 0) -> tuple[List[TileResults], Optional[SkewResults]]:
+    #
+    # Release wait is from the last ready tile to the frame release by the synchronizer.
+    # `offset` is added to receiver wallclocks, as in the Analyser.
+    #
+    receiver_stages = list(receiver_stages)
+    sender_wallclocks = {send.timestamp: send.sender_wallclock for send in sender_statistics}
+    released = {}
+    for recv in receiver_statistics:
+        released.setdefault(recv.timestamp, recv.receiver_wallclock + offset)
+    fetched = _per_frame(receiver_stages, STAGE_FETCHED, offset)
+    ready = _per_frame(receiver_stages, STAGE_READY, offset) or _per_frame(receiver_stages, STAGE_DECODED, offset)
+    tiles = sorted(set(tile for frame in ready.values() for tile in frame))
+    if len(tiles) < 2:
+        return [], None
+    qualities = fetched_qualities(sender_stages, receiver_stages, variants) if sender_stages is not None and variants else {}
+    latencies = {tile: LatencyHistogram() for tile in tiles}
+    decodes = {tile: LatencyHistogram() for tile in tiles}
+    arrival_skews = LatencyHistogram()
+    ready_skews = LatencyHistogram()
+    release_waits = LatencyHistogram()
+    last_arrived : collections.Counter = collections.Counter()
+    last_ready : collections.Counter = collections.Counter()
+    last_qualities : collections.Counter = collections.Counter()
+    frames = 0
+    for timestamp, frame in ready.items():
+        captured = sender_wallclocks.get(timestamp)
+        arrivals = fetched.get(timestamp, {})
+        for tile, wallclock in frame.items():
+            if captured is not None:
+                latencies[tile].record(max(0.0, wallclock - captured))
+            if tile in arrivals:
+                decodes[tile].record(max(0.0, wallclock - arrivals[tile]))
+        if len(frame) < len(tiles):
+            # Incomplete frame: the synchronizer did not release it, or we missed a hop
+            continue
+        frames += 1
+        last_tile = max(frame, key=lambda tile: frame[tile])
+        last_ready[last_tile] += 1
+        last_qualities[(last_tile, qualities.get((timestamp, last_tile), -1))] += 1
+        ready_skews.record(max(0.0, frame[last_tile] - min(frame.values())))
+        if len(arrivals) == len(tiles):
+            last_arrival = max(arrivals, key=lambda tile: arrivals[tile])
+            last_arrived[last_arrival] += 1
+            arrival_skews.record(max(0.0, arrivals[last_arrival] - min(arrivals.values())))
+        if timestamp in released:
+            release_waits.record(max(0.0, released[timestamp] - frame[last_tile]))
+    results = [
+        TileResults(
+            tile,
+            latencies[tile].count,
+            latencies[tile].percentile(0.5),
+            latencies[tile].percentile(0.9),
+            latencies[tile].percentile(0.99),
+            latencies[tile].max if latencies[tile].count else 0,
+            decodes[tile].percentile(0.5),
+            decodes[tile].percentile(0.99),
+            last_arrived[tile],
+            last_ready[tile],
+        )
+        for tile in tiles
+    ]
+    if not frames:
+        return results, None
+    (bottleneck_tile, bottleneck_quality), count = last_qualities.most_common(1)[0]
+    arrival_tile, arrival_count = last_arrived.most_common(1)[0] if last_arrived else (-1, 0)
+    skew = SkewResults(
+        frames,
+        arrival_skews.percentile(0.5),
+        arrival_skews.percentile(0.99),
+        arrival_skews.max if arrival_skews.count else 0,
+        ready_skews.percentile(0.5),
+        ready_skews.percentile(0.99),
+        ready_skews.max,
+        release_waits.percentile(0.5),
+        release_waits.percentile(0.99),
+        bottleneck_tile,
+        bottleneck_quality,
+        count / frames,
+        arrival_tile,
+        arrival_count / arrival_skews.count if arrival_skews.count else 0,
+    )
+    return results, skew
+
+def print_tiles(results : List[TileResults], skew : Optional[SkewResults]) -> None:
+    if not results:
+        return
+    print(f"testlatency: {'tile':<6} {'count':>6} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'dec_p50':>7} {'dec_p99':>7} {'last_in':>7} {'last_rd':>7}")
+    for r in results:
+        print(f"testlatency: {r.tile:<6} {r.count:>6} {r.latency_p50:>7.3f} {r.latency_p90:>7.3f} {r.latency_p99:>7.3f} {r.latency_max:>7.3f} {r.decode_p50:>7.3f} {r.decode_p99:>7.3f} {r.count_last_arrived:>7} {r.count_last_ready:>7}")
+    if skew:
+        quality = skew.bottleneck_quality if skew.bottleneck_quality >= 0 else "unknown"
+        print(f"testlatency: tile skew: frames={skew.frames}, arrival_skew_p50={skew.arrival_skew_p50:.3f}, arrival_skew_p99={skew.arrival_skew_p99:.3f}, arrival_skew_max={skew.arrival_skew_max:.3f}, ready_skew_p50={skew.ready_skew_p50:.3f}, ready_skew_p99={skew.ready_skew_p99:.3f}, ready_skew_max={skew.ready_skew_max:.3f}, release_wait_p50={skew.release_wait_p50:.3f}, release_wait_p99={skew.release_wait_p99:.3f}")
+        print(f"testlatency: tile skew: bottleneck tile={skew.bottleneck_tile}, quality={quality}, last decoded in {100 * skew.bottleneck_fraction:.1f}% of frames; last to arrive tile={skew.arrival_bottleneck_tile} in {100 * skew.arrival_bottleneck_fraction:.1f}% of frames")
+
+def tile_columns(results : List[TileResults], skew : Optional[SkewResults]) -> Dict[str, Any]:
+    if skew is None:
+        return {}
+    return {
+        "tile_latency_p99_max": max(r.latency_p99 for r in results),
+        "tile_latency_p99_min": min(r.latency_p99 for r in results),
+        "tile_arrival_skew_p50": skew.arrival_skew_p50,
+        "tile_arrival_skew_p99": skew.arrival_skew_p99,
+        "tile_ready_skew_p50": skew.ready_skew_p50,
+        "tile_ready_skew_p99": skew.ready_skew_p99,
+        "tile_release_wait_p99": skew.release_wait_p99,
+        "tile_bottleneck": skew.bottleneck_tile,
+        "tile_bottleneck_quality": skew.bottleneck_quality,
+        "tile_bottleneck_fraction": skew.bottleneck_fraction,
+        "tile_arrival_bottleneck": skew.arrival_bottleneck_tile,
+    }
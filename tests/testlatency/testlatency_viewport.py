@@ -0,0 +1,219 @@
+import argparse
+import csv
+import math
+import statistics
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional
+from testlatency_abr import AbrController
+from testlatency_bandwidth import StreamVariant
+from testlatency_probes import STAGE_PUSHED, STAGE_FETCHED, STAGE_DECODED
+from testlatency_switches import fetched_qualities
+
+#
+# Viewport-aware quality selection: tiles facing the viewer get the highest quality, the others
+# the lowest. The viewer moves along a recorded trajectory (--viewport-trajectory) or orbits the
+# point cloud (--viewport-orbit). A tile faces the viewer when the angle between its normal (from
+# the tile info the sender publishes) and the direction towards the viewer is below --viewport-angle.
+# The analysis compares the bytes fetched and the fetch-to-decode time with what selecting the
+# highest quality for every tile would have cost.
+#
+
+Vector = tuple[float, float, float]
+
+def _normalize(v : Vector) -> Vector:
+    length = math.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    return (v[0] / length, v[1] / length, v[2] / length) if length > 0 else (0.0, 0.0, 0.0)
+
+class OrbitViewport:
+    # Viewer circling the point cloud around the vertical (y) axis, once every `period` seconds
+    def __init__(self, period : float, elevation : float = 0):
+        self.period = period
+        self.elevation = math.radians(elevation)
+
+    def position(self, t : float) -> Vector:
+        angle = 2 * math.pi * t / self.period
+        return _normalize((
+            math.cos(self.elevation) * math.sin(angle),
+            math.sin(self.elevation),
+            math.cos(self.elevation) * math.cos(angle),
+        ))
+
+class TrajectoryViewport:
+    #
+    # Recorded viewer positions relative to the point cloud centre: CSV lines of time,x,y,z
+    # (a header line is allowed). Positions are interpolated, the trajectory loops.
+    #
+    def __init__(self, path : str):
+        self.samples : List[tuple[float, Vector]] = []
+        with open(path, newline="") as fp:
+            for row in csv.reader(fp):
+                try:
+                    t, x, y, z = (float(value) for value in row[:4])
+                except ValueError:
+                    continue
+                self.samples.append((t, (x, y, z)))
+        if not self.samples:
+            raise ValueError(f"{path}: no time,x,y,z samples")
+        self.samples.sort()
+
+    def position(self, t : float) -> Vector:
+        first, last = self.samples[0][0], self.samples[-1][0]
+        if last > first:
+            t = first + (t - first) % (last - first)
+        previous = self.samples[0]
+        for sample in self.samples:
+            if sample[0] >= t:
+                span = sample[0] - previous[0]
+                f = (t - previous[0]) / span if span > 0 else 1
+                return _normalize(tuple(a + f * (b - a) for a, b in zip(previous[1], sample[1])))  # type: ignore
+            previous = sample
+        return _normalize(self.samples[-1][1])
+
+def tile_normals(description : Any, args : argparse.Namespace) -> List[Vector]:
+    #
+    # Normals of the published tiles, from the multisource description when it carries them.
+    # Otherwise from the tile info of the synthetic source, filtered like the sender does:
+    # with the same --fps, --npoints and --tiles it has the same tiles.
+    #
+    normals : List[Vector] = []
+    try:
+        for tile in description:
+            normal = tile[0].get("normal") if isinstance(tile[0], dict) else None
+            if normal is None:
+                normals = []
+                break
+            normals.append((float(normal["x"]), float(normal["y"]), float(normal["z"])))
+    except (IndexError, KeyError, TypeError):
+        normals = []
+    if normals:
+        return normals
+    import cwipc
+    source = cwipc.cwipc_synthetic(args.fps, args.npoints)
+    try:
+        tileinfo = [source.get_tileinfo_dict(i) for i in range(source.maxtile())]
+    finally:
+        source.free()
+    normals = [
+        (float(info["normal"]["x"]), float(info["normal"]["y"]), float(info["normal"]["z"]))
+        for info in tileinfo if info["cameraMask"] != 0
+    ]
+    return normals[:args.tiles] if args.tiles else normals
+
+class ViewportController(AbrController):
+    def __init__(self, n_tile : int, n_quality : int, order : Optional[List[int]], normals : List[Vector], viewport : Any, angle : float = 90, interval : float = 0.2):
+        super().__init__(n_tile, n_quality, order)
+        self.normals = [_normalize(normal) for normal in normals]
+        self.viewport = viewport
+        self.cos_angle = math.cos(math.radians(angle))
+        self.interval = interval
+        self.start : Optional[float] = None
+        self.next_update = 0.0
+
+    def visible(self, tile : int, viewer : Vector) -> bool:
+        if tile >= len(self.normals) or self.normals[tile] == (0.0, 0.0, 0.0):
+            # No direction: a tile for all cameras, always visible
+            return True
+        normal = self.normals[tile]
+        return normal[0] * viewer[0] + normal[1] * viewer[1] + normal[2] * viewer[2] >= self.cos_angle
+
+    def decide(self, now : float) -> Dict[int, int]:
+        if self.start is None:
+            self.start = now
+        if now < self.next_update:
+            return {}
+        self.next_update = now + self.interval
+        viewer = self.viewport.position(now - self.start)
+        decision = {}
+        for tile in range(self.n_tile):
+            level = self.n_quality - 1 if self.visible(tile, viewer) else 0
+            if level != self.level[tile]:
+                decision[tile] = self.order[level]
+        return decision
+
+def create_viewport_controller(args : argparse.Namespace, n_tile : int, n_quality : int, order : Optional[List[int]], description : Any) -> ViewportController:
+    viewport : Any
+    if args.viewport_trajectory:
+        viewport = TrajectoryViewport(args.viewport_trajectory)
+    else:
+        viewport = OrbitViewport(args.viewport_orbit)
+    normals = tile_normals(description, args)
+    if len(normals) != n_tile:
+        print(f"testlatency: viewport: {len(normals)} tile normals for {n_tile} tiles", file=sys.stderr)
+    return ViewportController(n_tile, n_quality, order, normals, viewport, args.viewport_angle)
+
+class ViewportResults(NamedTuple):
+    tile_frames : int
+    tile_frames_top_quality : int
+    bytes_fetched : int
+    bytes_uniform : int
+    bytes_saved : float
+    decode_time : float
+    decode_time_uniform : float
+    decode_time_saved : float
+
+def analyse_viewport(sender_stages : Any, receiver_stages : Any, variants : List[StreamVariant]) -> Optional[ViewportResults]:
+    #
+    # The uniform alternative is every tile at the top quality: the quality with the most bytes
+    # per tile. Its bytes are what the sender pushed for that tile and frame at the top quality,
+    # its fetch-to-decode time the mean of that tile (or all tiles) when fetched at the top quality.
+    #
+    stream_of : Dict[tuple[int, int], int] = {}
+    per_tile : Dict[int, int] = {}
+    for variant in variants:
+        stream_of[(variant.tile, per_tile.get(variant.tile, 0))] = variant.stream
+        per_tile[variant.tile] = per_tile.get(variant.tile, 0) + 1
+    pushed : Dict[tuple[int, int], int] = {}
+    quality_bytes : Dict[int, List[int]] = {}
+    quality_of_stream = {stream: quality for (tile, quality), stream in stream_of.items()}
+    for stage in sender_stages:
+        if stage.stage == STAGE_PUSHED and stage.tile in quality_of_stream:
+            pushed[(stage.timestamp, stage.tile)] = stage.nbytes
+            quality_bytes.setdefault(quality_of_stream[stage.tile], []).append(stage.nbytes)
+    if len(quality_bytes) < 2:
+        return None
+    top = max(quality_bytes, key=lambda quality: statistics.mean(quality_bytes[quality]))
+    qualities = fetched_qualities(sender_stages, receiver_stages, variants)
+    fetched : Dict[tuple[int, int], tuple[float, int]] = {}
+    decode_times : Dict[tuple[int, int], float] = {}
+    for stage in receiver_stages:
+        key = (stage.timestamp, stage.tile)
+        if stage.stage == STAGE_FETCHED:
+            fetched.setdefault(key, (stage.wallclock, stage.nbytes))
+        elif stage.stage == STAGE_DECODED and key in fetched:
+            decode_times.setdefault(key, stage.wallclock - fetched[key][0])
+    top_times : Dict[int, List[float]] = {}
+    for key, decode_time in decode_times.items():
+        if qualities.get(key) == top:
+            top_times.setdefault(key[1], []).append(decode_time)
+    all_top_times = [t for times in top_times.values() for t in times]
+    bytes_fetched = bytes_uniform = 0
+    decode_time = decode_time_uniform = 0.0
+    n_top = 0
+    for (timestamp, tile), (_, nbytes) in fetched.items():
+        top_stream = stream_of.get((tile, top))
+        bytes_fetched += nbytes
+        bytes_uniform += pushed.get((timestamp, top_stream), nbytes) if top_stream is not None else nbytes
+        measured = decode_times.get((timestamp, tile), 0)
+        decode_time += measured
+        if qualities.get((timestamp, tile)) == top:
+            n_top += 1
+            decode_time_uniform += measured
+        else:
+            times = top_times.get(tile) or all_top_times
+            decode_time_uniform += statistics.mean(times) if times else measured
+    return ViewportResults(
+        len(fetched),
+        n_top,
+        bytes_fetched,
+        bytes_uniform,
+        1 - bytes_fetched / bytes_uniform if bytes_uniform else 0,
+        decode_time,
+        decode_time_uniform,
+        1 - decode_time / decode_time_uniform if decode_time_uniform else 0,
+    )
+
+def print_viewport(results : Optional[ViewportResults]) -> None:
+    if results is None:
+        print("testlatency: viewport: needs at least two qualities and the sender stage statistics", file=sys.stderr)
+        return
+    print(f"testlatency: viewport: tile_frames={results.tile_frames}, top_quality={results.tile_frames_top_quality}, MB_fetched={results.bytes_fetched / 1e6:.3f}, MB_uniform={results.bytes_uniform / 1e6:.3f}, bytes_saved={results.bytes_saved:.3f}, decode_seconds={results.decode_time:.3f}, decode_seconds_uniform={results.decode_time_uniform:.3f}, decode_time_saved={results.decode_time_saved:.3f}")